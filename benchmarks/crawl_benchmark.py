@@ -0,0 +1,222 @@
+# Crawls a generated site graph end to end, against a local fake cache
+# server (benchmarks/fake_cache.py) run in its own process, in a temporary
+# directory, with config.ini and the changes given with --set. Reports
+# pages/sec, the CPU time of every stage of the crawl, the peak RSS and the
+# growth of the frontier during the crawl.
+#
+#     python -m benchmarks.crawl_benchmark [--hosts 20] [--pages_per_host 100] [--latency 0.01]
+#         [--politeness 0.01] [--set "LOCAL PROPERTIES.THREADCOUNT=8"] [--max_seconds 600]
+#
+# Stage times are thread CPU time, so they do not count waiting for the
+# server or for the frontier, and they are inclusive: process includes
+# parse, filter and frontier. With PARSEPROCESSES the parsing CPU is spent
+# in the children, parse then only shows the cost of handing pages over.
+# Stages are only timed in thread mode.
+import contextlib
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from functools import wraps
+
+import crawler
+import crawler.async_worker
+import crawler.worker
+import scraper
+from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.worker import Worker
+from benchmarks import fake_cache
+from utils.config import Config
+from utils.robots import RobotsCache
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.ini")
+
+
+class StageTimes(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = dict()
+        self.cpu = dict()
+        self.patched = []
+
+    def wrap(self, owner, attribute, stage):
+        # Times every call of owner.attribute as stage, until restore()
+        function = getattr(owner, attribute)
+        self.calls.setdefault(stage, 0)
+        self.cpu.setdefault(stage, 0.0)
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                spent = time.thread_time() - start
+                with self.lock:
+                    self.calls[stage] += 1
+                    self.cpu[stage] += spent
+
+        self.patched.append((owner, attribute, function))
+        setattr(owner, attribute, timed)
+
+    def restore(self):
+        for owner, attribute, function in reversed(self.patched):
+            setattr(owner, attribute, function)
+        self.patched = []
+
+
+def instrument(stages):
+    stages.wrap(crawler.worker, "download", "fetch")
+    # Only counted, the coroutine runs after the call returns
+    stages.wrap(crawler.async_worker, "async_download", "fetch")
+    stages.wrap(RobotsCache, "lookup", "robots")
+    stages.wrap(Worker, "process_response", "process")
+    stages.wrap(Crawler, "analyze_page", "parse")
+    stages.wrap(scraper, "is_valid_many", "filter")
+    for method in ("add_urls", "get_tbd_url", "release_url", "mark_url_complete"):
+        stages.wrap(Frontier, method, "frontier")
+
+
+def pool_usage(pool):
+    # CPU seconds and largest peak RSS in KB of the processes of a parse
+    # pool, read from /proc. They are children of the forkserver, so
+    # RUSAGE_CHILDREN does not see them.
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = 0.0
+    peak = 0
+    for pid in list(pool._processes):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rpartition(")")[2].split()
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak, int(line.split()[1]))
+        except OSError:
+            continue
+        # utime and stime, fields 14 and 15 of stat
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+    return cpu, peak
+
+
+def sample_growth(crawl, stages, start, interval, samples, stopped):
+    # (seconds, pages fetched, urls seen, urls waiting) every interval
+    while not stopped.wait(interval):
+        frontier = crawl.frontier
+        samples.append((
+            time.perf_counter() - start, stages.calls["fetch"],
+            len(frontier.save), len(frontier.save.pendingUrls)))
+
+
+def make_config(args, cacheServer, graph):
+    cparser = ConfigParser()
+    cparser.read(CONFIG)
+    cparser["CRAWLER"]["SEEDURL"] = ",".join(graph.seed_urls())
+    cparser["CRAWLER"]["POLITENESS"] = str(args.politeness)
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        section, _, option = key.rpartition(".")
+        cparser[section][option] = value
+    config = Config(cparser)
+    config.cache_server = cacheServer
+    return config
+
+
+def main():
+    argParser = ArgumentParser()
+    fake_cache.add_arguments(argParser)
+    argParser.add_argument("--politeness", type=float, default=0.01)
+    argParser.add_argument("--set", action="append", default=[],
+                           help='a config.ini change, "SECTION.KEY=VALUE"')
+    argParser.add_argument("--max_seconds", type=float, default=600)
+    argParser.add_argument("--sample_interval", type=float, default=1.0)
+    argParser.add_argument("--keep", action="store_true", default=False,
+                           help="keep the crawl directory, with its logs")
+    args = argParser.parse_args()
+
+    graph = fake_cache.graph_from_arguments(args)
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    server = context.Process(target=fake_cache.serve, args=(args, 0, ready), daemon=True)
+    server.start()
+    cacheServer = ("127.0.0.1", ready.get(timeout=30))
+
+    workDir = tempfile.mkdtemp(prefix="crawl_benchmark_")
+    cwd = os.getcwd()
+    os.chdir(workDir)
+    stages = StageTimes()
+    instrument(stages)
+    parsers = [0.0, 0]
+    closeCrawler = Crawler.close
+
+    def close(crawl):
+        # The parser processes are gone once the crawler is closed
+        if crawl.parsePool is not None and os.path.exists("/proc"):
+            parsers[:] = pool_usage(crawl.parsePool)
+        closeCrawler(crawl)
+
+    Crawler.close = close
+    samples = []
+    stopped = threading.Event()
+    try:
+        # The crawler logs every page to the console, keep that in the crawl directory
+        with open("console.log", "w") as console, \
+                contextlib.redirect_stdout(console), contextlib.redirect_stderr(console):
+            config = make_config(args, cacheServer, graph)
+            cpuStart = time.process_time()
+            start = time.perf_counter()
+            crawl = Crawler(config, True)
+            startup = time.perf_counter() - start
+            sampler = threading.Thread(
+                target=sample_growth, args=(crawl, stages, start, args.sample_interval, samples, stopped),
+                daemon=True)
+            sampler.start()
+            timer = threading.Timer(args.max_seconds, crawl.frontier.stop)
+            timer.start()
+            crawl.start()
+            timer.cancel()
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpuStart
+            stopped.set()
+            sampler.join()
+        pageCount = crawl.report.pageCount
+    finally:
+        Crawler.close = closeCrawler
+        stages.restore()
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Crawl directory: {workDir}")
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+        server.terminate()
+
+    fetched = stages.calls["fetch"]
+    print(f"Site graph: {args.hosts} hosts x {args.pages_per_host} pages, "
+          f"latency {args.latency * 1000:.0f} ms, politeness {args.politeness} s, "
+          f"{config.threads_count} threads, mode {config.crawl_mode}, "
+          f"{config.parse_processes} parser processes")
+    print(f"Fetched {fetched} urls, {pageCount} unique pages, in {elapsed:.2f} s "
+          f"(startup {startup:.2f} s): {fetched / elapsed:.1f} pages/sec")
+    print(f"CPU: {cpu:.2f} s in the crawler process, {parsers[0]:.2f} s in parser processes")
+    # ru_maxrss is in kilobytes on Linux
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB crawler, "
+          f"{parsers[1] / 1024:.1f} MB largest parser process")
+    if config.crawl_mode == "thread":
+        print(f"{'stage':10} {'calls':>8} {'cpu s':>8} {'ms/call':>8}")
+        for stage, calls in stages.calls.items():
+            spent = stages.cpu[stage]
+            print(f"{stage:10} {calls:8} {spent:8.2f} {spent * 1000 / calls if calls else 0:8.3f}")
+    print(f"{'seconds':>8} {'fetched':>8} {'seen':>8} {'waiting':>8}")
+    for seconds, fetchedThen, seen, waiting in samples:
+        print(f"{seconds:8.1f} {fetchedThen:8} {seen:8} {waiting:8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# A local stand-in for the cache server, so a whole crawl can be measured
+# without the network. It answers GET /?q=<url>&u=<agent> like the real
+# one, with a cbor map holding the status and a pickled requests.Response
+# (see utils/download.py and utils/response.py), for the pages of a
+# generated site graph:
+#
+# - `hosts` subdomains of ics.uci.edu with `pagesPerHost` pages each, of
+#   about `pageWords` words drawn from a Zipf distributed vocabulary, with
+#   `linksPerPage` links (a share of them to other hosts)
+# - exact and near duplicate pages (`duplicates` of the pages)
+# - traps on a share of the pages (`traps`): calendar links the url filter
+#   rejects, and a chain of short pages `trapDepth` long that it does not
+# - `facets` links per page to a faceted search, whose results are the same
+#   page whatever the filter and sort order
+# - robots.txt disallowing /private, with a sitemap of every page of the host
+#
+# Every answer waits `latency` seconds plus up to `jitter` more.
+#
+#     python -m benchmarks.fake_cache [--port 9000] [--hosts 20] [--latency 0.01] ...
+import pickle
+import random
+import time
+
+from argparse import ArgumentParser
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import accumulate
+from urllib.parse import urlparse, parse_qs
+
+import cbor
+import requests
+
+
+class SiteGraph(object):
+    def __init__(self, hosts=20, pagesPerHost=100, pageWords=600, linksPerPage=10,
+                 crossHostLinks=0.2, duplicates=0.05, traps=0.02, trapDepth=20,
+                 facets=0, sitemaps=True, vocabulary=5000, seed=0):
+        self.hosts = ["www.ics.uci.edu"] + [f"site{number}.ics.uci.edu" for number in range(1, hosts)]
+        self.hostSet = frozenset(self.hosts)
+        self.pagesPerHost = pagesPerHost
+        self.pageWords = pageWords
+        self.linksPerPage = linksPerPage
+        self.crossHostLinks = crossHostLinks
+        self.duplicates = duplicates
+        self.traps = traps
+        self.trapDepth = trapDepth
+        self.facets = facets
+        self.sitemaps = sitemaps
+        self.seed = seed
+
+        rng = random.Random(seed)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        self.words = ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+                      for _ in range(vocabulary)]
+        self.cumulativeWeights = list(accumulate(1 / rank for rank in range(1, vocabulary + 1)))
+
+    def seed_urls(self):
+        return [f"https://{host}" for host in self.hosts]
+
+    def _rng(self, host, number):
+        return random.Random(f"{self.seed}:{host}:{number}")
+
+    def _text(self, host, number):
+        rng = self._rng(host, number)
+        if rng.random() < self.duplicates and number > 0:
+            # Same text as an earlier page of the host, or nearly
+            text = self._text(host, rng.randrange(number))
+            if rng.random() < 0.5:
+                return text
+            return [self.words[0] if rng.random() < 0.02 else word for word in text]
+        count = rng.randint(self.pageWords // 2, self.pageWords * 3 // 2)
+        return rng.choices(self.words, cum_weights=self.cumulativeWeights, k=count)
+
+    def _page(self, host, number):
+        rng = self._rng(host, -number - 1)
+        links = []
+        for _ in range(self.linksPerPage):
+            target = host
+            if rng.random() < self.crossHostLinks:
+                target = rng.choice(self.hosts)
+            links.append(f"https://{target}/page/{rng.randrange(self.pagesPerHost)}")
+        if number % 10 == 0:
+            links.append(f"/private/{number}")
+        if rng.random() < self.traps:
+            links.append(f"/calendar/2024-01-{rng.randint(1, 28):02}")
+            links.append("/trap/1")
+        for _ in range(self.facets):
+            links.append(f"/search?filter={rng.randrange(1000)}&sort={rng.choice(('date', 'name', 'size'))}")
+        text = self._text(host, number)
+        paragraphs = "".join(
+            "<p>" + " ".join(text[start:start + 100]) + "</p>\n" for start in range(0, len(text), 100))
+        anchors = "".join(f'<li><a href="{link}">{link}</a></li>\n' for link in links)
+        return (
+            f"<html><head><title>{host} page {number}</title></head><body>\n"
+            f"<h1>Page {number}</h1>\n{paragraphs}<ul>\n{anchors}</ul></body></html>").encode()
+
+    def _trap(self, host, depth):
+        # Pages that only lead to one more page like them
+        nextLink = f'<a href="/trap/{depth + 1}">next</a>' if depth < self.trapDepth else ""
+        return f"<html><body><p>Entry {depth}</p>{nextLink}</body></html>".encode()
+
+    def _search(self, host):
+        # Every filter and sort order gives the same results
+        text = self._text(host, 0)
+        paragraphs = "".join(
+            "<p>" + " ".join(text[start:start + 100]) + "</p>\n" for start in range(0, len(text), 100))
+        return f"<html><head><title>Search</title></head><body>\n{paragraphs}</body></html>".encode()
+
+    def _robots(self, host):
+        body = "User-agent: *\nDisallow: /private\n"
+        if self.sitemaps:
+            body += f"Sitemap: https://{host}/sitemap.xml\n"
+        return body.encode()
+
+    def _sitemap(self, host):
+        locs = "".join(
+            f"<url><loc>https://{host}/page/{number}</loc></url>" for number in range(self.pagesPerHost))
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{locs}</urlset>').encode()
+
+    def get(self, url):
+        # Returns (status, content type, body) for url
+        parsed = urlparse(url)
+        host = parsed.hostname
+        path = parsed.path.rstrip("/") or "/page/0"
+        if host not in self.hostSet:
+            return 404, "text/html", b""
+        if path == "/robots.txt":
+            return 200, "text/plain", self._robots(host)
+        if path == "/sitemap.xml" and self.sitemaps:
+            return 200, "application/xml", self._sitemap(host)
+        if path == "/search" and self.facets:
+            return 200, "text/html", self._search(host)
+        kind, _, number = path[1:].partition("/")
+        if not number.isdigit():
+            return 404, "text/html", b""
+        number = int(number)
+        if kind == "page" and number < self.pagesPerHost:
+            return 200, "text/html", self._page(host, number)
+        if kind == "trap" and 0 < number <= self.trapDepth:
+            return 200, "text/html", self._trap(host, number)
+        if kind in ("private", "calendar"):
+            return 200, "text/html", self._page(host, number % self.pagesPerHost)
+        return 404, "text/html", b""
+
+
+def encode_response(url, status, contentType, body):
+    # What the cache server sends back for url
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body
+    resp.url = url
+    resp.encoding = "utf-8"
+    resp.headers["Content-Type"] = contentType
+    resp.headers["Content-Length"] = str(len(body))
+    return cbor.dumps({"url": url, "status": status, "response": pickle.dumps(resp)})
+
+
+def make_server(graph, address=("127.0.0.1", 0), latency=0.0, jitter=0.0, cacheSize=10000):
+    # A cache server for graph, call serve_forever() on it
+    answer = lru_cache(maxsize=cacheSize)(lambda url: encode_response(url, *graph.get(url)))
+    jitterRng = random.Random(graph.seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            if "q" not in query:
+                self.send_error(400)
+                return
+            delay = latency + jitterRng.uniform(0, jitter) if jitter else latency
+            if delay:
+                time.sleep(delay)
+            body = answer(query["q"][0])
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(address, Handler)
+    server.daemon_threads = True
+    return server
+
+
+def add_arguments(argParser):
+    # The site graph and server options, shared with crawl_benchmark
+    argParser.add_argument("--hosts", type=int, default=20)
+    argParser.add_argument("--pages_per_host", type=int, default=100)
+    argParser.add_argument("--page_words", type=int, default=600)
+    argParser.add_argument("--links_per_page", type=int, default=10)
+    argParser.add_argument("--duplicates", type=float, default=0.05)
+    argParser.add_argument("--traps", type=float, default=0.02)
+    argParser.add_argument("--facets", type=int, default=0)
+    argParser.add_argument("--no_sitemaps", action="store_true", default=False)
+    argParser.add_argument("--latency", type=float, default=0.01)
+    argParser.add_argument("--jitter", type=float, default=0.0)
+    argParser.add_argument("--seed", type=int, default=0)
+
+
+def graph_from_arguments(args):
+    return SiteGraph(
+        hosts=args.hosts, pagesPerHost=args.pages_per_host, pageWords=args.page_words,
+        linksPerPage=args.links_per_page, duplicates=args.duplicates, traps=args.traps,
+        facets=args.facets, sitemaps=not args.no_sitemaps, seed=args.seed)
+
+
+def serve(args, port, ready=None):
+    # Runs a server for the graph of args, in this process
+    server = make_server(graph_from_arguments(args), ("127.0.0.1", port), args.latency, args.jitter)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def main():
+    argParser = ArgumentParser()
+    argParser.add_argument("--port", type=int, default=9000)
+    add_arguments(argParser)
+    args = argParser.parse_args()
+    print(f"Serving {args.hosts * args.pages_per_host} pages on 127.0.0.1:{args.port}")
+    serve(args, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Compares the old CRC16 exact duplicate check with utils.fingerprint on
+# speed (MB/s of page text) and on false duplicates between distinct pages.
+#
+#     python -m benchmarks.fingerprint_benchmark [--pages 50000]
+import random
+import time
+
+from argparse import ArgumentParser
+from benchmarks.parser_benchmark import large_publication_list
+from utils.fingerprint import content_fingerprint
+from utils.parsers import Bs4Parser
+
+
+def cyclic_redundancy_check(pageData):
+    # The pure Python CRC16 that scraper.checkDuplicate used before
+    crcHash = 0xFFFF
+    for byte in pageData.encode():
+        crcHash ^= byte
+        for _ in range(8):
+            if crcHash & 0x0001:
+                crcHash = (crcHash >> 1) ^ 0xA001
+            else:
+                crcHash >>= 1
+    return crcHash ^ 0xFFFF
+
+
+def megabytes_per_second(function, text, seconds=1.0):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function(text)
+        count += 1
+    return count * len(text.encode()) / (time.perf_counter() - start) / 1e6
+
+
+def false_duplicates(function, pages):
+    seen = set()
+    duplicates = 0
+    for text in pages:
+        value = function(text)
+        duplicates += value in seen
+        seen.add(value)
+    return duplicates
+
+
+def main():
+    argParser = ArgumentParser()
+    argParser.add_argument("--pages", type=int, default=50000)
+    args = argParser.parse_args()
+
+    text = Bs4Parser().parse_html(large_publication_list())[0]
+    print(f"400 KB page text, {len(text.encode()) / 1024:.0f} KB:")
+    for name, function in [("crc16", cyclic_redundancy_check), ("fingerprint", content_fingerprint)]:
+        print(f"  {name:12} {megabytes_per_second(function, text):10.2f} MB/s")
+
+    # Small distinct pages, like the short pages of a crawl
+    rng = random.Random(0)
+    pages = [f"page {number} " + " ".join(str(rng.random()) for _ in range(20))
+             for number in range(args.pages)]
+    print(f"False duplicates among {args.pages} distinct pages:")
+    for name, function in [("crc16", cyclic_redundancy_check), ("fingerprint", content_fingerprint)]:
+        print(f"  {name:12} {false_duplicates(function, pages):10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Checks that crawler/store.py FrontierStore gives back the urls still to
+# download after a crash, a compaction or a restart from a checkpoint.
+#
+#     python -m benchmarks.frontier_store_check
+#
+# Every check runs on its own log in a temporary folder, with random 64-bit
+# url ids like the ones url_id gives.
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from crawler.store import FrontierStore
+
+
+def make_items(count):
+    return [(random.getrandbits(64), f"https://www.ics.uci.edu/page{index}") for index in range(count)]
+
+
+def log_lines(path):
+    with open(path, "rb") as f:
+        return f.read().splitlines()
+
+
+def check_group_commit(folder):
+    # Adds wait in memory until commitBatch of them are waiting or sync is called
+    path = os.path.join(folder, "frontier.log")
+    store = FrontierStore(path, commitInterval=60, commitBatch=100, checkpointInterval=0)
+    problems = []
+    store.add_many(make_items(10))
+    time.sleep(0.2)
+    if os.path.getsize(path):
+        problems.append("10 adds were written before the batch was full")
+    store.add_many(make_items(90))
+    deadline = time.monotonic() + 5
+    while len(log_lines(path)) < 100 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if len(log_lines(path)) != 100:
+        problems.append(f"a full batch of 100 left {len(log_lines(path))} records in the log")
+    store.add_many(make_items(5))
+    store.sync()
+    if len(log_lines(path)) != 105:
+        problems.append(f"sync left {len(log_lines(path))} records in the log instead of 105")
+    store.close()
+    return problems
+
+
+def check_torn_record(folder):
+    # A record cut short by a crash is dropped, the ones before it are kept
+    path = os.path.join(folder, "frontier.log")
+    items = make_items(200)
+    store = FrontierStore(path, checkpointInterval=0)
+    store.add_many(items)
+    store.complete_many([urlId for urlId, _ in items[:50]])
+    store.close()
+    os.remove(path + ".checkpoint")
+    goodSize = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b'["a", 12345, "https://www.ics.uci.edu/tor')
+
+    store = FrontierStore(path, checkpointInterval=0)
+    problems = []
+    if store.fromCheckpoint:
+        problems.append("loaded a checkpoint that was removed")
+    if sorted(store.pending_urls()) != sorted(url for _, url in items[50:]):
+        problems.append(f"{len(store.pending_urls())} urls pending instead of 150")
+    if len(store) != 200 or 12345 in store:
+        problems.append(f"{len(store)} urls seen instead of 200")
+    if os.path.getsize(path) != goodSize:
+        problems.append("the torn record was not cut off the log")
+    # The next records land after the good ones, not glued to the torn one
+    store.add(42, "https://www.ics.uci.edu/after")
+    store.close()
+    os.remove(path + ".checkpoint")
+    store = FrontierStore(path, checkpointInterval=0)
+    if "https://www.ics.uci.edu/after" not in store.pending_urls() or len(store) != 201:
+        problems.append("a record written after the torn one was lost")
+    store.close()
+    return problems
+
+
+def check_compaction(folder):
+    # Once the log holds more than compactRatio records per url it is
+    # rewritten with one record per url, with the same state
+    path = os.path.join(folder, "frontier.log")
+    items = make_items(300)
+    store = FrontierStore(path, compactRatio=1, compactMinimum=100, checkpointInterval=0)
+    store.add_many(items)
+    store.sync()
+    store.complete_many([urlId for urlId, _ in items[:200]])
+    store.remove(items[200][0])
+    store.sync()
+    problems = []
+    if len(log_lines(path)) != 300:
+        problems.append(f"{len(log_lines(path))} records after the compaction instead of 300")
+    store.add(7, "https://www.ics.uci.edu/late")
+    store.close()
+    expected = sorted([url for _, url in items[201:]] + ["https://www.ics.uci.edu/late"])
+    os.remove(path + ".checkpoint")
+    store = FrontierStore(path, checkpointInterval=0)
+    if sorted(store.pending_urls()) != expected:
+        problems.append(f"{len(store.pending_urls())} urls pending after the compaction instead of {len(expected)}")
+    if len(store) != 301 or items[200][0] not in store:
+        problems.append(f"{len(store)} urls seen after the compaction instead of 301")
+    store.close()
+    return problems
+
+
+def check_checkpoint(folder):
+    # A restart loads the checkpoint and only replays the log written after
+    # it; a checkpoint of another log is ignored
+    path = os.path.join(folder, "frontier.log")
+    items = make_items(500)
+    store = FrontierStore(path, checkpointInterval=0)
+    store.add_many(items[:400])
+    store.complete_many([urlId for urlId, _ in items[:100]])
+    store.close()
+
+    problems = []
+    store = FrontierStore(path, checkpointInterval=0)
+    if not store.fromCheckpoint or store.replayedRecords:
+        problems.append(f"replayed {store.replayedRecords} records instead of loading the checkpoint")
+    # Crash after these are committed, without the checkpoint of close
+    store.add_many(items[400:])
+    store.sync()
+
+    expected = sorted(url for _, url in items[100:])
+    restarted = FrontierStore(path, checkpointInterval=0)
+    if not restarted.fromCheckpoint or restarted.replayedRecords != 100:
+        problems.append(f"replayed {restarted.replayedRecords} records after the checkpoint instead of 100")
+    if sorted(restarted.pending_urls()) != expected or len(restarted) != 500:
+        problems.append("the checkpoint and the log after it give another state")
+    restarted.close()
+    store.close()
+
+    # Same size and different last records: the log was replaced since
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data.replace(b'"a"', b'"r"'))
+    store = FrontierStore(path, checkpointInterval=0)
+    if store.fromCheckpoint:
+        problems.append("loaded the checkpoint of another log")
+    store.close()
+    return problems
+
+
+CHECKS = [check_group_commit, check_torn_record, check_compaction, check_checkpoint]
+
+
+def main():
+    failures = 0
+    for check in CHECKS:
+        folder = tempfile.mkdtemp(prefix="frontier_store_check")
+        try:
+            print(check.__name__)
+            problems = check(folder)
+        finally:
+            shutil.rmtree(folder)
+        for problem in problems:
+            print(f"    FAIL: {problem}")
+        failures += bool(problems)
+    print(f"{failures} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
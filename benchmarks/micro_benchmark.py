@@ -0,0 +1,100 @@
+# Times the hot functions of the scraper on their own: tokenize_text and
+# simHash on the text of generated and saved pages, the old CRC16 duplicate
+# check, and is_valid on the links of generated pages, with the url filter
+# cache cold (every url new) and warm (every url seen before), and reading
+# cache server answers into a Response, with and without loading the page.
+#
+#     python -m benchmarks.micro_benchmark [--seconds 1]
+import glob
+import os
+import time
+
+from argparse import ArgumentParser
+from types import SimpleNamespace
+from urllib.parse import urljoin
+
+import cbor
+
+import crawler
+import scraper
+from benchmarks.fake_cache import SiteGraph, encode_response
+from benchmarks.fingerprint_benchmark import cyclic_redundancy_check
+from benchmarks.parser_benchmark import CORPUS, large_publication_list
+from utils.parsers import get_parser
+from utils.response import Response
+from utils.seen_set import SeenSet
+from utils.url_filter import UrlFilter
+
+
+def calls_per_second(function, arguments, seconds):
+    # Calls function on every argument in turn, as often as fits in seconds
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for argument in arguments:
+            function(argument)
+        count += len(arguments)
+    return count / (time.perf_counter() - start)
+
+
+def report(name, rate, textBytes=None):
+    line = f"{name:28} {rate:12.1f} calls/sec"
+    if textBytes is not None:
+        line += f" {rate * textBytes / 1e6:8.2f} MB/s"
+    print(line)
+
+
+def main():
+    argParser = ArgumentParser()
+    argParser.add_argument("--seconds", type=float, default=1.0)
+    args = argParser.parse_args()
+
+    parser = get_parser("lxml")
+    graph = SiteGraph(hosts=5, pagesPerHost=200)
+    generated = [graph.get(f"https://{host}/page/{number}")[2]
+                 for host in graph.hosts for number in range(20)]
+    saved = []
+    for path in sorted(glob.glob(os.path.join(CORPUS, "*.html"))):
+        with open(path, "rb") as f:
+            saved.append(f.read())
+    workloads = [("generated pages", generated), ("corpus pages", saved),
+                 ("400KB page", [large_publication_list()])]
+
+    for workload, contents in workloads:
+        pages = [scraper.ParsedPage(*parser.parse_html(content)) for content in contents]
+        texts = [page.text for page in pages]
+        textBytes = sum(len(text.encode()) for text in texts) / len(texts)
+        print(f"{workload}, {len(pages)} pages of {textBytes / 1024:.1f} KB of text on average:")
+        report("  tokenize_text", calls_per_second(scraper.tokenize_text, texts, args.seconds), textBytes)
+        for page in pages:
+            page.tokens
+        report("  simHash", calls_per_second(scraper.simHash, pages, args.seconds), textBytes)
+        report("  cyclic_redundancy_check",
+               calls_per_second(cyclic_redundancy_check, texts, args.seconds), textBytes)
+
+    urls = []
+    for content in generated:
+        urls.extend(urljoin("https://www.ics.uci.edu/", link) for link in parser.parse_html(content)[2])
+    urls += [f"https://www.google.com/search?q={number}" for number in range(100)]
+    urls += [f"https://www.ics.uci.edu/files/{number}.pdf" for number in range(100)]
+    print(f"is_valid on {len(urls)} links of generated pages, other sites and files:")
+    for cacheSize, name in ((0, "  is_valid, cache cold"), (len(urls), "  is_valid, cache warm")):
+        # The parts of the Crawler is_valid uses
+        crawlState = SimpleNamespace(
+            uniquePages=SeenSet(),
+            urlFilter=UrlFilter("ics.uci.edu,cs.uci.edu,informatics.uci.edu,stat.uci.edu".split(","),
+                                cacheSize=cacheSize))
+        report(name, calls_per_second(lambda url: scraper.is_valid(crawlState, url), urls, args.seconds))
+
+    answers = [encode_response(f"https://www.ics.uci.edu/page/{number}", 200, "text/html", content)
+               for number, content in enumerate(generated)]
+    answerBytes = sum(len(answer) for answer in answers) / len(answers)
+    print(f"Cache server answers of {answerBytes / 1024:.1f} KB on average:")
+    report("  Response, status only", calls_per_second(
+        lambda answer: Response(cbor.loads(answer)).status, answers, args.seconds), answerBytes)
+    report("  Response, content", calls_per_second(
+        lambda answer: Response(cbor.loads(answer)).content, answers, args.seconds), answerBytes)
+
+
+if __name__ == "__main__":
+    main()
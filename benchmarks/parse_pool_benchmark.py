@@ -0,0 +1,57 @@
+# Reports pages/sec of the full page analysis (scraper.analyze_page) done
+# by THREADCOUNT threads in the crawler process, against the same threads
+# handing the pages to a pool of parser processes, for 1 to N processes.
+# Only the second scales with the number of cores.
+#
+#     python -m benchmarks.parse_pool_benchmark [--pages 200] [--threads 5] [--processes N]
+import glob
+import os
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import crawler
+import scraper
+from crawler.parse_pool import make_parse_pool, analyze_page
+from benchmarks.parser_benchmark import CORPUS, large_publication_list
+from utils.parsers import get_parser
+
+
+def pages_per_second(analyze, pages, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as fetchers:
+        list(fetchers.map(analyze, pages))
+    return len(pages) / (time.perf_counter() - start)
+
+
+def main():
+    argParser = ArgumentParser()
+    argParser.add_argument("--pages", type=int, default=200)
+    argParser.add_argument("--threads", type=int, default=5)
+    argParser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = argParser.parse_args()
+
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(CORPUS, "*.html"))):
+        with open(path, "rb") as f:
+            corpus.append(f.read())
+    corpus.append(large_publication_list())
+    pages = [corpus[i % len(corpus)] for i in range(args.pages)]
+    parser = get_parser("lxml")
+    url = "https://www.ics.uci.edu/page"
+
+    rate = pages_per_second(lambda content: scraper.analyze_page(parser, url, content), pages, args.threads)
+    print(f"{args.threads} threads, no pool      {rate:8.1f} pages/sec")
+    for processes in range(1, args.processes + 1):
+        pool = make_parse_pool(processes)
+        # Start the processes before timing
+        list(pool.map(analyze_page, [parser] * processes, [url] * processes, pages[:processes]))
+        rate = pages_per_second(
+            lambda content: pool.submit(analyze_page, parser, url, content).result(), pages, args.threads)
+        pool.shutdown()
+        print(f"{args.threads} threads, {processes:2} processes {rate:8.1f} pages/sec")
+
+
+if __name__ == "__main__":
+    main()
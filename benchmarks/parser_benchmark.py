@@ -0,0 +1,63 @@
+# Reports pages/sec of every parser backend on the saved corpus and on a
+# large generated publication list, similar to the 400 KB pages of a crawl.
+#
+#     python -m benchmarks.parser_benchmark [--seconds 2]
+import glob
+import os
+import time
+
+from argparse import ArgumentParser
+from utils.parsers import PARSERS, LxmlParser, etree
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+def large_publication_list(size=400 * 1024):
+    entry = (
+        '<li><span class="authors">A. Author, B. Author and C. Author</span>. '
+        '<a href="/pubs/{0}.html">Paper number {0} on crawling and indexing</a>. '
+        '<em>Proceedings of the conference</em>, 2020. [<a href="/pubs/{0}.pdf">pdf</a>]</li>\n')
+    parts = ["<html><head><title>Publications</title></head><body><ul>\n"]
+    total = 0
+    number = 0
+    while total < size:
+        parts.append(entry.format(number))
+        total += len(parts[-1])
+        number += 1
+    parts.append("</ul><p>End of the list.</p></body></html>")
+    return "".join(parts).encode()
+
+
+def pages_per_second(parser, pages, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for content in pages:
+            parser.parse_html(content)
+        count += len(pages)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    argParser = ArgumentParser()
+    argParser.add_argument("--seconds", type=float, default=2.0)
+    args = argParser.parse_args()
+
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(CORPUS, "*.html"))):
+        with open(path, "rb") as f:
+            corpus.append(f.read())
+    workloads = [("corpus", corpus), ("400KB page", [large_publication_list()])]
+
+    for name, parserClass in PARSERS.items():
+        if parserClass is LxmlParser and etree is None:
+            print(f"{name:6} skipped, lxml is not installed")
+            continue
+        parser = parserClass()
+        for workload, pages in workloads:
+            rate = pages_per_second(parser, pages, args.seconds)
+            print(f"{name:6} {workload:12} {rate:10.1f} pages/sec")
+
+
+if __name__ == "__main__":
+    main()
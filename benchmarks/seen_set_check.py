@@ -0,0 +1,135 @@
+# Checks that utils/seen_set.py SeenSet answers like a Python set while its
+# table grows, with and without the Bloom filter, and after a round trip
+# through write_table_snapshot and read_table_snapshot.
+#
+#     python -m benchmarks.seen_set_check
+#
+# The ids are random 64-bit integers like the ones url_id gives.
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from utils.seen_set import SeenSet, write_table_snapshot, read_table_snapshot
+
+IDS = 100000
+ABSENT = 10000
+
+
+def compare(seen, added, absent):
+    # Differences between seen and the set of ids added to it
+    problems = []
+    if len(seen) != len(added):
+        problems.append(f"{len(seen)} ids counted instead of {len(added)}")
+    missing = sum(1 for urlId in added if urlId not in seen)
+    if missing:
+        problems.append(f"{missing} added ids not found")
+    found = sum(1 for urlId in absent if urlId in seen)
+    if found:
+        problems.append(f"{found} ids found that were never added")
+    if set(seen) != added:
+        problems.append("iterating gives other ids than were added")
+    return problems
+
+
+def fill(seen, ids):
+    # Adds ids, every other one twice, returns the problems of the answers of add
+    problems = []
+    for index, urlId in enumerate(ids):
+        if not seen.add(urlId):
+            problems.append(f"add of a new id returned False after {index} ids")
+            break
+        if index % 2 and seen.add(urlId):
+            problems.append(f"add of an id already in returned True after {index} ids")
+            break
+    return problems
+
+
+def check_growth(folder):
+    # From a small table, so it grows many times
+    ids = [random.getrandbits(64) for _ in range(IDS)]
+    absent = [random.getrandbits(64) for _ in range(ABSENT)]
+    seen = SeenSet(capacity=16)
+    problems = fill(seen, ids)
+    problems += compare(seen, set(ids), absent)
+    # 0 marks an empty slot, the id 0 is stored as 1
+    seen.add(0)
+    if 0 not in seen:
+        problems.append("the id 0 was not found after it was added")
+    return problems
+
+
+def check_bloom(folder):
+    # The filter may only answer "maybe": it must never hide an added id,
+    # and with 10 bits per id it should rule out about 99% of the others
+    ids = [random.getrandbits(64) for _ in range(IDS)]
+    absent = [random.getrandbits(64) for _ in range(ABSENT)]
+    seen = SeenSet(capacity=16, bloomBitsPerItem=10)
+    problems = fill(seen, ids)
+    problems += compare(seen, set(ids), absent)
+    maybe = sum(1 for urlId in absent if urlId in seen.bloom)
+    print(f"    Bloom filter let {maybe / len(absent):.2%} of the absent ids through to the table")
+    if maybe > 0.05 * len(absent):
+        problems.append(f"the Bloom filter let {maybe} of {len(absent)} absent ids through")
+    return problems
+
+
+def check_snapshot(folder):
+    # A loaded snapshot holds the same ids, a cut one is not loaded
+    path = os.path.join(folder, "seen.bin")
+    ids = [random.getrandbits(64) for _ in range(IDS)]
+    absent = [random.getrandbits(64) for _ in range(ABSENT)]
+    seen = SeenSet()
+    for urlId in ids:
+        seen.add(urlId)
+    table, count = seen.table()
+    write_table_snapshot(path, table, count, {"position": 1234})
+
+    problems = []
+    snapshot = read_table_snapshot(path)
+    if snapshot is None:
+        return ["the snapshot just written could not be read"]
+    header, data = snapshot
+    if header.get("position") != 1234 or header["count"] != count:
+        problems.append(f"the header came back as {header}")
+    for bloomBits in (0, 10):
+        loaded = SeenSet(bloomBitsPerItem=bloomBits)
+        loaded.load_table(data, header["count"])
+        problems += [f"bloom {bloomBits}: {problem}" for problem in compare(loaded, set(ids), absent)]
+        # The loaded table keeps growing like a built one
+        more = [random.getrandbits(64) for _ in range(IDS // 2)]
+        problems += [f"bloom {bloomBits}: {problem}" for problem in fill(loaded, more)]
+        problems += [f"bloom {bloomBits}, after adds: {problem}"
+                     for problem in compare(loaded, set(ids) | set(more), absent)]
+
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 8)
+    if read_table_snapshot(path) is not None:
+        problems.append("a snapshot cut short was read")
+    if read_table_snapshot(os.path.join(folder, "missing.bin")) is not None:
+        problems.append("a missing snapshot was read")
+    return problems
+
+
+CHECKS = [check_growth, check_bloom, check_snapshot]
+
+
+def main():
+    failures = 0
+    for check in CHECKS:
+        folder = tempfile.mkdtemp(prefix="seen_set_check")
+        try:
+            print(check.__name__)
+            problems = check(folder)
+        finally:
+            shutil.rmtree(folder)
+        for problem in problems:
+            print(f"    FAIL: {problem}")
+        failures += bool(problems)
+    print(f"{failures} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# Checks that scraper.tokenize_text and scraper.count_tokens give exactly
+# what the character loop they replaced gave, then compares their speed.
+#
+#     python -m benchmarks.tokenizer_benchmark [--seconds 1] [--fuzz 20000]
+#
+# The texts checked are the saved pages of benchmarks/corpus, generated
+# pages, a few edge cases and random strings mixing ASCII and non ASCII
+# letters, digits, apostrophes, dashes and whitespace. Exits with 1 on any
+# difference.
+import glob
+import os
+import random
+import sys
+import time
+
+from argparse import ArgumentParser
+
+import crawler
+import scraper
+from benchmarks.fake_cache import SiteGraph
+from benchmarks.parser_benchmark import CORPUS, large_publication_list
+from utils.parsers import get_parser
+
+EDGE_CASES = [
+    "", "a", "ab", "a b", "AB-cd", "don't", "--", "''", "-a", "a-", "x'", "3.14", "C3PO r2-d2",
+    # Non ASCII letters and digits are separators, even those that lower
+    # case to ASCII: the Kelvin sign, dotted capital I
+    "cafés naïve", "Kelvin", "İstanbul", "xKy", "١٢٣ 123",
+    "a bc de", "tab\tnew\nline\r\nend", "ＡＢ fullwidth", "emoji\U0001F600ok",
+    "The THE the tHe", "it's IT'S Its", "and the of a to",
+]
+
+ALPHABET = ("abcXYZ019'-- \t\n.,;!?éÉKİß١ ’中\U0001F600")
+
+
+def tokenize_text_loop(text):
+    # The character loop scraper.tokenize_text used before
+    tokens = []
+    current_token = []
+    for char in text:
+        if (char.isascii() and char.isalnum()) or (char == "'" or char == "-"):
+            current_token.append(char)
+        else:
+            if current_token:
+                if len(current_token) > 1:
+                    tokens.append(''.join(current_token).lower())
+                current_token = []
+    if current_token:
+        if len(current_token) > 1:
+            tokens.append(''.join(current_token).lower())
+    return tokens
+
+
+def count_tokens_loop(text):
+    # What analyze_page did before: tokenize, drop stop words, then count
+    # them with the loop of the former scraper.computeWordFrequencies
+    wordFrequencies = dict()
+    for t in tokenize_text_loop(text):
+        if t in scraper.stopWords:
+            continue
+        if t in wordFrequencies.keys():
+            wordFrequencies[t] += 1
+        else:
+            wordFrequencies[t] = 1
+    return wordFrequencies
+
+
+def page_texts():
+    parser = get_parser("lxml")
+    contents = []
+    for path in sorted(glob.glob(os.path.join(CORPUS, "*.html"))):
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    contents.append(large_publication_list())
+    graph = SiteGraph(hosts=2, pagesPerHost=50)
+    contents += [graph.get(f"https://{host}/page/{number}")[2]
+                 for host in graph.hosts for number in range(50)]
+    texts = []
+    for content in contents:
+        text, paragraphText, _, _ = parser.parse_html(content)
+        texts += [text, paragraphText]
+    return texts
+
+
+def check(texts):
+    # Returns the number of texts on which the old and new functions differ
+    failures = 0
+    for text in texts:
+        problems = []
+        if scraper.tokenize_text(text) != tokenize_text_loop(text):
+            problems.append("tokens differ")
+        # Same counts in the same order
+        if list(scraper.count_tokens(text).items()) != list(count_tokens_loop(text).items()):
+            problems.append("counts differ")
+        if problems:
+            failures += 1
+            print(f"FAIL: {', '.join(problems)} on {text[:60]!r}")
+    return failures
+
+
+def megabytes_per_second(function, texts, seconds):
+    textBytes = sum(len(text.encode("utf-8", "surrogatepass")) for text in texts)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for text in texts:
+            function(text)
+        count += 1
+    return count * textBytes / (time.perf_counter() - start) / 1e6
+
+
+def main():
+    argParser = ArgumentParser()
+    argParser.add_argument("--seconds", type=float, default=1.0)
+    argParser.add_argument("--fuzz", type=int, default=20000)
+    args = argParser.parse_args()
+
+    texts = page_texts()
+    rng = random.Random(0)
+    fuzz = ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 80))) for _ in range(args.fuzz)]
+    failures = check(EDGE_CASES + texts + fuzz)
+    print(f"{len(EDGE_CASES) + len(texts) + len(fuzz)} texts checked, {failures} failure(s)")
+
+    print(f"{len(texts)} page texts:")
+    for name, old, new in (("tokenize", tokenize_text_loop, scraper.tokenize_text),
+                           ("tokenize, filter and count", count_tokens_loop, scraper.count_tokens)):
+        before = megabytes_per_second(old, texts, args.seconds)
+        after = megabytes_per_second(new, texts, args.seconds)
+        print(f"  {name:28} {before:8.2f} MB/s before {after:8.2f} MB/s now ({after / before:.1f}x)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
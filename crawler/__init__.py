@@ -1,9 +1,28 @@
-from utils import get_logger
+from utils import get_logger, canonicalize_url
 from crawler.frontier import Frontier
 from crawler.worker import Worker
+from crawler.async_worker import AsyncWorker, Wakeup
+from crawler.sitemaps import SitemapIngester
+from crawler.cluster import ClusterNode
+from crawler.parse_pool import make_parse_pool, analyze_page
+from crawler.store import log_tail
+import scraper
+from scraper import simHashDistance
+from concurrent.futures import ThreadPoolExecutor
+from utils.download import async_session, make_session
+from utils.parsers import get_parser
+from utils.fingerprint import FingerprintIndex, SimHashIndex, drop_legacy_shelve
+from utils.token_stats import TokenStats
+from utils.seen_set import SeenSet, write_table_snapshot, read_table_snapshot
+from utils.robots import RobotsCache
+from utils.url_filter import UrlFilter
+from utils.crawl_report import CrawlReport
+from utils.metrics import get_metrics, MetricsReporter, TimedLock
+from utils.page_states import PageStates
+from utils.trap_detector import TrapDetector
+import asyncio
 import os
 import shelve
-import threading
 
 
 
@@ -11,64 +30,162 @@ class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
-        self.frontier = frontier_factory(config, restart)
+        # Latencies of every stage and lock, and counters, written to
+        # METRICSFILE and served on METRICSPORT while the crawl runs
+        self.metrics = get_metrics()
+        self.metricsReporter = MetricsReporter(
+            self.metrics, config.metrics_file, interval=config.metrics_interval,
+            port=config.metrics_port, logger=self.logger)
+        # One node of a multi-node crawl: only the hosts this node owns are
+        # queued here, the others are forwarded to their nodes
+        self.cluster = None
+        if config.node:
+            self.cluster = ClusterNode(
+                config.node, config.coordinator, heartbeatInterval=config.heartbeat_interval,
+                forwardBatch=config.forward_batch, clusterSize=config.cluster_size,
+                logger=get_logger("CLUSTER", "Cluster"))
+            self.frontier = frontier_factory(config, restart, cluster=self.cluster)
+            self.cluster.start(self.frontier)
+        else:
+            self.frontier = frontier_factory(config, restart)
         self.workers = list()
         self.worker_factory = worker_factory
 
-        # stuff for storing longest file
-        self.longestFile = shelve.open("longest.shelve")
-        if "Longest" not in self.longestFile:
-            self.longestFile["Longest"] = ("", 0)
-        self.longestLock = threading.Lock()
+        # Keep-alive connection pool to the cache server shared by all workers
+        self.session = make_session(config)
 
-        # Unique pages storage
-        self.uniquePages = shelve.open("uniquePages.shelve") 
-        self.uniquePagesLock = threading.Lock()
+        # Rules for the urls worth crawling, compiled once
+        self.urlFilter = UrlFilter(config.domains, cacheSize=config.url_filter_cache)
 
-        # Keep track of all tokens on the site
-        self.tokens = shelve.open("tokens.shelve")
-        self.tokensLock = threading.Lock()
+        # HTML and sitemap parser backend picked in config.ini
+        self.parser = get_parser(config.parser, self.logger)
 
-        # Keep track of current subdomains list
-        self.icsSubDomainCounts = shelve.open("subDomains.shelve")
-        self.icsSubDomainCountsLock = threading.Lock()
+        # Pages are parsed on PARSEPROCESSES processes while the workers keep
+        # fetching, only the small results come back to this process
+        self.parsePool = make_parse_pool(config.parse_processes)
+
+        # Sitemaps are read on their own thread, off the fetch path
+        self.sitemaps = SitemapIngester(
+            self, maxDepth=config.sitemap_max_depth, maxUrls=config.sitemap_max_urls,
+            batchSize=config.sitemap_batch)
+
+        # Unique pages storage: ids of the pages in a compact set, and their urls
+        # appended to a list by the report, which is also what the set is rebuilt
+        # from. The set is written to uniquePages.bin on exit with the size and
+        # last bytes of the list then, so a resume only reads the urls appended
+        # after it, and a list replaced since is read whole.
+        if restart:
+            for path in ("uniquePages.log", "uniquePages.bin"):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.uniquePages = SeenSet(bloomBitsPerItem=config.seen_bloom_bits)
+        if os.path.exists("uniquePages.log"):
+            position = 0
+            snapshot = read_table_snapshot("uniquePages.bin")
+            if (snapshot is not None and snapshot[0]["position"] <= os.path.getsize("uniquePages.log")
+                    and log_tail("uniquePages.log", snapshot[0]["position"]) == snapshot[0].get("tail")):
+                header, table = snapshot
+                self.uniquePages.load_table(table, header["count"])
+                position = header["position"]
+            with open("uniquePages.log", "rb") as pages:
+                pages.seek(position)
+                for page in pages:
+                    self.uniquePages.add(scraper.page_id(page.decode("utf-8").rstrip("\n")))
+        if not restart and os.path.exists("uniquePages.shelve.dat"):
+            self._import_unique_pages("uniquePages.shelve")
+        drop_legacy_shelve("uniquePages.shelve", "unique pages moved to uniquePages.log", self.logger)
+
+        # Keep track of all tokens on the site, in memory with a snapshot on disk
+        self.tokenStats = TokenStats("tokens.json", flushInterval=config.stats_flush_interval)
+        if not restart and os.path.exists("tokens.shelve.dat"):
+            self.tokenStats.import_shelve("tokens.shelve")
+            drop_legacy_shelve("tokens.shelve", "token counts moved to tokens.json", self.logger)
 
         # Used to identify whether we should find the sitemap
         self.netlocs = shelve.open("netloc.shelve")
-        self.netlocsLock = threading.Lock()
+        self.netlocsLock = TimedLock("netlocs", self.metrics)
+
+        # robots.txt rules of every site, fetched through the cache server
+        drop_legacy_shelve("robotTXTs.shelve", "robots.txt rules moved to robotRules.shelve", self.logger)
+        self.robots = RobotsCache(
+            config, "robotRules.shelve", self.session, self.logger,
+            capacity=config.robots_cache_size, ttl=config.robots_ttl)
 
-        # place to store the robot .txt parsers
-        self.robotTxt = shelve.open("robotTXTs.shelve")
-        self.robotTxtLock = threading.Lock()
+        # Url templates of every host with the yield of new content of their
+        # pages, those that stop giving any are throttled then blocked
+        self.traps = TrapDetector(
+            "trapTemplates.json", minFetches=config.trap_min_fetches,
+            throttleYield=config.trap_throttle_yield, blockYield=config.trap_block_yield,
+            throttleRate=config.trap_throttle_rate, flushInterval=config.stats_flush_interval,
+            logger=get_logger("TRAPS", "Traps"))
 
-        # Place to maintain politness between threads
-        self.politeLockDictLock = threading.Lock()
-        self.politeLocksDict = {}
+        # Numbers of report.txt (unique pages, longest page, subdomains,
+        # tokens and blocked traps) kept up to date in memory with a snapshot on disk
+        if restart and os.path.exists("report.json"):
+            os.remove("report.json")
+        self.report = CrawlReport(
+            "report.json", "uniquePages.log", self.tokenStats, self.robots, traps=self.traps,
+            pageCount=len(self.uniquePages), flushInterval=config.stats_flush_interval)
+        if not restart and os.path.exists("longest.shelve.dat"):
+            self.report.import_shelves("longest.shelve", "subDomains.shelve")
+        drop_legacy_shelve("longest.shelve", "longest page moved to report.json", self.logger)
+        drop_legacy_shelve("subDomains.shelve", "subdomain counts moved to report.json", self.logger)
 
-        # place to maintain hash information
-        self.hashOfPages = shelve.open("hashOfPages.shelve")
-        self.hashOfPagesLock = threading.Lock()
+        # place to maintain hash information, fingerprints of every page for exact duplicates
+        drop_legacy_shelve(
+            "hashOfPages.shelve", "CRC16 values cannot be converted to content fingerprints", self.logger)
+        self.pageFingerprints = FingerprintIndex("pageFingerprints.bin")
 
-        self.simHashSet = shelve.open("simHashSet.shelve")
-        self.simHashSetLock = threading.Lock()
-        if "Queue" not in self.simHashSet:
-            self.simHashSet["Queue"] = []
+        # 64-bit simhashes of every page for near duplicates
+        drop_legacy_shelve(
+            "simHashSet.shelve", "8-bit simhashes cannot be converted to 64-bit ones", self.logger)
+        self.simHashIndex = SimHashIndex("simHashes.bin", maxDistance=simHashDistance)
 
-        # threads being done array
-        self.activeArray = []
-        for id in range(self.config.threads_count):
-            self.activeArray.append(True)
+        # Validators, fingerprint and revisit interval of every page fetched,
+        # pages that did not change are not parsed again in a re-crawl
+        self.pageStates = PageStates(
+            "pageStates.log", interval=config.recrawl_interval,
+            minInterval=config.recrawl_min_interval, maxInterval=config.recrawl_max_interval,
+            flushInterval=config.stats_flush_interval)
+        if os.path.exists("pageStates.json"):
+            if not restart:
+                self.pageStates.import_snapshot("pageStates.json")
+            os.remove("pageStates.json")
 
         if restart:
             print("clearing all shelves")
-            self.longestFile.clear()
-            self.longest = 0
-            self.uniquePages.clear()
-            self.tokens.clear()
-            self.icsSubDomainCounts.clear()
+            self.tokenStats.clear()
+            self.report.clear()
             self.netlocs.clear()
-            self.hashOfPages.clear()
-            self.simHashSet.clear()
+            self.pageFingerprints.clear()
+            self.simHashIndex.clear()
+            self.pageStates.clear()
+            self.traps.clear()
+
+        if config.recrawl:
+            due = self.pageStates.due()
+            queued = self.frontier.revisit(due)
+            self.logger.info(
+                f"Re-crawl: {len(due)} of {len(self.pageStates)} pages are due, {queued} queued again.")
+
+    def _import_unique_pages(self, shelvePath):
+        # Moves the pages of the old unique pages shelve to uniquePages.log
+        # and the set. Its keys are the scheme, host and path run together
+        # without "://" (httpswww.ics.uci.edu/about).
+        with shelve.open(shelvePath) as pages, open("uniquePages.log", "a", encoding="utf-8") as log:
+            for key in pages.keys():
+                scheme = "https" if key.startswith("https") else "http"
+                url = canonicalize_url(f"{scheme}://{key[len(scheme):]}")
+                if self.uniquePages.add(scraper.page_id(url)):
+                    log.write(url + "\n")
+
+    def analyze_page(self, url, content):
+        # scraper.PageAnalysis of a page, made on a parser process when
+        # there is a pool; the calling worker waits without holding the GIL
+        with self.metrics.timer("parse"):
+            if self.parsePool is None:
+                return scraper.analyze_page(self.parser, url, content)
+            return self.parsePool.submit(analyze_page, self.parser, url, content).result()
 
     def start_async(self):
         self.workers = [
@@ -78,8 +195,73 @@ class Crawler(object):
             worker.start()
 
     def start(self):
-        self.start_async()
-        self.join()
+        try:
+            if self.config.crawl_mode == "async":
+                try:
+                    asyncio.run(self.run_event_loop())
+                except KeyboardInterrupt:
+                    # asyncio.run cancelled the coroutines, the urls they were
+                    # downloading stay pending; parsing in the executor finished
+                    self.logger.info("Stopping, the urls being downloaded stay pending.")
+                    self.frontier.stop()
+            else:
+                self.start_async()
+                try:
+                    self.join()
+                except KeyboardInterrupt:
+                    # Let the workers finish the urls they hold, then save everything
+                    self.logger.info("Stopping, waiting for the workers to finish their urls.")
+                    self.frontier.stop()
+                    self.join()
+        finally:
+            self.close()
+
+    def close(self):
+        # Write out the state that is only flushed periodically
+        self.sitemaps.close()
+        if self.cluster is not None:
+            self.cluster.close()
+        self.frontier.close()
+        self.pageFingerprints.flush()
+        self.simHashIndex.close()
+        self.pageStates.close()
+        self.traps.close()
+        self.tokenStats.close()
+        self.report.close()
+        if os.path.exists("uniquePages.log"):
+            table, count = self.uniquePages.table()
+            position = os.path.getsize("uniquePages.log")
+            write_table_snapshot(
+                "uniquePages.bin", table, count,
+                {"position": position, "tail": log_tail("uniquePages.log", position)})
+        self.robots.close()
+        with self.netlocsLock:
+            self.netlocs.close()
+        self.metricsReporter.close()
+        if self.parsePool is not None:
+            self.parsePool.shutdown()
+        self.logger.info(f"Url filter decisions: {self.urlFilter.stats()}")
+
+    async def run_event_loop(self):
+        # asyncio crawl mode: ASYNCCONCURRENCY coroutines fetch on one loop
+        # while parsing is handed to a pool of THREADCOUNT threads
+        logger = get_logger("AsyncWorker", "Worker")
+        self.workers = [
+            AsyncWorker(worker_id, self.config, self.frontier, self, logger)
+            for worker_id in range(self.config.async_concurrency)]
+        wakeup = Wakeup(asyncio.get_running_loop())
+        self.frontier.add_listener(wakeup.notify)
+        session = async_session(self.config)
+        with ThreadPoolExecutor(max_workers=self.config.threads_count) as executor:
+            try:
+                await asyncio.gather(*[
+                    worker.run_async(session, executor, wakeup)
+                    for worker in self.workers])
+            finally:
+                # Nothing wakes this loop anymore once it is gone
+                self.frontier.remove_listener(wakeup.notify)
+                if session is not None:
+                    await session.close()
 
     def join(self):
         for worker in self.workers:
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from crawler.worker import Worker
+from utils.download import async_download
+
+
+class Wakeup(object):
+    # Lets the frontier, from any thread, wake the coroutines waiting for
+    # work. A coroutine takes the generation before polling the frontier and
+    # only sleeps if no notification came since, so none is ever missed.
+    # Every notification sets the event the sleepers wait on and starts a new
+    # one; no lock is involved, so cancelling all of them on Ctrl-C cannot
+    # deadlock like cancelled waiters of an asyncio.Condition can on 3.11.
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.generation = 0
+
+    def notify(self):
+        # Thread safe, called by the frontier
+        self.loop.call_soon_threadsafe(self._notify_all)
+
+    def _notify_all(self):
+        self.generation += 1
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def wait(self, generation, timeout=None):
+        if self.generation != generation:
+            return
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AsyncWorker(Worker):
+    # A coroutine version of Worker. Many of them share one event loop and one
+    # http session, the robots.txt check and all of the parsing in
+    # process_response run in the executor so they never block the loop.
+    # It is never started as a thread, Crawler awaits run_async instead.
+
+    async def run_async(self, session, executor, wakeup):
+        loop = asyncio.get_running_loop()
+        while True:
+            generation = wakeup.generation
+            tbd_url, wait = self.frontier.poll_tbd_url()
+
+            if not tbd_url:
+                if self.frontier.finished:
+                    self.logger.info("Frontier is empty. Stopping Crawler.")
+                    break
+                # Sleeps until the earliest host is ready, or until the
+                # frontier has news when no host is queued at all
+                await wakeup.wait(generation, wait)
+                continue
+
+            try:
+                if self.check_trap(tbd_url):
+                    continue
+                allowed = await loop.run_in_executor(executor, self.checkRobotTxt, tbd_url)
+                if not allowed:
+                    self.crawler.logger.info(f"Found blackisted site : {tbd_url}")
+                    self.frontier.remove_url(tbd_url)
+                    continue
+
+                start = time.perf_counter()
+                resp = await async_download(tbd_url, self.config, self.logger, session)
+                self.metrics.observe("download", time.perf_counter() - start)
+                await loop.run_in_executor(executor, self.process_response, tbd_url, resp)
+            except Exception as e:
+                self.logger.error(f"Failed to crawl {tbd_url}: {e}")
+            finally:
+                self.frontier.release_url(tbd_url)
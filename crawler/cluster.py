@@ -0,0 +1,188 @@
+import bisect
+import requests
+import time
+
+from hashlib import blake2b
+from threading import Thread, Lock, Condition
+
+from utils import get_logger
+
+
+def _ring_hash(key):
+    return int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashRing(object):
+    # Consistent hashing of hosts onto node names. Every node is placed at
+    # `replicas` points of a 64-bit ring and a host belongs to the first node
+    # point after its own hash, so when a node joins or leaves only the
+    # hosts next to its points change owner.
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.nodes = sorted(set(nodes))
+        self.points = sorted(
+            (_ring_hash(f"{node}#{replica}"), node)
+            for node in self.nodes for replica in range(replicas))
+        self.keys = [point for point, _ in self.points]
+
+    def owner(self, host):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.keys, _ring_hash(host or "")) % len(self.points)
+        return self.points[index][1]
+
+
+class ClusterNode(object):
+    # This crawler as one node of a multi-node crawl. Every node owns the
+    # hosts the HashRing gives it: their frontier, politeness and robots
+    # rules live only on that node. Urls found for other nodes' hosts are
+    # batched and sent through the coordinator (crawler/coordinator.py), the
+    # node polls the coordinator for urls sent to it, and every heartbeat
+    # tells it the current members. When they change, queued urls of hosts
+    # the node no longer owns are handed over. The node holds its frontier
+    # open until the coordinator sees every node idle with nothing in flight.
+    #
+    # Only the urls still queued move with a host when the members change,
+    # a node leaving also sends the ids of the pages it crawled, but a node
+    # joining or failing in the middle of a crawl means some pages of the
+    # moved hosts are crawled again. Nodes wait for clusterSize members
+    # before crawling so that only happens when a node fails. The urls
+    # queued on a failed node wait in its save file until it is resumed.
+    def __init__(self, name, coordinator, heartbeatInterval=1.0, forwardBatch=500,
+                 clusterSize=1, logger=None):
+        self.name = name
+        self.coordinator = f"http://{coordinator}"
+        self.heartbeatInterval = heartbeatInterval
+        self.forwardBatch = forwardBatch
+        self.logger = logger if logger else get_logger("CLUSTER")
+        self.session = requests.Session()
+        self.frontier = None
+
+        self.lock = Lock()
+        self.outboxChanged = Condition(self.lock)
+        self.outbox = list()
+        self.sent = 0
+        self.received = 0
+        self.done = False
+        self.closed = False
+
+        members = self._call("join", {"node": self.name})
+        self.logger.info(f"Joined the cluster as {self.name}, nodes: {', '.join(members['nodes'])}")
+        while len(members["nodes"]) < clusterSize:
+            time.sleep(self.heartbeatInterval)
+            members = self._call("members", {"node": self.name})
+        self.epoch = members["epoch"]
+        self.ring = HashRing(members["nodes"])
+        self.thread = Thread(target=self._run, name="ClusterNode", daemon=True)
+
+    def _call(self, action, message):
+        resp = self.session.post(f"{self.coordinator}/{action}", json=message, timeout=30)
+        resp.raise_for_status()
+        return resp.json()
+
+    def owns(self, host):
+        return self.ring.owner(host) == self.name
+
+    def forward(self, urls):
+        # Queues urls of hosts owned by other nodes, sent in batches
+        with self.lock:
+            self.outbox.extend(urls)
+            if len(self.outbox) >= self.forwardBatch:
+                self.outboxChanged.notify()
+
+    def start(self, frontier):
+        self.frontier = frontier
+        # Released when the whole cluster is done, see _heartbeat
+        frontier.hold()
+        # Urls saved by an earlier run for hosts that are now someone else's
+        self.forward(frontier.take_queued(lambda host: not self.owns(host)))
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.closed and len(self.outbox) < self.forwardBatch:
+                    self.outboxChanged.wait(self.heartbeatInterval)
+                if self.closed:
+                    return
+            try:
+                self._send()
+                self._receive()
+                if self._heartbeat():
+                    return
+            except requests.RequestException as e:
+                self.logger.error(f"Could not reach the coordinator, retrying: {e}")
+
+    def _send(self):
+        with self.lock:
+            batch, self.outbox = self.outbox, list()
+        if not batch:
+            return
+        try:
+            self._call("send", {"node": self.name, "urls": batch})
+        except requests.RequestException:
+            with self.lock:
+                self.outbox[:0] = batch
+            raise
+        with self.lock:
+            self.sent += len(batch)
+
+    def _receive(self):
+        mail = self._call("receive", {"node": self.name})
+        if mail["seen"]:
+            # Crawled by a node that left, before its queued urls come in
+            self.frontier.add_seen(mail["seen"])
+        urls = mail["urls"]
+        if urls:
+            # Urls for hosts this node lost meanwhile are forwarded again
+            self.frontier.add_urls(urls)
+            with self.lock:
+                self.received += len(urls)
+
+    def _heartbeat(self):
+        # Returns True once the cluster is done
+        inFlight, queuedHosts = self.frontier.work_counts()
+        with self.lock:
+            # The only work left is our own hold on the frontier
+            idle = inFlight == 1 and queuedHosts == 0 and not self.outbox
+            message = {"node": self.name, "idle": idle, "sent": self.sent, "received": self.received}
+        state = self._call("heartbeat", message)
+
+        if state["epoch"] != self.epoch:
+            self.epoch = state["epoch"]
+            self.ring = HashRing(state["nodes"])
+            self.logger.info(f"Cluster nodes are now {', '.join(self.ring.nodes)}")
+        # Hosts that were being fetched at the change are handed over later
+        handedOver = self.frontier.take_queued(lambda host: not self.owns(host))
+        if handedOver:
+            self.logger.info(f"Handing over {len(handedOver)} queued urls")
+            self.forward(handedOver)
+
+        if state["done"]:
+            self.logger.info("Every node is idle, the crawl is done.")
+            self.done = True
+            self.frontier.unhold()
+            return True
+        return False
+
+    def close(self):
+        # Leaving before the crawl is done hands every queued url over to
+        # the other nodes first
+        with self.lock:
+            self.closed = True
+            self.outboxChanged.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.done:
+            return
+        try:
+            if self.frontier is not None:
+                self.forward(self.frontier.take_queued(lambda host: True))
+                self._send()
+                crawled = self.frontier.crawled_ids()
+                for start in range(0, len(crawled), 100000):
+                    self._call("send", {
+                        "node": self.name, "urls": [], "seen": crawled[start:start + 100000]})
+            self._call("leave", {"node": self.name})
+        except requests.RequestException as e:
+            self.logger.error(f"Could not leave the cluster cleanly: {e}")
@@ -0,0 +1,181 @@
+import json
+import time
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock
+from urllib.parse import urlparse
+
+from crawler.cluster import HashRing
+from utils import get_logger
+
+
+class Coordinator(object):
+    # Stands in for the network between the nodes of a multi-node crawl
+    # (crawler/cluster.py) on one machine: it keeps the members, routes the
+    # urls nodes send each other to the mailbox of the owner of their host,
+    # and decides when the whole crawl is done. A node that misses
+    # heartbeats for nodeTimeout seconds is dropped and its mail rerouted.
+    # The ids of the pages crawled by a node that leaves are passed on to
+    # every other node, since the ids do not tell whose hosts they are.
+    def __init__(self, nodeTimeout=30.0, logger=None):
+        self.nodeTimeout = nodeTimeout
+        self.logger = logger if logger else get_logger("COORDINATOR")
+        self.lock = Lock()
+        self.epoch = 0
+        self.lastSeen = dict()
+        self.ring = HashRing()
+        self.mailboxes = defaultdict(list)
+        self.seenboxes = defaultdict(list)
+        # Urls handed to each node, and its last heartbeat
+        self.delivered = defaultdict(int)
+        self.reports = dict()
+        self.done = False
+
+    def _members_changed(self):
+        # Caller holds the lock
+        self.epoch += 1
+        self.ring = HashRing(self.lastSeen)
+        self.logger.info(f"Epoch {self.epoch}, nodes: {', '.join(self.ring.nodes)}")
+        # Mail waiting for nodes that left goes to the new owners
+        for node in list(self.mailboxes):
+            if node not in self.lastSeen:
+                self._route(self.mailboxes.pop(node))
+        for node in list(self.seenboxes):
+            if node not in self.lastSeen:
+                del self.seenboxes[node]
+
+    def _route(self, urls):
+        # Caller holds the lock
+        for url in urls:
+            owner = self.ring.owner(urlparse(url).hostname)
+            if owner is not None:
+                self.mailboxes[owner].append(url)
+
+    def _expire(self):
+        # Caller holds the lock
+        now = time.monotonic()
+        expired = [node for node, seen in self.lastSeen.items() if now - seen > self.nodeTimeout]
+        for node in expired:
+            self.logger.warning(f"No heartbeat from {node} for {self.nodeTimeout} seconds, dropping it")
+            del self.lastSeen[node]
+            self.reports.pop(node, None)
+        if expired:
+            self._members_changed()
+
+    def _state(self):
+        return {"epoch": self.epoch, "nodes": self.ring.nodes, "done": self.done}
+
+    def join(self, message):
+        with self.lock:
+            self._expire()
+            node = message["node"]
+            isNew = node not in self.lastSeen
+            self.lastSeen[node] = time.monotonic()
+            # A node rejoining after a restart starts its counts again
+            self.delivered[node] = 0
+            self.reports.pop(node, None)
+            if isNew:
+                self._members_changed()
+            return self._state()
+
+    def members(self, message):
+        with self.lock:
+            self.lastSeen[message["node"]] = time.monotonic()
+            self._expire()
+            return self._state()
+
+    def leave(self, message):
+        with self.lock:
+            node = message["node"]
+            if self.lastSeen.pop(node, None) is not None:
+                self.reports.pop(node, None)
+                self._members_changed()
+            return self._state()
+
+    def send(self, message):
+        with self.lock:
+            self.lastSeen[message["node"]] = time.monotonic()
+            self._route(message["urls"])
+            for node in self.lastSeen:
+                if node != message["node"] and message.get("seen"):
+                    self.seenboxes[node].extend(message["seen"])
+            return {}
+
+    def receive(self, message):
+        with self.lock:
+            node = message["node"]
+            self.lastSeen[node] = time.monotonic()
+            urls = self.mailboxes.pop(node, [])
+            self.delivered[node] += len(urls)
+            return {"urls": urls, "seen": self.seenboxes.pop(node, [])}
+
+    def heartbeat(self, message):
+        with self.lock:
+            node = message["node"]
+            if node not in self.lastSeen:
+                # Dropped after a timeout, it is a member again
+                self.lastSeen[node] = time.monotonic()
+                self._members_changed()
+            self.lastSeen[node] = time.monotonic()
+            self.reports[node] = message
+            self._expire()
+            self._check_done()
+            return self._state()
+
+    def _check_done(self):
+        # Caller holds the lock. Done once every member said it is idle
+        # after receiving all of the urls given to it, and no url is waiting
+        # in a mailbox. A node only gets busy again by receiving urls, so an
+        # idle report that counted every delivered url is still true.
+        if self.done or not self.lastSeen:
+            return
+        for node in self.lastSeen:
+            report = self.reports.get(node)
+            if not report or not report["idle"] or report["received"] != self.delivered[node]:
+                return
+        if any(self.mailboxes.values()):
+            return
+        self.logger.info("Every node is idle and no url is in flight, the crawl is done.")
+        self.done = True
+
+
+def make_server(coordinator, address):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            name = self.path.strip("/")
+            if name not in ("join", "members", "leave", "send", "receive", "heartbeat"):
+                self.send_error(404)
+                return
+            action = getattr(coordinator, name)
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                message = json.loads(self.rfile.read(length))
+            except ValueError:
+                # A node stopped in the middle of a request
+                self.send_error(400)
+                return
+            body = json.dumps(action(message)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer(address, Handler)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--node_timeout", type=float, default=30.0)
+    args = parser.parse_args()
+    server = make_server(Coordinator(args.node_timeout), (args.host, args.port))
+    server.serve_forever()
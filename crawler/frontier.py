@@ -1,19 +1,66 @@
 import os
+import dbm
+import time
+import heapq
 import shelve
 
-from threading import Thread, RLock, Lock
-from queue import Queue, Empty
+from itertools import count
+from threading import Condition
+from urllib.parse import urlparse
 
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
+from utils import get_logger, canonicalize_url, url_id
+from utils.metrics import get_metrics, TimedLock
+from utils.fingerprint import drop_legacy_shelve
+from utils.seen_set import SeenSet
+from crawler.store import FrontierStore
+from crawler.priority import UrlScorer, parse_weights
+
+# The save file of crawls made before the frontier log, urlhash -> (url, completed)
+LEGACY_SAVE_FILE = "frontier.shelve"
 
 class Frontier(object):
-    def __init__(self, config, restart):
+    def __init__(self, config, restart, cluster=None, scorer=None):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
-        
-        if not os.path.exists(self.config.save_file) and not restart:
+        # The ClusterNode when this crawler is one node of a multi-node
+        # crawl: urls of hosts owned by other nodes are forwarded to them
+        self.cluster = cluster
+        # Ids of urls handed over to another node, taken back if the host
+        # comes back to this node before that node crawled them
+        self.handedOver = set()
+        # Ids of urls forwarded to their owner already, so a url linked from
+        # many pages crosses the network once instead of once per page
+        self.forwarded = SeenSet()
+
+        # Politeness scheduling: every host has its own queue of urls and a
+        # time before which it may not be fetched again. Hosts with queued
+        # urls that are not currently being fetched sit in coolingHeap ordered
+        # by that time; once it passed they move to readyHeap, ordered by the
+        # cost of their best url. get_tbd_url only hands out urls that are
+        # polite now, the most valuable of those first.
+        self.hostQueues = dict()
+        self.nextFetchTime = dict()
+        # Crawl-delay of robots.txt for the hosts that ask for more than POLITENESS
+        self.crawlDelays = dict()
+        self.busyHosts = set()
+        self.coolingHeap = list()
+        self.readyHeap = list()
+        self.readyHosts = set()
+        # Urls handed out per host, for the coverage priority
+        self.hostFetched = dict()
+
+        # Every host queue is a heap of [key, sequence, url, inlinks, lowInfo,
+        # queuedAt], keyed by the scorer (see crawler/priority.py). When a
+        # queued url is linked again its entry is replaced by one with a
+        # better key and its url set to None; the best entry of a queue is
+        # never a replaced one.
+        self.scorer = scorer if scorer else UrlScorer(
+            parse_weights(config.priority), aging=config.priority_aging)
+        self.sequence = count()
+        self.queuedEntries = dict()
+
+        legacySave = dbm.whichdb(LEGACY_SAVE_FILE)
+        if not os.path.exists(self.config.save_file) and not restart and not legacySave:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
@@ -22,77 +69,417 @@ class Frontier(object):
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove("longest.shelve")
-            os.remove("subDomains.shelve")
-            os.remove("tokens.shelve")
-            os.remove("uniquePages.shelve")
+            os.remove(self.config.save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
-        # Set lock for frontier
-        self.frontierLock = Lock()
+        # Changes are group committed to its log instead of synced one by one,
+        # and a checkpoint of it spares replaying the whole log on a resume.
+        loadStart = time.perf_counter()
+        self.save = FrontierStore(
+            self.config.save_file, commitInterval=self.config.commit_interval,
+            commitBatch=self.config.commit_batch,
+            bloomBitsPerItem=self.config.seen_bloom_bits,
+            checkpointInterval=self.config.checkpoint_interval)
+        self.loadSeconds = time.perf_counter() - loadStart
+        if legacySave:
+            if not restart and not self.save:
+                self._import_shelve(LEGACY_SAVE_FILE)
+                reason = f"its urls were moved to {self.config.save_file}"
+            elif restart:
+                reason = "starting from seed"
+            else:
+                reason = f"continuing from {self.config.save_file}"
+            drop_legacy_shelve(LEGACY_SAVE_FILE, reason, self.logger)
+        # Lock for the politeness queues, never held while sleeping
+        self.metrics = get_metrics()
+        self.scheduleLock = TimedLock("frontier", self.metrics)
+        # Idle workers wait on workAvailable until a host becomes ready. The
+        # crawl is finished once nothing is queued and no url is in flight
+        # (handed out and not released), since only those can add new urls.
+        self.workAvailable = Condition(self.scheduleLock)
+        self.inFlight = 0
+        self.finished = False
+        self.listeners = list()
 
         if restart:
-            for url in self.config.seed_urls:
-                self.add_url(url)
+            self.add_urls(self.config.seed_urls)
         else:
             # Set the frontier state with contents of save file.
             self._parse_save_file()
             if not self.save:
-                for url in self.config.seed_urls:
-                    self.add_url(url)
+                self.add_urls(self.config.seed_urls)
+
+    def _import_shelve(self, shelvePath):
+        # Moves the urls of an old shelve save file into the store, so a crawl
+        # started before the frontier log resumes where it stopped
+        pending, completed = [], []
+        with shelve.open(shelvePath, "r") as save:
+            for url, isCompleted in save.values():
+                url = canonicalize_url(url)
+                if isCompleted:
+                    completed.append(url_id(url))
+                else:
+                    pending.append((url_id(url), url))
+        self.save.add_many(pending)
+        self.save.complete_many(completed)
+        self.save.sync()
+        self.logger.info(
+            f"Imported {len(pending)} pending and {len(completed)} completed urls "
+            f"from {shelvePath}.")
 
     def _parse_save_file(self):
         ''' This function can be overridden for alternate saving techniques. '''
         total_count = len(self.save)
-        tbd_count = 0
-        with self.frontierLock:
-            for url, completed in self.save.values():
-                if not completed:
-                    self.to_be_downloaded.append(url)
-                    tbd_count += 1
-            self.logger.info(
-                f"Found {tbd_count} urls to be downloaded from {total_count} "
-                f"total urls discovered.")
+        urls = self.save.pending_urls()
+        self._enqueue_all(urls)
+        tbd_count = len(urls)
+        if self.save.fromCheckpoint:
+            source = f"the checkpoint and {self.save.replayedRecords} log records after it"
+        else:
+            source = f"{self.save.replayedRecords} log records"
+        self.logger.info(
+            f"Found {tbd_count} urls to be downloaded from {total_count} "
+            f"total urls discovered, loaded from {source} in {self.loadSeconds:.2f}s.")
+
+    def _enqueue(self, url, lowInfo=False):
+        # Caller holds scheduleLock, returns True if the host just became schedulable
+        parsed = urlparse(url)
+        host = parsed.hostname
+        if host not in self.hostQueues:
+            self.hostQueues[host] = list()
+        queue = self.hostQueues[host]
+        now = time.monotonic()
+        entry = [self.scorer.key(parsed, 1, lowInfo, now), next(self.sequence), url, 1, lowInfo, now]
+        heapq.heappush(queue, entry)
+        if self.scorer.usesInlinks:
+            self.queuedEntries[url] = entry
+        if len(queue) == 1 and host not in self.busyHosts:
+            heapq.heappush(self.coolingHeap, (self.nextFetchTime.get(host, 0), host))
+            return True
+        return False
+
+    def _enqueue_all(self, urls, lowInfo=False):
+        with self.scheduleLock:
+            readyHosts = 0
+            for url in urls:
+                readyHosts += self._enqueue(url, lowInfo)
+            if readyHosts:
+                self.workAvailable.notify(readyHosts)
+        if readyHosts:
+            self._notify_listeners()
+
+    def _relink(self, urls):
+        # Queued urls found on one more page move up their host queue
+        with self.scheduleLock:
+            for url in urls:
+                entry = self.queuedEntries.get(url)
+                if entry is None:
+                    # Handed out already
+                    continue
+                parsed = urlparse(url)
+                inlinks = entry[3] + 1
+                relinked = [self.scorer.key(parsed, inlinks, entry[4], entry[5]),
+                            next(self.sequence), url, inlinks, entry[4], entry[5]]
+                entry[2] = None
+                heapq.heappush(self.hostQueues[parsed.hostname], relinked)
+                self.queuedEntries[url] = relinked
+
+    def _pop_url(self, host):
+        # Caller holds scheduleLock, takes the best url of a queued host
+        queue = self.hostQueues[host]
+        # _relink leaves the old entry of a moved url behind as None, and
+        # it may sit on top when the moved url did not rank any better
+        while queue[0][2] is None:
+            heapq.heappop(queue)
+        url = heapq.heappop(queue)[2]
+        while queue and queue[0][2] is None:
+            heapq.heappop(queue)
+        if not queue:
+            del self.hostQueues[host]
+        self.queuedEntries.pop(url, None)
+        return url
+
+    def add_listener(self, callback):
+        # callback() is called, from any thread and without any lock held,
+        # whenever a host may have become ready or the crawl finished. Used
+        # to wake the asyncio workers, thread workers wait on workAvailable.
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def _notify_listeners(self):
+        for callback in self.listeners:
+            callback()
+
+    def _finish(self):
+        # Caller holds scheduleLock
+        if not self.finished:
+            self.finished = True
+            self.workAvailable.notify_all()
+            return True
+        return False
+
+    def poll_tbd_url(self):
+        # Non blocking version of get_tbd_url for the asyncio workers.
+        # Returns (url, None) when a host is ready, (None, seconds) until the
+        # earliest host is ready, or (None, None) when nothing can be scheduled
+        # until a worker adds urls; self.finished is set once nothing ever will.
+        finished = False
+        start = time.perf_counter()
+        with self.scheduleLock:
+            url, wait = self._poll()
+            if url is None and wait is None and self.inFlight == 0:
+                finished = self._finish()
+        self.metrics.observe("frontier.pop", time.perf_counter() - start)
+        if finished:
+            self._notify_listeners()
+        return url, wait
+
+    def _poll(self):
+        # Caller holds scheduleLock
+        if self.finished:
+            return None, None
+        now = time.monotonic()
+        while self.coolingHeap:
+            readyAt, host = self.coolingHeap[0]
+            # Entries left behind while acquire_host held the host
+            if (host in self.busyHosts or host not in self.hostQueues or host in self.readyHosts
+                    or readyAt < self.nextFetchTime.get(host, 0)):
+                heapq.heappop(self.coolingHeap)
+                continue
+            if readyAt > now:
+                break
+            # Polite to fetch now, ranked by its best url
+            heapq.heappop(self.coolingHeap)
+            self.readyHosts.add(host)
+            hostKey = self.hostQueues[host][0][0] + self.scorer.host_cost(self.hostFetched.get(host, 0))
+            heapq.heappush(self.readyHeap, (hostKey, host))
+        while self.readyHeap:
+            _, host = heapq.heappop(self.readyHeap)
+            # Entries of hosts taken by acquire_host or take_queued meanwhile
+            if host not in self.readyHosts:
+                continue
+            self.readyHosts.discard(host)
+            url = self._pop_url(host)
+            self.hostFetched[host] = self.hostFetched.get(host, 0) + 1
+            # The host stays out of the heaps until release_url
+            self.busyHosts.add(host)
+            self.inFlight += 1
+            return url, None
+        if self.coolingHeap:
+            return None, self.coolingHeap[0][0] - now
+        return None, None
 
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+        # Returns a url whose host may be fetched right now. Blocks without
+        # using any CPU while every host is cooling down or while the queues
+        # are empty but other workers may still add urls. Returns None once
+        # the crawl is finished (or stopped), to every worker.
+        finished = False
+        start = time.perf_counter()
+        waited = 0.0
+        with self.workAvailable:
+            while True:
+                url, wait = self._poll()
+                if url is not None or self.finished:
+                    break
+                if wait is None and self.inFlight == 0:
+                    finished = self._finish()
+                    break
+                waitStart = time.perf_counter()
+                self.workAvailable.wait(wait)
+                waited += time.perf_counter() - waitStart
+        # Time spent waiting for a polite host apart from the rest
+        self.metrics.observe("frontier.pop", time.perf_counter() - start - waited)
+        if waited:
+            self.metrics.observe("frontier.wait", waited)
+        if finished:
+            self._notify_listeners()
+        return url
+
+    def release_url(self, url):
+        # Called by a worker once it is done with a url from get_tbd_url, the
+        # host becomes available again after the politeness delay.
+        host = urlparse(url).hostname
+        with self.scheduleLock:
+            self.inFlight -= 1
+            changed = self._release_host(host) or self._finish_if_done()
+        if changed:
+            self._notify_listeners()
+
+    def _release_host(self, host):
+        # Caller holds scheduleLock, returns True if the host is queued again
+        self.busyHosts.discard(host)
+        readyAt = time.monotonic() + self.crawlDelays.get(host, self.config.time_delay)
+        self.nextFetchTime[host] = readyAt
+        if host in self.hostQueues:
+            heapq.heappush(self.coolingHeap, (readyAt, host))
+            # A waiting worker may have to wait for this host now
+            self.workAvailable.notify()
+            return True
+        return False
+
+    def _finish_if_done(self):
+        # Caller holds scheduleLock
+        if self.inFlight == 0 and not self.hostQueues:
+            return self._finish()
+        return False
+
+    def hold(self):
+        # Work outside of the workers that may still add urls, e.g. a queued
+        # sitemap. The crawl does not finish before every hold is released.
+        with self.scheduleLock:
+            self.inFlight += 1
+
+    def unhold(self):
+        with self.scheduleLock:
+            self.inFlight -= 1
+            finished = self._finish_if_done()
+        if finished:
+            self._notify_listeners()
+
+    def acquire_host(self, host):
+        # Reserves host, like get_tbd_url does, for a request made outside of
+        # the frontier urls. Blocks until the host is polite to fetch and not
+        # in use, returns False if the crawl finished or stopped meanwhile.
+        with self.workAvailable:
+            while not self.finished:
+                wait = self.nextFetchTime.get(host, 0) - time.monotonic()
+                if host in self.busyHosts:
+                    wait = self.crawlDelays.get(host, self.config.time_delay)
+                elif wait <= 0:
+                    self.busyHosts.add(host)
+                    self.readyHosts.discard(host)
+                    return True
+                self.workAvailable.wait(wait)
+        return False
+
+    def release_host(self, host):
+        with self.scheduleLock:
+            queued = self._release_host(host)
+        if queued:
+            self._notify_listeners()
+
+    def set_crawl_delay(self, host, delay):
+        # Delay between two fetches of host asked by its robots.txt, it never
+        # goes below POLITENESS
+        with self.scheduleLock:
+            if delay > self.config.time_delay:
+                self.crawlDelays[host] = delay
+            else:
+                self.crawlDelays.pop(host, None)
+
+    def stop(self):
+        # Ask every worker to stop once its current url is done
+        with self.scheduleLock:
+            finished = self._finish()
+        if finished:
+            self._notify_listeners()
 
     def add_url(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # lock the frontier to make sure no double writes
-            with self.frontierLock:
-                self.save[urlhash] = (url, False)
-                self.save.sync()
-                self.to_be_downloaded.append(url)
-    
+        self.add_urls([url])
+
+    def add_urls(self, urls, lowInfo=False):
+        # lowInfo: the urls were found on a low information page
+        with self.metrics.timer("frontier.add"):
+            self._add_urls(urls, lowInfo)
+
+    def _add_urls(self, urls, lowInfo):
+        # Adds every link of a page in one operation and one group commit.
+        # Urls already seen are dropped before taking any lock, unless the
+        # number of links to queued urls counts for their priority.
+        items = []
+        foreign = []
+        returned = []
+        relinked = []
+        for url in urls:
+            url = canonicalize_url(url)
+            urlId = url_id(url)
+            if self.cluster is not None and not self.cluster.owns(urlparse(url).hostname):
+                # The owner of the host decides if it was seen
+                if urlId not in self.save and self.forwarded.add(urlId):
+                    foreign.append(url)
+            elif urlId not in self.save:
+                items.append((urlId, url))
+            elif urlId in self.handedOver:
+                self.handedOver.discard(urlId)
+                returned.append((urlId, url))
+            elif self.scorer.usesInlinks:
+                relinked.append(url)
+        if foreign:
+            self.cluster.forward(foreign)
+        added = self.save.add_many(items) if items else []
+        if returned:
+            added += self.save.add_many(returned, again=True)
+        if added:
+            self._enqueue_all(added, lowInfo)
+        if relinked:
+            self._relink(relinked)
+
+    def revisit(self, urls):
+        # Queues pages crawled before to be downloaded again, for a re-crawl
+        # (see utils/page_states.py). Returns how many were queued.
+        added = self.save.add_completed([(url_id(url), url) for url in urls])
+        if added:
+            self._enqueue_all(added)
+        return len(added)
+
+    def crawled_ids(self):
+        # Ids of the urls seen here that are neither queued nor handed over
+        return [urlId for urlId in self.save.completed_ids() if urlId not in self.handedOver]
+
+    def add_seen(self, urlIds):
+        # Urls crawled elsewhere, they are not added again
+        self.save.complete_many([urlId for urlId in urlIds if urlId not in self.save])
+
+    def work_counts(self):
+        # Urls in flight (and holds) and hosts with queued urls
+        with self.scheduleLock:
+            return self.inFlight, len(self.hostQueues)
+
+    def take_queued(self, predicate):
+        # Removes and returns the queued urls of the hosts for which
+        # predicate(host) is true, except hosts being fetched right now
+        # (their urls are taken at the next call). Used to hand hosts over
+        # to another node, the urls stay seen here.
+        taken = []
+        with self.scheduleLock:
+            for host in list(self.hostQueues):
+                if host in self.busyHosts or not predicate(host):
+                    continue
+                for entry in self.hostQueues.pop(host):
+                    if entry[2] is not None:
+                        self.queuedEntries.pop(entry[2], None)
+                        taken.append(entry[2])
+                # Its heap entries are skipped as stale by _poll
+                self.readyHosts.discard(host)
+            finished = self._finish_if_done()
+        for url in taken:
+            urlId = url_id(url)
+            self.save.remove(urlId)
+            self.handedOver.add(urlId)
+        if finished:
+            self._notify_listeners()
+        return taken
+
     def mark_url_complete(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
+        url = canonicalize_url(url)
+        urlId = url_id(url)
+        if urlId not in self.save:
             # This should not happen.
             self.logger.error(
                 f"Completed url {url}, but have not seen it before.")
-        with self.frontierLock:
-            self.save[urlhash] = (url, True)
-            self.save.sync()
+        self.save.complete(urlId)
 
 
     def remove_url(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
+        url = canonicalize_url(url)
+        # Delete the url from the frontier
+        if not self.save.remove(url_id(url)):
             # This should not happen.
             self.logger.error(
                 f"Deleting url {url}, but have not seen it before.")
-        with self.frontierLock:
-            try:
-                # Delete the url from the frontier
-                del self.save[urlhash]
-                self.save.sync()
-            except:
-                self.logger.error(f"failed delete on {url}")
\ No newline at end of file
+
+    def close(self):
+        # Commit what is still waiting for the next group commit
+        self.save.close()
@@ -0,0 +1,23 @@
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+import scraper
+
+
+def make_parse_pool(processes):
+    # Pool of parser processes, or None to parse on the worker threads.
+    # Children are started by a fork server (or spawned where there is none)
+    # rather than forked from the crawler, which already runs threads.
+    if processes <= 0:
+        return None
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context)
+
+
+def analyze_page(parser, url, content):
+    # What the parser processes run. Submitting this function rather than
+    # scraper.analyze_page makes them import the crawler package before
+    # scraper, the order the two need.
+    return scraper.analyze_page(parser, url, content)
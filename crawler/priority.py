@@ -0,0 +1,82 @@
+import math
+import time
+
+
+# The frontier hands out the queued url with the lowest cost first. The cost
+# of a url is a weighted sum of features, picked with PRIORITY in
+# config.ini ("depth:1, inlinks:1, coverage:1"). A url feature is
+# feature(parsedUrl, inlinks, lowInfo) -> points; new features are added to
+# URL_FEATURES, like parsers to PARSERS.
+
+def path_depth(parsed, inlinks, lowInfo):
+    # Path segments, and one more for a query: top level pages come first
+    depth = sum(1 for segment in parsed.path.split("/") if segment)
+    return depth + 1 if parsed.query else depth
+
+
+def inlink_count(parsed, inlinks, lowInfo):
+    # Urls linked from more pages come first
+    return -math.log2(inlinks)
+
+
+def low_info_parent(parsed, inlinks, lowInfo):
+    # Urls found on a low information page come last
+    return 1.0 if lowInfo else 0.0
+
+
+URL_FEATURES = {"depth": path_depth, "inlinks": inlink_count, "lowinfo": low_info_parent}
+
+# coverage is a feature of the host rather than of the url: hosts the crawl
+# fetched fewer pages of come first, so every host gets covered
+HOST_FEATURES = ("coverage",)
+
+
+def parse_weights(text):
+    # "depth:1, inlinks:0.5" -> {"depth": 1.0, "inlinks": 0.5}, a feature
+    # without a weight weighs 1
+    weights = dict()
+    for part in text.split(","):
+        name, _, weight = part.partition(":")
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in URL_FEATURES and name not in HOST_FEATURES:
+            raise ValueError(
+                f"Unknown priority feature {name}, expected some of "
+                f"{', '.join(list(URL_FEATURES) + list(HOST_FEATURES))}")
+        weights[name] = float(weight) if weight.strip() else 1.0
+        if weights[name] < 0:
+            raise ValueError(
+                f"Priority feature {name} has a negative weight {weight.strip()}, "
+                f"weights must be 0 or more")
+    return weights
+
+
+class UrlScorer(object):
+    # Keys of the frontier queues. Costs are fixed when a url is queued (or
+    # linked again), so a url waiting behind better ones would wait forever;
+    # with aging, every aging seconds a url waits is worth one point of cost
+    # against urls queued later. Without any weight the frontier is FIFO.
+    def __init__(self, weights, aging=0.0):
+        self.urlWeights = [
+            (URL_FEATURES[name], weight) for name, weight in weights.items()
+            if name in URL_FEATURES and weight]
+        self.coverageWeight = weights.get("coverage", 0.0)
+        # The frontier only keeps count of the links to queued urls for this
+        self.usesInlinks = bool(weights.get("inlinks"))
+        self.aging = aging
+        self.started = time.monotonic()
+
+    def key(self, parsed, inlinks, lowInfo, queuedAt):
+        cost = 0.0
+        for feature, weight in self.urlWeights:
+            cost += weight * feature(parsed, inlinks, lowInfo)
+        if self.aging:
+            cost += (queuedAt - self.started) / self.aging
+        return cost
+
+    def host_cost(self, fetched):
+        # Added to the key of the best url of a host fetched pages of
+        if not self.coverageWeight:
+            return 0.0
+        return self.coverageWeight * math.log2(1 + fetched)
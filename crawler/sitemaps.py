@@ -0,0 +1,144 @@
+import gzip
+
+from collections import deque
+from io import BytesIO
+from threading import Thread, Condition
+from urllib.parse import urlparse, urljoin
+
+import scraper
+from utils import get_logger
+from utils.download import download
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class _BoundedReader(object):
+    # Returns end of file after limit bytes, so a huge or gzip bombed
+    # sitemap is never inflated whole
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class SitemapIngester(object):
+    # Reads sitemaps on its own thread, so workers only queue them and go on
+    # crawling. Each sitemap is downloaded once, waiting its turn on the host
+    # like any other request, then parsed incrementally (gzip sitemaps are
+    # inflated on the fly) and its urls are added to the frontier in batches
+    # of batchSize. Sitemap indexes are followed maxDepth levels deep, at
+    # most maxUrls urls are taken from the sitemaps of one site and at most
+    # maxBytes are read from one sitemap.
+    def __init__(self, crawler, maxDepth=2, maxUrls=50000, maxBytes=50 * 1024 * 1024, batchSize=500):
+        self.crawler = crawler
+        self.config = crawler.config
+        self.frontier = crawler.frontier
+        self.logger = get_logger("SITEMAPS")
+        self.maxDepth = maxDepth
+        self.maxUrls = maxUrls
+        self.maxBytes = maxBytes
+        self.batchSize = batchSize
+
+        self.jobs = deque()
+        self.jobsChanged = Condition()
+        self.queued = set()
+        # Only used by the ingester thread
+        self.siteUrls = dict()
+        self.closed = False
+
+        self.thread = Thread(target=self._run, name="SitemapIngester", daemon=True)
+        self.thread.start()
+
+    def submit(self, sitemapUrls, site, depth=0):
+        # Queues the sitemaps found for site and returns right away. Every
+        # queued sitemap holds the frontier open until it has been read.
+        with self.jobsChanged:
+            for url in sitemapUrls:
+                if url in self.queued or self.closed:
+                    continue
+                self.queued.add(url)
+                self.frontier.hold()
+                self.jobs.append((url, site, depth))
+            self.jobsChanged.notify()
+
+    def _run(self):
+        while True:
+            with self.jobsChanged:
+                while not self.jobs and not self.closed:
+                    self.jobsChanged.wait()
+                if not self.jobs:
+                    return
+                url, site, depth = self.jobs.popleft()
+            try:
+                self._ingest(url, site, depth)
+            except Exception as e:
+                self.logger.error(f"Failed to read sitemap {url}: {e}")
+            finally:
+                self.frontier.unhold()
+
+    def _ingest(self, url, site, depth):
+        host = urlparse(url).hostname
+        if self.siteUrls.get(site, 0) >= self.maxUrls:
+            return
+        if not self.frontier.acquire_host(host):
+            # The crawl is over
+            return
+        try:
+            resp = download(url, self.config, self.logger, self.crawler.session)
+        finally:
+            self.frontier.release_host(host)
+        if resp.status != 200 or resp.raw_response is None:
+            self.logger.info(f"Could not get sitemap {url} <{resp.status}>")
+            return
+
+        content = resp.content
+        stream = BytesIO(content)
+        if content[:2] == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=stream)
+        stream = _BoundedReader(stream, self.maxBytes)
+
+        self.logger.info(f"Parsing sitemap {url}")
+        batch = []
+        taken = self.siteUrls.get(site, 0)
+        try:
+            for kind, loc in self.crawler.parser.iter_sitemap(stream):
+                loc = urljoin(url, loc)
+                if kind == "sitemap":
+                    if depth < self.maxDepth:
+                        self.submit([loc], site, depth + 1)
+                    continue
+                batch.append(loc)
+                if len(batch) >= self.batchSize:
+                    taken = self._add_batch(batch, site, taken)
+                    batch = []
+                    if taken >= self.maxUrls:
+                        break
+        finally:
+            # What was read before an error is kept
+            if batch:
+                taken = self._add_batch(batch, site, taken)
+            self.siteUrls[site] = taken
+        if taken >= self.maxUrls:
+            self.logger.info(f"Reached the limit of {self.maxUrls} sitemap urls for {site}")
+
+    def _add_batch(self, batch, site, taken):
+        # Filters a batch in one pass, keeps what fits in the budget of the
+        # site and returns the new number of urls taken from it
+        valid = scraper.is_valid_many(self.crawler, batch)[:self.maxUrls - taken]
+        self.frontier.add_urls(valid)
+        return taken + len(valid)
+
+    def close(self):
+        # Queued sitemaps are dropped once the crawl is over
+        with self.jobsChanged:
+            self.closed = True
+            self.jobsChanged.notify()
+        self.thread.join()
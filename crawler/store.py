@@ -0,0 +1,283 @@
+import json
+import os
+import time
+
+from array import array
+from threading import Thread, Lock, Condition
+
+from utils.metrics import TimedLock
+from utils.seen_set import SeenSet, write_table_snapshot, read_table_snapshot
+
+# Bytes of the log before the checkpoint position kept in the checkpoint, to
+# tell that the log it was made from is still the one on disk
+TAIL_BYTES = 64
+
+
+def log_tail(path, position):
+    # The TAIL_BYTES bytes of the file at path before position, as hex
+    start = max(0, position - TAIL_BYTES)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(position - start).hex()
+
+
+class FrontierStore(object):
+    # Durable state of the Frontier: the 64-bit id of every url ever added, in
+    # a compact SeenSet, and the url of those not completed yet. Every change
+    # is appended to a log file; instead of syncing on each change, changes are
+    # grouped and committed (written and fsynced) by a background thread every
+    # commitInterval seconds or once commitBatch of them are waiting. The log
+    # is compacted to one record per url once it holds mostly stale records.
+    #
+    # Every checkpointInterval seconds (and on close) the seen ids, as the
+    # table in memory, and the pending urls are written to a checkpoint
+    # with the log position they are up to date with. On start the
+    # checkpoint is loaded and only the log after it is replayed, so
+    # startup does not grow with the number of urls ever seen; without a
+    # checkpoint matching the log, the whole log is replayed. Either way a
+    # record torn by a crash is ignored.
+    ADD, COMPLETE, REMOVE = "a", "c", "r"
+
+    def __init__(self, path, commitInterval=1.0, commitBatch=1000, compactRatio=3, compactMinimum=10000,
+                 bloomBitsPerItem=0, checkpointInterval=60.0):
+        self.path = path
+        self.checkpointPath = path + ".checkpoint"
+        self.checkpointInterval = checkpointInterval
+        self.commitInterval = commitInterval
+        self.commitBatch = commitBatch
+        self.compactRatio = compactRatio
+        self.compactMinimum = compactMinimum
+
+        self.lock = TimedLock("frontier_log")
+        self.commitLock = Lock()
+        self.pendingChanged = Condition(self.lock)
+        self.seen = SeenSet(bloomBitsPerItem=bloomBitsPerItem)
+        self.pendingUrls = dict()
+        self.pending = list()
+        self.logRecords = 0
+        self.closed = False
+        # How the state was loaded, for the frontier's log
+        self.fromCheckpoint = False
+        self.replayedRecords = 0
+
+        self._replay()
+        self.lastCheckpoint = time.monotonic()
+        self.log = open(self.path, "a", encoding="utf-8")
+        self.committer = Thread(target=self._commit_loop, name="FrontierStore", daemon=True)
+        self.committer.start()
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            # A checkpoint of a log deleted to start over
+            if os.path.exists(self.checkpointPath):
+                os.remove(self.checkpointPath)
+            return
+        goodBytes = self._load_checkpoint()
+        with open(self.path, "rb") as f:
+            f.seek(goodBytes)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record cut short by a crash, everything after it is lost
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self._apply(record)
+                self.logRecords += 1
+                self.replayedRecords += 1
+                goodBytes += len(line)
+        if goodBytes != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(goodBytes)
+
+    def _load_checkpoint(self):
+        # Loads the checkpoint if it was made from this log, returns the log
+        # position it is up to date with (0 without one)
+        snapshot = read_table_snapshot(self.checkpointPath)
+        if snapshot is None:
+            return 0
+        header, table = snapshot
+        position = header["position"]
+        if position > os.path.getsize(self.path) or log_tail(self.path, position) != header["tail"]:
+            return 0
+        self.seen.load_table(table, header["count"])
+        self.pendingUrls = dict(header["pending"])
+        self.logRecords = header["logRecords"]
+        self.fromCheckpoint = True
+        return position
+
+    def _checkpoint(self):
+        # Caller holds commitLock, so nothing is written to the log meanwhile.
+        # Records not committed yet are already part of the state, like for
+        # _compact, replaying them after the checkpoint leaves the same state.
+        with self.lock:
+            header = {"pending": list(self.pendingUrls.items()), "logRecords": self.logRecords}
+            table, count = self.seen.table()
+        self.log.flush()
+        position = os.fstat(self.log.fileno()).st_size
+        header["tail"] = log_tail(self.path, position)
+        header["position"] = position
+        write_table_snapshot(self.checkpointPath, table, count, header)
+        self.lastCheckpoint = time.monotonic()
+
+    def _apply(self, record):
+        kind, urlId = record[0], record[1]
+        if kind == self.ADD:
+            self.seen.add(urlId)
+            self.pendingUrls[urlId] = record[2]
+        elif kind == self.COMPLETE:
+            self.seen.add(urlId)
+            self.pendingUrls.pop(urlId, None)
+        elif kind == self.REMOVE:
+            # Still seen, it is not added again
+            self.pendingUrls.pop(urlId, None)
+
+    def _append(self, record):
+        # Caller holds the lock
+        self._apply(record)
+        self.pending.append(record)
+        if len(self.pending) >= self.commitBatch:
+            self.pendingChanged.notify()
+
+    def __len__(self):
+        return len(self.seen)
+
+    def __contains__(self, urlId):
+        # No lock, see SeenSet
+        return urlId in self.seen
+
+    def __bool__(self):
+        return len(self.seen) > 0
+
+    def pending_urls(self):
+        # Urls added but not completed or removed yet
+        with self.lock:
+            return list(self.pendingUrls.values())
+
+    def add(self, urlId, url):
+        # Returns True if the url was not in the store yet
+        with self.lock:
+            if urlId in self.seen:
+                return False
+            self._append([self.ADD, urlId, url])
+            return True
+
+    def add_many(self, items, again=False):
+        # items: (urlId, url) pairs, returns the urls that were new, all of
+        # them end up in the same group commit. With again, urls already
+        # seen are added back too (a removed url that has to be crawled
+        # after all).
+        added = []
+        with self.lock:
+            for urlId, url in items:
+                if again or urlId not in self.seen:
+                    self._append([self.ADD, urlId, url])
+                    added.append(url)
+        return added
+
+    def add_completed(self, items):
+        # items: (urlId, url) pairs of urls to download again, returns the
+        # urls that were added, those still waiting are left as they are
+        added = []
+        with self.lock:
+            for urlId, url in items:
+                if urlId not in self.pendingUrls:
+                    self._append([self.ADD, urlId, url])
+                    added.append(url)
+        return added
+
+    def completed_ids(self):
+        # Ids seen and no longer waiting to be downloaded
+        with self.lock:
+            return [urlId for urlId in self.seen if urlId not in self.pendingUrls]
+
+    def complete_many(self, urlIds):
+        with self.lock:
+            for urlId in urlIds:
+                self._append([self.COMPLETE, urlId])
+
+    def complete(self, urlId):
+        with self.lock:
+            self._append([self.COMPLETE, urlId])
+
+    def remove(self, urlId):
+        # Returns False if the url was not waiting to be downloaded
+        with self.lock:
+            if urlId not in self.pendingUrls:
+                return False
+            self._append([self.REMOVE, urlId])
+            return True
+
+    def _commit_loop(self):
+        while True:
+            with self.lock:
+                if not self.closed and len(self.pending) < self.commitBatch:
+                    self.pendingChanged.wait(self.commitInterval)
+                closed = self.closed
+            self._commit()
+            if closed:
+                return
+
+    def _commit(self):
+        # One write and one fsync for the whole group. Only the swap of the
+        # pending list holds the main lock, so adds are never blocked on disk.
+        with self.commitLock:
+            with self.lock:
+                batch, self.pending = self.pending, list()
+            if not batch:
+                return
+            self.log.write("".join(json.dumps(record) + "\n" for record in batch))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            with self.lock:
+                self.logRecords += len(batch)
+                compacted = self.logRecords > max(self.compactMinimum, self.compactRatio * len(self.seen))
+            if compacted:
+                self._compact()
+            # A checkpoint of the log before the compaction is useless
+            if compacted or (self.checkpointInterval
+                             and time.monotonic() - self.lastCheckpoint >= self.checkpointInterval):
+                self._checkpoint()
+
+    def _compact(self):
+        # Caller holds commitLock. Rewrite the log with one record per url and
+        # swap it in atomically, done urls only keep their id. The log is
+        # written from a copy of the state taken under the main lock, and only
+        # the swap holds it again, so adds are not blocked on the rewrite; the
+        # records of the adds made meanwhile wait in pending and go to the new
+        # log with the next commit. Records pending when the copy was taken
+        # are already part of it, replaying them again leaves the same state.
+        with self.lock:
+            table, count = self.seen.table()
+            pendingUrls = dict(self.pendingUrls)
+        seenIds = array("Q")
+        seenIds.frombytes(table)
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w", encoding="utf-8") as f:
+            for urlId in seenIds:
+                if urlId and urlId not in pendingUrls:
+                    f.write(json.dumps([self.COMPLETE, urlId]) + "\n")
+            for urlId, url in pendingUrls.items():
+                f.write(json.dumps([self.ADD, urlId, url]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self.log.close()
+            os.replace(tmpPath, self.path)
+            self.log = open(self.path, "a", encoding="utf-8")
+            self.logRecords = count
+
+    def sync(self):
+        # Commit everything written so far before returning
+        self._commit()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.pendingChanged.notify()
+        # The committer writes the last group before it stops
+        self.committer.join()
+        with self.commitLock:
+            self._checkpoint()
+        self.log.close()
@@ -1,22 +1,23 @@
-from threading import Thread, Lock
+from threading import Thread
 
 from inspect import getsource
 from utils.download import download
-from urllib import robotparser
-from utils import get_logger, normalize, get_urlhash
+from utils import get_logger
+from utils.metrics import get_metrics
+from utils.page_states import NEW, UNCHANGED
 import scraper
 import time
-from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
 
 
 class Worker(Thread):
-    def __init__(self, worker_id, config, frontier, crawler):
-        self.logger = get_logger(f"Worker-{worker_id}", "Worker")
+    def __init__(self, worker_id, config, frontier, crawler, logger=None):
+        self.logger = logger if logger else get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
         self.frontier = frontier
         self.crawler = crawler
         self.workerId = worker_id
+        self.metrics = get_metrics()
         # basic check for requests in scraper
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
         assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
@@ -24,174 +25,152 @@ class Worker(Thread):
         
     def run(self):
         while True:
+            # Blocks while there is nothing to fetch yet, None means the
+            # frontier is empty and no other worker can add to it anymore
             tbd_url = self.frontier.get_tbd_url()
-            # Check if all of the threads are inactive
-            # if they are then stop crawling on all threads
-            if all(not x for x in self.crawler.activeArray):
+            if tbd_url is None:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
 
-            # set thread status in array
-            if not tbd_url:
-                self.crawler.activeArray[self.workerId] = False
-                continue
-            else:
-                 self.crawler.activeArray[self.workerId] = True
-                 
-            # Check if there is a lock already existing in the dict for this hostname
-            parsed = urlparse(tbd_url)
-
-            # Lock editing rights to the dict
-            with self.crawler.politeLockDictLock:
-                # add new lock if hostname is new
-                if not parsed.hostname in self.crawler.politeLocksDict:
-                    self.crawler.politeLocksDict[parsed.hostname] = Lock()
-            
-            # Lock the hostname and then do our stuff then wait then free
-            with self.crawler.politeLocksDict[parsed.hostname]:
-                
-                # Check if we have permission to crawl the site
-                if not self.checkRobotTxt(tbd_url):
-                    self.crawler.logger.info(f"Found blackisted site : {tbd_url}")
-                    self.frontier.remove_url(tbd_url)
-                    continue
-
-                resp = download(tbd_url, self.config, self.logger)
-
-                # Wait for keeping lock locked while not polite
-                time.sleep(self.config.time_delay)
-
-                # Handle none type
-                if resp and resp.raw_response:
-                    self.logger.info(
-                        f"Downloaded {tbd_url}, status <{resp.status}>, "
-                        f"using cache {self.config.cache_server}.")
-
-                    # Handle website redirects and make sure we index the redirected content
-                    if (resp.status == 301 or resp.status == 302 or tbd_url != resp.url):
-                        # Delete url from frontier 
-                        self.frontier.remove_url(tbd_url)
-                        # Add redirected url
-                        self.frontier.add_url(resp.url)
-                    
-                    # Update the count of the URLS
-                    scraper.updateURLCount(self.crawler, resp.url)
-                    
-                    if(resp.status == 200 or resp.status == 301 or resp.status == 302):
-                        
-                        # Actually scrape the response
-                        scraped_urls = scraper.scraper(self.crawler, resp.url, resp)
-                        ### Code for questions on assignement
-                        scraper.updateTokens(self.crawler , resp)
-                        scraper.updateSubDomains(self.crawler, resp.url)
-                        # Check whether we need robots.txt
-                        if scraper.checkUniqueNetloc(self.crawler, resp.url):
-                            self.crawler.logger.info("Getting robot txt")
-                            # get netloc
-                            netloc = normalize(parsed.netloc)
-                            # get robots.txt URL
-                            robots_url = parsed.scheme + "://" + netloc + "/robots.txt"
-                            self.crawler.logger.info("Parsing robots.txt")
-                            robotResp = download(robots_url, self.frontier.config)
-
-                            # Maintain politness with robot txt request
-                            time.sleep(self.config.time_delay)
-
-                            # Check again that the response is not a none type
-                            if robotResp:
-                                # Check if the response is successful
-                                if robotResp.status == 200:
-                                    # Parse robots.txt content
-                                    robots_content = robotResp.raw_response.content.decode('utf-8')
-                                    sitemap_urls = []
-                                    for line in robots_content.split('\n'):
-                                        if line.startswith("Sitemap:"):
-                                            sitemap_urls.append(line.split(":", 1)[1].strip())
-
-                                    # Function to recursively parse sitemaps
-                                    def parse_sitemap(sitemap_url):
-                                        # Download the xml file from the website
-                                        sitemap_resp = download(sitemap_url, self.frontier.config)
-
-                                        # Maintain politness with robot txt request
-                                        time.sleep(self.config.time_delay)
-                                        
-                                        # Handle the none object return case
-                                        if sitemap_resp and sitemap_resp.raw_response:
-                                            # Use beautiful soup to parse the xml
-                                            sitemap_soup = BeautifulSoup(sitemap_resp.raw_response.content, "xml")
-
-                                            # Get all instances of url in the site map and extract the link
-                                            #<url> <loc> </loc> </url>
-                                            sitemap_links = sitemap_soup.find_all("url")
-                                            for link in sitemap_links:
-                                                if link:
-                                                    # Get the location within the url tags
-                                                    actualURL = link.find("loc").text
-                                                    print(f"appending {actualURL}")
-                                                    if scraper.is_valid(self.crawler, actualURL):
-                                                        scraped_urls.append(urljoin(resp.url, actualURL))
-
-                                            # If there are nested sitemaps call recursive
-                                            nested_sitemaps = sitemap_soup.find_all("sitemap")
-                                            for nested_sitemap in nested_sitemaps: 
-                                                nested_sitemap_url = nested_sitemap.find("loc").text
-                                                parse_sitemap(nested_sitemap_url)
-                                        else:
-                                            # Return nothing if the site map wasn't succesfully gotten
-                                            return []
-
-                                    # Parse each sitemap recursively
-                                    self.crawler.logger.info("Parsing sitemaps")
-                                    for sitemap_url in sitemap_urls:
-                                        parse_sitemap(sitemap_url)
-                                        
-                        ## END
-                        # Another level of insurance to catch none type links
-                        scraped_urls = [link for link in scraped_urls if link]
-
-                        # add found links to be searched in the frontier
-                        for scraped_url in scraped_urls:
-                            if scraper.is_valid(self.crawler, scraped_url):
-                                self.frontier.add_url(scraped_url)
-                
-                # Mark this url complete regardless of the outcome
-                self.frontier.mark_url_complete(resp.url)
-                
-
+            # The frontier only hands out urls whose host is polite to fetch
+            # right now, and holds the host back until we release it
+            try:
+                self.crawl_url(tbd_url)
+            except Exception as e:
+                self.logger.error(f"Failed to crawl {tbd_url}: {e}")
+            finally:
+                self.frontier.release_url(tbd_url)
+
+    def crawl_url(self, tbd_url):
+        if self.check_trap(tbd_url):
+            return
+
+        # Check if we have permission to crawl the site
+        with self.metrics.timer("robots"):
+            allowed = self.checkRobotTxt(tbd_url)
+        if not allowed:
+            self.crawler.logger.info(f"Found blackisted site : {tbd_url}")
+            self.frontier.remove_url(tbd_url)
+            return
+
+        with self.metrics.timer("download"):
+            resp = download(tbd_url, self.config, self.logger, self.crawler.session)
+        self.process_response(tbd_url, resp)
+
+    def process_response(self, tbd_url, resp):
+        # Everything done with a downloaded page, shared by the thread and asyncio workers
+        with self.metrics.timer("process"):
+            self._process_response(tbd_url, resp)
+
+    def _process_response(self, tbd_url, resp):
+        parsed = urlparse(tbd_url)
+        self.metrics.count(f"status.{resp.status}")
+
+        # Handle none type. A requests.Response is false for a 4xx or 5xx
+        # status (bool is its .ok), so those answers were never counted,
+        # logged nor parsed; the status of the answer, which the cache server
+        # copies from it, tells as much without loading the page.
+        if resp.status is not None and resp.status < 400 and resp.raw_response is not None:
+            timing = ""
+            if resp.timing:
+                self.metrics.observe("download.connect", resp.timing["connect"])
+                self.metrics.observe("download.wait", resp.timing["wait"])
+                self.metrics.observe("download.transfer", resp.timing["transfer"])
+                timing = (
+                    f" connect {resp.timing['connect']:.3f}s, wait {resp.timing['wait']:.3f}s, "
+                    f"transfer {resp.timing['transfer']:.3f}s.")
+            self.logger.info(
+                f"Downloaded {tbd_url}, status <{resp.status}>, "
+                f"using cache {self.config.cache_server}.{timing}")
+
+            # Handle website redirects and make sure we index the redirected content
+            if (resp.status == 301 or resp.status == 302 or tbd_url != resp.url):
+                # Delete url from frontier 
+                self.frontier.remove_url(tbd_url)
+                # Add redirected url
+                self.frontier.add_url(resp.url)
+
+            # Update the count of the URLS
+            scraper.updateURLCount(self.crawler, resp.url)
+
+            if((resp.status == 200 or resp.status == 301 or resp.status == 302)
+                    and self.check_changed(resp)):
+
+                # Actually scrape the response
+                scraped_urls = scraper.scraper(self.crawler, resp.url, resp)
+                ### Code for questions on assignement
+                # A changed page was already counted when it was first crawled
+                if not resp.revisit:
+                    scraper.updateTokens(self.crawler , resp)
+                    scraper.updateSubDomains(self.crawler, resp.url)
+                # Check whether we need the sitemaps of the site
+                if scraper.checkUniqueNetloc(self.crawler, resp.url):
+                    # The robots.txt was read when checking this url, its
+                    # Sitemap lines are kept with its rules. The sitemaps are
+                    # read in the background and feed the frontier directly.
+                    robotRules, _ = self.crawler.robots.lookup(resp.url)
+                    if robotRules.sitemaps:
+                        self.crawler.sitemaps.submit(robotRules.sitemaps, urlparse(resp.url).netloc)
+
+                ## END
+                # add found links to be searched in the frontier, all in one
+                # commit; scraper already dropped the invalid ones and the
+                # trap detector those of templates that stopped giving content
+                scraped_urls = self.crawler.traps.admit_many(scraped_urls)
+                analysis = getattr(resp, "analysis", None)
+                self.frontier.add_urls(scraped_urls, lowInfo=bool(analysis and analysis.lowInfoReason))
+
+        elif resp.status in (404, 410):
+            # Gone, it is not revisited by a re-crawl anymore
+            self.crawler.pageStates.remove(resp.url)
+
+        # Whether a first fetch of the url gave new content, for the trap
+        # detector; scraper sets resp.novel. Only pages that were analyzed
+        # count: redirects, errors and cache server hiccups say nothing of
+        # the content of a template and would block it for good.
+        if resp.status == 200 and not getattr(resp, "revisit", False):
+            self.crawler.traps.record(tbd_url, getattr(resp, "novel", False))
+
+        if resp.status is None:
+            # The cache server could not be reached (download gave up after
+            # its retries): the url stays pending in the save file, so it is
+            # fetched again when the crawl is resumed
+            self.logger.warning(f"Leaving {tbd_url} pending: {resp.error}")
+            return
+
+        # Mark this url complete regardless of the outcome
+        self.frontier.mark_url_complete(resp.url)
+
+
+    def check_trap(self, url):
+        # True if url was queued before its template got blocked as a trap,
+        # it is dropped without being fetched
+        if not self.crawler.traps.is_blocked(url):
+            return False
+        self.metrics.count("traps.skipped")
+        self.logger.info(f"Skipping {url}, its url template is blocked as a trap.")
+        self.frontier.remove_url(url)
+        return True
+
+    def check_changed(self, resp):
+        # Records the fetch of a page for re-crawls, returns False when it
+        # was fetched before and did not change since: its links, tokens and
+        # fingerprints are those of then, so it is not parsed again. Sets
+        # resp.revisit for a page fetched before.
+        state = self.crawler.pageStates.update(resp.url, resp.headers, resp.content)
+        self.metrics.count(f"pages.{state}")
+        resp.revisit = state != NEW
+        return state != UNCHANGED
 
     def checkRobotTxt(self, url):
-        # get important strings
-        parsed = urlparse(url)
-        parsedNetloc = parsed.netloc
-        parsedScheme = parsed.scheme
-
-        # Sometimes netloc can be in bytes, ifso, decode to string
-        if isinstance(parsedNetloc, bytes):
-            parsedNetloc = netloc.decode('utf-8')  
-        if isinstance(parsedScheme, bytes):
-            parsedScheme = parsedScheme.decode('utf-8')  
-        
-        # sometimes the netloc has www which crashes the code
-        netloc = normalize(parsedNetloc.strip("www."))
-
-        # Reserve the shelve
-        with self.crawler.robotTxtLock:
-                # Check if the robot txt has already been fetched
-                if netloc in self.crawler.robotTxt.keys():
-                    parser = self.crawler.robotTxt[netloc]
-                    return parser.can_fetch(self.crawler.config.user_agent, url)
-                else:
-                    # fetch new robot txt
-                    parser = robotparser.RobotFileParser()
-                    parser.set_url(parsedScheme + "://" + netloc + "/robots.txt")
-                    try:
-                        parser.read()
-                        # Maintain politness with robot txt request
-                        time.sleep(self.config.time_delay)
-                        self.crawler.robotTxt[netloc] = parser
-                        return parser.can_fetch(self.crawler.config.user_agent, url)
-                    except Exception as e:
-                        return True
-
-        
\ No newline at end of file
+        # The rules come from the robots cache, only the first worker on a
+        # site downloads its robots.txt and no lock is held while it does
+        rules, downloaded = self.crawler.robots.lookup(url)
+        delay = self.config.time_delay
+        if rules.crawlDelay:
+            delay = max(delay, min(rules.crawlDelay, self.config.max_crawl_delay))
+            self.frontier.set_crawl_delay(urlparse(url).hostname, delay)
+        if downloaded:
+            # Maintain politness with robot txt request
+            time.sleep(delay)
+        return rules.can_fetch(url)
@@ -5,11 +5,20 @@ from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
 import atexit
+import os
 
-def main(config_file, restart):
+def main(config_file, restart, node=None, coordinator=None, recrawl=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
+    if node:
+        # Every node keeps its frontier, logs and statistics in its own directory
+        nodeDir = os.path.join("nodes", node)
+        os.makedirs(nodeDir, exist_ok=True)
+        os.chdir(nodeDir)
+        config.node = node
+        config.coordinator = coordinator
+    config.recrawl = recrawl
     config.cache_server = get_cache_server(config, restart)
     crawler = Crawler(config, restart)
     crawler.start()
@@ -19,6 +28,9 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--node", type=str, default=None)
+    parser.add_argument("--coordinator", type=str, default="127.0.0.1:9100")
+    parser.add_argument("--recrawl", action="store_true", default=False)
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.node, args.coordinator, args.recrawl)
         
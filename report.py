@@ -1,43 +1,51 @@
-import shelve
+import os
+import sys
+
+from itertools import islice
+from utils.crawl_report import read_report
 
 def generate_report(title, stats, file):
     f.write(f"----- {title} -----\n")
     if type(stats) == dict:
         for key, value in stats.items():
             f.write(f"{key} {value}\n")
-    elif type(stats) == list:
-        for value in stats:
-            f.write(f"{value}\n")
     elif type(stats) == int:
         f.write(f"{stats}\n")
+    else:
+        # lists, or any iterable streamed one line at a time
+        for value in stats:
+            f.write(f"{value}\n")
     f.write("------------------\n")
 
 
 if __name__ == "__main__":
+    # report.json is the snapshot the crawler keeps up to date, it can be
+    # read while a crawl is running
+    if not os.path.exists("report.json"):
+        sys.exit("report.json not found: it is written by the crawler while it runs, "
+                 "start a crawl with python3 launch.py from this folder first.")
+    snapshot = read_report("report.json")
+
     with open("report.txt", "w") as f:
 
-        tokens = shelve.open("tokens.shelve")
-        urlCount = shelve.open("uniquePages.shelve")
-        subDomains = shelve.open("subDomains.shelve")
-        longest = shelve.open("longest.shelve")
-        robot = shelve.open("robotTXTs.shelve")
-    
-        generate_report("Number of unique pages ", len(urlCount),f)
-
-        generate_report("Number of tokens", len(tokens), f)
-        generate_report("Longest page", list(longest.items()), f)
-        
-        sorted_dict = list(sorted(tokens.items(), key=lambda item: (-item[1], item[0])))
-        generate_report("Top 50 tokens", sorted_dict[:50], f)
-
-        sorted_URL_subdomains = dict(sorted(subDomains.items(), key=lambda item: (-item[1], item[0])))
-       
+        generate_report("Number of unique pages ", snapshot["pageCount"],f)
+
+        generate_report("Number of tokens", snapshot["tokenCount"], f)
+        generate_report("Longest page", [("Longest", tuple(snapshot["longest"]))], f)
+
+        generate_report("Top 50 tokens", [tuple(token) for token in snapshot["topTokens"]], f)
+
+        sorted_URL_subdomains = dict(sorted(snapshot["subDomains"].items(), key=lambda item: (-item[1], item[0])))
+
         generate_report("Top subdomains", sorted_URL_subdomains, f)
 
-        generate_report("Lenght of robotTXTs", len(robot), f)
+        generate_report("Lenght of robotTXTs", snapshot["robotCount"], f)
+
+        # (template, pages fetched, yield, urls dropped), missing from older snapshots
+        generate_report("Url templates blocked as traps",
+                        [tuple(template) for template in snapshot.get("blockedTemplates", [])], f)
 
-    with open("uniquepages.txt", "w") as f:
-        generate_report("Number of pages", len(urlCount.items()), f)
-        results = dict(urlCount.items())
-        generate_report("Longest page", results, f)
-        
\ No newline at end of file
+    # The pages of the snapshot are the first pageCount lines of the list
+    with open("uniquepages.txt", "w") as f, open("uniquePages.log", "r", encoding="utf-8") as pages:
+        generate_report("Number of pages", snapshot["pageCount"], f)
+        generate_report("Unique pages", (page.rstrip("\n") for page in islice(pages, snapshot["pageCount"])), f)
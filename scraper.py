@@ -1,11 +1,12 @@
 import re
 from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
 import crawler
 import sys
 from collections import Counter
-from utils import get_logger, get_urlhash, normalize
+from utils import get_logger, normalize, canonicalize_url, url_id
 from utils.download import download
+from utils.fingerprint import content_fingerprint, simhash64
+from utils.metrics import get_metrics
 
 
 stopWords = {"we'd", 'his', "you're", 'its', "mustn't", "i'd", "you've", 'that', 'nor', 'only', 'both', 'because', 'through', 'from', 'herself', 'same', 'themselves', 'having', 'this', "we're", 'further', 'your', 'which', "that's", 'down', 'been', 'more', "weren't", 'why', 'with', 'some', 'them', 'below', 'their', "couldn't", 'if', 'then', 'in', 'about', 'i', 'of', "wouldn't", "she's", 'all', "i'm", 'than', 'what', 'when', 'against', 'so', 'he', 'did', "hadn't", 'those', "aren't", 'here', 'yours', "it's", 'be', 'until', "when's", 'no', 'an', "don't", 'not', 'were', "doesn't", 'me', 'on', "there's", 'at', 'any', 'out', "i've", 'over', 'have', 'has', 'we', "they've", "wasn't", "we'll", 'yourselves', 'whom', "hasn't", "they'll", 'a', 'to', 'but', "he'd", 'am', 'her', 'above', 'under', 'the', 'after', "they'd", 'doing', "haven't", 'should', 'him', 'is', 'other', "shouldn't", 'how', 'cannot', 'they', "i'll", 'itself', 'myself', 'himself', 'between', 'it', 'would', 'my', "they're", "she'll", 'ours', 'or', 'was', 'where', "won't", "can't", 'too', "here's", "where's", 'again', 'into', 'most', "let's", 'does', 'by', 'being', 'these', 'such', "he'll", "isn't", "didn't", "who's", 'few', "you'd", 'you', 'do', 'each', 'ourselves', "we've", 'yourself', 'who', 'during', 'our', 'are', "what's", "you'll", 'and', 'as', 'hers', 'once', 'up', 'off', "shan't", 'she', 'there', 'while', "he's", 'could', "how's", 'very', 'before', 'ought', 'for', 'had', "she'd", "why's", 'own', 'theirs'}
@@ -13,13 +14,66 @@ wordCountThreshold = 400
 contentToCodeRatioThreshold = 0.9
 uniqueWordRatioThreshold = 0.02
 linkToContentRatioThreshold = 10
-simHashThreshold = 0.65
-simHashQueueLength = 80
+# Pages whose 64-bit simhashes are at most this many bits apart are near duplicates
+simHashDistance = 3
+# Stage latencies and counters, see utils/metrics.py
+metrics = get_metrics()
+
+
+class ParsedPage(object):
+    # Everything the scraper needs from a page, built from one parse and one
+    # walk of the tree. Token lists are only computed when they are used.
+    def __init__(self, text, paragraphText, links, tagCounts):
+        self.text = text                    # same as soup.get_text()
+        self.paragraphText = paragraphText  # text of every <p>, each followed by a space
+        self.links = links                  # href of every <a>, then of every <url>
+        self.tagCounts = tagCounts          # Counter of tag names
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = tokenize_text(self.text)
+        return self._tokens
+
+
+class PageAnalysis(object):
+    # Everything the crawler keeps from a page, small enough to come back
+    # from a parser process: the rest of the parse is thrown away there
+    def __init__(self, links, fingerprint, simHash, lowInfoReason, tokenFrequencies, tokenCount):
+        self.links = links                        # absolute links, <a> then <url>
+        self.fingerprint = fingerprint            # content_fingerprint of the text
+        self.simHash = simHash                    # simhash64 of the tokens
+        self.lowInfoReason = lowInfoReason        # why the page is low information, or None
+        self.tokenFrequencies = tokenFrequencies  # paragraph tokens without stop words -> count
+        self.tokenCount = tokenCount              # number of those tokens, for the longest page
+
+
+def analyze_page(parser, url, content):
+    # All of the CPU work on a page: parse, tokenize, fingerprint, simhash
+    # and low information check. It only uses its arguments, so it can run
+    # in a parser process (see crawler/parse_pool.py).
+    page = ParsedPage(*parser.parse_html(content))
+    links = [urljoin(url, href) for href in page.links]
+    frequencies = count_tokens(page.paragraphText)
+    return PageAnalysis(
+        links, content_fingerprint(page.text), simHash(page), lowInfoReason(page, url),
+        frequencies, sum(frequencies.values()))
+
+
+def analyze_response(crawler, resp):
+    # Analyze a response at most once, on the parser processes when there
+    # are some; the PageAnalysis is cached on the response
+    analysis = getattr(resp, "analysis", None)
+    if analysis is None:
+        analysis = crawler.analyze_page(resp.url, resp.content)
+        resp.analysis = analysis
+    return analysis
 
 
 def scraper(crawler : crawler, url, resp): 
     links = extract_next_links(crawler, url, resp)
-    return [link for link in links if is_valid(crawler, link)]
+    return is_valid_many(crawler, links)
 
 def extract_next_links(crawler, url, resp):
     # url: the URL that was used to get the page
@@ -34,33 +88,40 @@ def extract_next_links(crawler, url, resp):
     hyperlinkList = []
 
     # handle none case
-    if (not resp) or (not resp.raw_response) or (not resp.raw_response.content):
+    if (not resp) or (not resp.raw_response) or (not resp.content):
         return []
     
-    # Parse the page content using beautiful soup
-    soup = BeautifulSoup(resp.raw_response.content, 'html.parser')
-    if not is_valid(crawler, resp.url):
+    if not is_valid(crawler, resp.url, checkSeen=False):
         return []
     # Check for repeated paths again just in case it got in here
     if re.match("^.*?(/.+?/).*?\1.*$|^.*?/(.+?/)\2.*$", resp.url):
         return []
+
+    # Parse the page content once, later stages reuse the same PageAnalysis
+    analysis = analyze_response(crawler, resp)
     
-    # Check for duplicates/near duplicates
-    if not checkDuplicate(crawler, soup, resp):
+    # Check for duplicates/near duplicates, a page changed since it was last
+    # crawled is not a duplicate of what it was then (see crawler/worker.py)
+    with metrics.timer("dedup"):
+        unique = getattr(resp, "revisit", False) or checkDuplicate(crawler, analysis, resp)
+    if not unique:
+        metrics.count("pages.duplicate")
         print(f"returning after checking hash for {resp.url}")
         return []
 
-    # Check for low information pages
-    if not checkLowInfo(crawler, soup, resp.url):
-        return []
+    # Check for low information pages, their links are dropped, or queued
+    # behind the others with LOWINFOLINKS = queue (see crawler/priority.py)
+    if analysis.lowInfoReason:
+        metrics.count("pages.low_info")
+        crawler.logger.warning(analysis.lowInfoReason)
+        if crawler.config.low_info_links == "drop":
+            return []
 
-    # Iterate through <a> objects, adding the hyperlink to list
-    for link in soup.find_all('a'):
-        hyperlinkList.append(urljoin(resp.url, link.get('href')))
-    
-    # Iterate through all urls, adding the hyperlink to list
-    for url in soup.find_all('url'):
-        hyperlinkList.append(urljoin(resp.url, url.get('href')))
+    # The page is new content, for the trap detector (see crawler/worker.py)
+    resp.novel = not analysis.lowInfoReason
+
+    # Hyperlinks of the <a> objects, then of the <url> objects
+    hyperlinkList.extend(analysis.links)
             
     # Print out specific invalid urls
     if resp.status == 403:
@@ -70,313 +131,143 @@ def extract_next_links(crawler, url, resp):
         
     return hyperlinkList
 
-def checkLowInfo(crawler, soup, url):
+def lowInfoReason(page, url):
+    # Returns why the page holds too little information, or None
 
     # Check for non html webpages
     pattern = r".*\.(r|txt|bib)$"
     if re.match(pattern, url):
-        return True
+        return None
     
     # Filter out super large webpages
-    if (sys.getsizeof(soup.get_text())  > 1024 * 1024): # Check if page is larger than 1 mb
-        crawler.logger.warning(f"too large of a webpage size for url: {url}")
-        return False
+    if (sys.getsizeof(page.text)  > 1024 * 1024): # Check if page is larger than 1 mb
+        return f"too large of a webpage size for url: {url}"
 
     # Check for low word count on page
-    totalWords = len(soup.get_text())
+    totalWords = len(page.text)
 
     if totalWords < wordCountThreshold:
-        crawler.logger.warning(f"low total words on {url}")
-        return False
+        return f"low total words on {url}"
     
     # Check Content to Code Ratio
-    HTMLCSSJSCount = len(soup.find_all(['html', 'head', 'meta', 'link', 'script', 'style']))
-    paragraphCount = len(soup.find_all('p'))
-    linkCount = len(soup.find_all('a'))
+    HTMLCSSJSCount = sum(page.tagCounts[tag] for tag in ['html', 'head', 'meta', 'link', 'script', 'style'])
+    paragraphCount = page.tagCounts['p']
+    linkCount = page.tagCounts['a']
     total_elements = HTMLCSSJSCount + paragraphCount + linkCount
 
     if total_elements == 0: # Ensure no divide by 0 errors
-        crawler.logger.warning(f"0 total_elements count on {url}")
-        return False
+        return f"0 total_elements count on {url}"
     
     if (HTMLCSSJSCount / total_elements) > contentToCodeRatioThreshold:
-        crawler.logger.warning(f"high html count of {HTMLCSSJSCount / total_elements} on {url}")
-        return False
+        return f"high html count of {HTMLCSSJSCount / total_elements} on {url}"
 
     # Check for low number of unique words
-    uniqueWords = re.findall(r'\b\w+\b', soup.get_text().lower())
+    uniqueWords = re.findall(r'\b\w+\b', page.text.lower())
     uniqueWordsCount = len(set(uniqueWords))
     
     if (uniqueWordsCount / totalWords) < uniqueWordRatioThreshold: # Total words guaranteed to be above 0 due to word count check
-        crawler.logger.warning(f"low unique words of {uniqueWordsCount / totalWords} on {url}")
-        return False
+        return f"low unique words of {uniqueWordsCount / totalWords} on {url}"
 
     #Check link-to-text ratio
     pageWithoutLinks = total_elements - linkCount
 
     if pageWithoutLinks == 0: # Ensure no divide by 0 errors
-       crawler.logger.warning(f"0 content count on {url}")
-       return False
+       return f"0 content count on {url}"
     
     if linkCount / pageWithoutLinks > linkToContentRatioThreshold:
-       crawler.logger.warning(f"high link to content ratio of {linkCount / pageWithoutLinks} on {url}")
-       return False
+       return f"high link to content ratio of {linkCount / pageWithoutLinks} on {url}"
     
-    return True
+    return None
     
 
-def is_valid(crawler : crawler, url):
+def is_valid(crawler : crawler, url, checkSeen=True):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
-    try:
-       
-        parsed = urlparse(url) # returns <scheme>://<netloc>/<path>;<params>?<query>#<fragment>
-        parsedNetloc = parsed.netloc
-
-        noFragmentURL = normalize(parsed.scheme+parsed.netloc+parsed.path)
-
-        # Update the unique pages count without fragments
-        with crawler.uniquePagesLock:
-            if noFragmentURL in crawler.uniquePages:
-                return False
-
-        # Detect calander enteries
-        date_pattern = r'\d{4}-\d{2}-\d{2}'
-        if re.search(date_pattern, url):
-            return False
-        # Ensure the netlock is a string for future functions
-        if isinstance(parsedNetloc, bytes):
-            parsedNetloc = parsed.netloc.decode('utf-8')  
-            
-        # Ensure we are in correct domains
-        if not checkDomain(parsedNetloc):
-            return False
-
-        
-            # Check for repeated paths 
-        if re.search(r'/([^/]+)/\1/', url):
-            return False
-        
-        # Ensure the link visited is http
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        
-        # Filter out any nonwebpage extensions
-        pattern = r"(css|js|bmp|gif|jpe?g|ico|png|tiff?|mid|mp2|mp3|mp4|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|epub|dll|cnf|tgz|sha1|thmx|mso|arff|rtf|jar|csv|rm|smil|wmv|swf|wma|zip|rar|gz)"
-
-        # Ignore capitalization 
-        compiled_pattern = re.compile(pattern, re.IGNORECASE)
-
-        # Search for the pattern anywhere in the path
-        # /pdf/file_name would still be a bad link
-        return not compiled_pattern.search(parsed.path.lower())
-
-
-    except TypeError:
-        print ("TypeError for ", parsed)
-        raise
-
-def checkDomain(netloc: str) -> bool:
-    # string netloc: Authority aspect of a URL: <scheme>://<netloc>/<path>;<params>?<query>#<fragment>
-    # Return whether netloc is a valid domain
-
-    # Available Domains
-    domains = ["ics.uci.edu", "cs.uci.edu", "informatics.uci.edu", "stat.uci.edu"]
-
-    parsed = netloc
-
-    # Sometimes netloc can be in bytes, ifso, decode to string
-    if isinstance(netloc, bytes):
-       parsed = netloc.decode('utf-8')  
-    
-    for domain in domains:
-        if domain in parsed:
-            return True
-    
-    # If netloc does not match any valid domains, return false
-    return False
-
-def checkDuplicate(crawler: crawler, soup, resp):
-    # For exact duplicates, use CRC to hash the page and compare to all previously visited pages.
-    totalText = soup.get_text()
-    crcHash = cyclic_redundancy_check(totalText)
-
-    # Reserve dict for this thread
-    with crawler.hashOfPagesLock:
-        # need to be str so the key lookup works
-        if str(crcHash) in crawler.hashOfPages:
-            #crawler.logger.warning(f"hash: {crcHash}  for url {resp.url} already visited")
-            return False
-        else:
-            crawler.hashOfPages[str(crcHash)] = True
-
-    # Check for near duplicates with simhashes
-    with crawler.simHashSetLock:
-        sim_hash = simHash(totalText)
-
-        # Maintain a reasonable queue of links to compare to
-        while len(crawler.simHashSet["Queue"]) > simHashQueueLength:
-                crawler.simHashSet["Queue"].pop(0)
-
-        
-        for sim in crawler.simHashSet["Queue"]:
-            if areSimilarSimHashes(sim_hash, sim, simHashThreshold):
-                #crawler.logger.warning(f"high similarity on {resp.url}")
-                return False
+    # checkSeen=False skips the already crawled check, for the page being scraped itself.
+    return bool(is_valid_many(crawler, [url], checkSeen))
+
+def is_valid_many(crawler : crawler, urls, checkSeen=True):
+    # The urls worth crawling, canonicalized, in one pass over the links of a
+    # page. The rules live in crawler.urlFilter (utils/url_filter.py).
+    with metrics.timer("filter"):
+        return _is_valid_many(crawler, urls, checkSeen)
+
+def _is_valid_many(crawler, urls, checkSeen):
+    seen = crawler.uniquePages
+    canonicalUrls = []
+    for url in urls:
+        if not url:
+            continue
+        url = canonicalize_url(url)
+        # Pages already crawled, ignoring their query so queries are not overloaded (no lock needed)
+        if checkSeen and url_id(url, ignoreQuery=True) in seen:
+            continue
+        canonicalUrls.append(url)
+    return crawler.urlFilter.is_valid_many(canonicalUrls)
+
+def checkDuplicate(crawler: crawler, analysis, resp):
+    # For exact duplicates, compare the fingerprint of the page to all previously visited pages.
+    if not crawler.pageFingerprints.add(analysis.fingerprint):
+        #crawler.logger.warning(f"fingerprint for url {resp.url} already visited")
+        return False
 
-        # Set the existance of the hash in the shelve
-        crawler.simHashSet["Queue"].append(sim_hash)
+    # Check for near duplicates with simhashes against every page crawled so far
+    if not crawler.simHashIndex.add(analysis.simHash):
+        #crawler.logger.warning(f"high similarity on {resp.url}")
+        return False
 
     return True
 
-def cyclic_redundancy_check(pageData):
-    
-    crcHash = 0xFFFF
-
-    # Convert page data into bytes and iterate
-    for byte in pageData.encode():
-
-        crcHash ^= byte # bitwise XOR
-
-        for _ in range(8): # 8 bits in a byte
-            if crcHash & 0x0001: # Check LSB 
-                crcHash = (crcHash >> 1) ^ 0xA001 # Polynomial divison process
-            else:
-                crcHash >>= 1 # Shift right by 1 bit to discard LSB
-
-    # Return compliment of hash
-    return crcHash ^ 0xFFFF
-
-def simHash(pageData):
-    # Seperate into words with weights
-    weightedWords = Counter(tokenize_text(pageData))
-
-    # Get 8-bit hash values for every unique word
-    hashValues = {word: bit_hash(word) for word in weightedWords}
-
-    # Calculate the Vector V by summing weights
-    simhash_value = [0] * 8
-
-    for word, count in weightedWords.items():
-        wordHash = hashValues[word]
-
-        for i in range(8):
-            # Offset hash digit by index of range, and multiply by 1 to get LSB
-            bit = (wordHash >> i) & 1
-            simhash_value[i] += (1 if bit else -1) * count
-    
-    # Convert into fingerprint
-    simhash_fingerprint = 0
-    for i in range(8):
-        if simhash_value[i] > 0:
-            simhash_fingerprint |= 1 << i
-    
-    return simhash_fingerprint
-
-def bit_hash(word):
-
-    # Function to generate an 8 bit hash for a word
-    hash = 0
-
-    for character in word:
-        # Add ASCII value to total hash
-        hash += ord(character)
-    
-    # Ensure hash value is 8 bits
-    return hash % 256
-
-def areSimilarSimHashes(firstSimHash, secondSimHash, threshold):
-    # Return true if two hashes are similar, else false
-
-    # Get number of different bits by XOR the two hashes, and count the occurances of 0 (similarities)
-    similarBits = bin(firstSimHash ^ secondSimHash).count('0')
-    # Calculate the similarity ratio
-    similarity = similarBits / 8
-
-    #if similarity >= threshold:
-    #    get_logger("CRAWLER").warning(f"simHash similarity: {similarity} already visited")
-
-    return similarity >= threshold
+def simHash(page):
+    # 64-bit simhash over 3-word shingles of the page text
+    return simhash64(page.tokens)
 
 def updateTokens(crawler : crawler, resp):
-    if resp.status == 200:
+    with metrics.timer("tokens"):
+        return _updateTokens(crawler, resp)
 
-        # Parse the page content using beautiful soup
-        soup = BeautifulSoup(resp.raw_response.content, 'html.parser')
+def _updateTokens(crawler, resp):
+    if resp.status == 200:
 
-        # Iterate and read through each <p> within the text content
-        text = ""
-        for paragraph in soup.find_all("p"):
-            text += paragraph.get_text() + " "
-        
-        # Take all text and tokenize it
-        text = tokenize_text(text)
+        # Reuse the analysis made for the links, the tokens of every <p>
+        # without stopwords are already counted
+        analysis = analyze_response(crawler, resp)
 
-        # remove stopwords and punctuation
-        tokens = [t for t in text if t not in stopWords]
-        
         # update record of longest webpage
-        with crawler.longestLock:
-            if(len(tokens) > crawler.longestFile["Longest"][1]):
-                crawler.logger.info(f"Updating longest with {len(tokens)} and url : {resp.url}")
-                crawler.longestFile["Longest"] = (resp.url, len(tokens))
-                crawler.longestFile.sync()
-            
+        if crawler.report.update_longest(resp.url, analysis.tokenCount):
+            crawler.logger.info(f"Updating longest with {analysis.tokenCount} and url : {resp.url}")
 
-        # build frequency dict
-        tokens = computeWordFrequencies(tokens)
-
-        with crawler.tokensLock:
-            # update counts of each token
-            for k,v in tokens.items():
-                if k in crawler.tokens:
-                    crawler.tokens[k] += v
-                else:
-                    crawler.tokens[k] = v
-            crawler.tokens.sync()
+        # update counts of each token, in this worker's own counts so there is no lock to wait on
+        crawler.tokenStats.add(analysis.tokenFrequencies)
     else:
         print(f"Failed to retrieve the web page. Status code: {resp.status}. Error code: {resp.error}.")
 
     # Just in case something goes wrong it doesn't freeze
     return []
 
-def tokenize_text(text):
-
-    tokens = []
-    current_token = []
+# A token is a run of at least 2 ASCII letters, digits, apostrophes or
+# dashes, lower cased. The text is not lower cased before matching: some
+# non ASCII letters lower case to ASCII ones (the Kelvin sign to k).
+tokenPattern = re.compile(r"[A-Za-z0-9'\-]{2,}")
 
-    # Iterate through text to tokenize words
-    for char in text:
-        if (char.isascii() and char.isalnum()) or (char == "'" or char == "-"): # Check for apostrophes or dashes
-                current_token.append(char)
-        else:
-            if current_token:
-                if len(current_token) > 1:
-                    tokens.append(''.join(current_token).lower())
-                current_token = []
-
-    # If there is still chars left in the token, append it to the list
-    if current_token:
-        if len(current_token) > 1:
-            tokens.append(''.join(current_token).lower())
-
-    return tokens
+def tokenize_text(text):
+    # The runs are found by the regex engine in C, and lower cased all at
+    # once; tokens never hold a space. Same tokens as the character loop
+    # this replaced, see benchmarks/tokenizer_benchmark.py.
+    tokens = tokenPattern.findall(text)
+    if not tokens:
+        return tokens
+    return " ".join(tokens).lower().split(" ")
 
 
-# Computing the word frequencies
-def computeWordFrequencies(TokenList : list) -> dict:
-    # returns map of tokens to counts
-    wordFrequencies = dict()
+def count_tokens(text, skip=stopWords):
+    # Token -> count of the tokens of text, without those in skip, in order
+    # of first appearance, counted in C and filtered once per distinct token
+    counts = Counter(tokenize_text(text))
+    for word in skip.intersection(counts):
+        del counts[word]
+    return dict(counts)
 
-    for t in TokenList:
-        if t in wordFrequencies.keys():
-            wordFrequencies[t] += 1
-        else:
-            wordFrequencies[t] = 1
-
-    return wordFrequencies
-    
 
 def updateSubDomains(crawler:crawler, url):
 
@@ -391,28 +282,19 @@ def updateSubDomains(crawler:crawler, url):
         normalURL = normalize(parsedURL.netloc).strip("www.")
 
     if "ics.uci.edu" in normalURL and "ics.uci.edu" != normalURL:
-        # reserve the ics domain lock
-        with crawler.icsSubDomainCountsLock:
-            # update count
-            if normalURL in crawler.icsSubDomainCounts:
-                crawler.icsSubDomainCounts[normalURL] += 1
-            else:
-                crawler.icsSubDomainCounts[normalURL] = 1
-
-            crawler.icsSubDomainCounts.sync()
+        # update count
+        crawler.report.add_subdomain(normalURL)
     
 
+def page_id(url):
+    # Id of a page for the unique pages count, without fragment or query
+    return url_id(canonicalize_url(url), ignoreQuery=True)
+
 def updateURLCount(crawler : crawler, url):
 
-    parsedURL = urlparse(url)
-    # Prevent queries being overloaded
-    noFragmentURL = normalize(parsedURL.scheme+parsedURL.netloc+parsedURL.path)
-
-    # Update the unique pages count without fragments
-    with crawler.uniquePagesLock:
-        if noFragmentURL not in crawler.uniquePages:
-            crawler.uniquePages[noFragmentURL] = True
-            crawler.uniquePages.sync()
+    # Update the unique pages count without fragments, and the list of unique pages
+    if crawler.uniquePages.add(page_id(url)):
+        crawler.report.add_page(canonicalize_url(url))
 
 
 def checkUniqueNetloc(crawler : crawler, url):
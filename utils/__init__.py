@@ -1,7 +1,7 @@
 import os
 import logging
-from hashlib import sha256
-from urllib.parse import urlparse
+from hashlib import sha256, blake2b
+from urllib.parse import urlparse, urlsplit, urlunsplit
 
 def get_logger(name, filename=None):
     logger = logging.getLogger(name)
@@ -33,3 +33,31 @@ def normalize(url):
     if url.endswith("/"):
         return url.rstrip("/")
     return url
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonicalize_url(url):
+    # The one normalization used for every url key of the crawler: lower case
+    # scheme and host, no default port, no fragment and no trailing slash
+    parsed = urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    try:
+        port = parsed.port
+        netloc = parsed.hostname or ""
+        if ":" in netloc:
+            netloc = f"[{netloc}]"
+        if port and DEFAULT_PORTS.get(scheme) != port:
+            netloc += f":{port}"
+    except ValueError:
+        # Invalid port, keep the authority as it is
+        netloc = parsed.netloc.lower()
+    return urlunsplit((scheme, netloc, parsed.path.rstrip("/"), parsed.query, ""))
+
+def url_id(canonicalUrl, ignoreQuery=False):
+    # 64-bit id of a canonical url, http and https share the same id like
+    # get_urlhash. ignoreQuery gives every query of a page the same id.
+    key = canonicalUrl.partition("://")[2]
+    if ignoreQuery:
+        key = key.partition("?")[0]
+    return int.from_bytes(blake2b(key.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
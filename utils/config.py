@@ -1,3 +1,4 @@
+import os
 import re
 
 
@@ -9,11 +10,65 @@ class Config(object):
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.commit_interval = float(config["LOCAL PROPERTIES"].get("COMMITINTERVAL", "1.0"))
+        self.commit_batch = int(config["LOCAL PROPERTIES"].get("COMMITBATCH", "1000"))
+        self.checkpoint_interval = float(config["LOCAL PROPERTIES"].get("CHECKPOINTINTERVAL", "60"))
+        self.seen_bloom_bits = int(config["LOCAL PROPERTIES"].get("SEENBLOOMBITS", "0"))
+        self.stats_flush_interval = float(config["LOCAL PROPERTIES"].get("STATSFLUSHINTERVAL", "30"))
+        self.metrics_file = config["LOCAL PROPERTIES"].get("METRICSFILE", "metrics.json").strip()
+        self.metrics_interval = float(config["LOCAL PROPERTIES"].get("METRICSINTERVAL", "10"))
+        self.metrics_port = int(config["LOCAL PROPERTIES"].get("METRICSPORT", "0"))
+        parseProcesses = config["LOCAL PROPERTIES"].get("PARSEPROCESSES", "").strip()
+        self.parse_processes = int(parseProcesses) if parseProcesses else default_parse_processes()
+        self.crawl_mode = config["LOCAL PROPERTIES"].get("MODE", "thread").strip().lower()
+        assert self.crawl_mode in ("thread", "async"), "MODE should be either thread or async"
+        self.async_concurrency = int(config["LOCAL PROPERTIES"].get("ASYNCCONCURRENCY", "200"))
+        self.heartbeat_interval = float(config["LOCAL PROPERTIES"].get("HEARTBEATINTERVAL", "1.0"))
+        self.forward_batch = int(config["LOCAL PROPERTIES"].get("FORWARDBATCH", "500"))
+        self.cluster_size = int(config["LOCAL PROPERTIES"].get("CLUSTERSIZE", "1"))
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.pool_size = int(config["CONNECTION"].get("POOLSIZE", "10"))
+        self.connect_timeout = float(config["CONNECTION"].get("CONNECTTIMEOUT", "5"))
+        self.read_timeout = float(config["CONNECTION"].get("READTIMEOUT", "30"))
+        self.retries = int(config["CONNECTION"].get("RETRIES", "3"))
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.parser = config["CRAWLER"].get("PARSER", "bs4").strip().lower()
+        self.domains = config["CRAWLER"].get(
+            "DOMAINS", "ics.uci.edu,cs.uci.edu,informatics.uci.edu,stat.uci.edu").split(",")
+        self.url_filter_cache = int(config["CRAWLER"].get("URLFILTERCACHE", "100000"))
+        self.robots_ttl = float(config["CRAWLER"].get("ROBOTSTTL", "86400"))
+        self.robots_cache_size = int(config["CRAWLER"].get("ROBOTSCACHESIZE", "1000"))
+        self.max_crawl_delay = float(config["CRAWLER"].get("MAXCRAWLDELAY", "60"))
+        self.sitemap_max_depth = int(config["CRAWLER"].get("SITEMAPMAXDEPTH", "2"))
+        self.sitemap_max_urls = int(config["CRAWLER"].get("SITEMAPMAXURLS", "50000"))
+        self.sitemap_batch = int(config["CRAWLER"].get("SITEMAPBATCH", "500"))
+        self.priority = config["CRAWLER"].get("PRIORITY", "depth:1, inlinks:1, coverage:1")
+        self.priority_aging = float(config["CRAWLER"].get("PRIORITYAGING", "300"))
+        self.low_info_links = config["CRAWLER"].get("LOWINFOLINKS", "drop").strip().lower()
+        assert self.low_info_links in ("drop", "queue"), "LOWINFOLINKS should be either drop or queue"
+        self.trap_min_fetches = int(config["CRAWLER"].get("TRAPMINFETCHES", "20"))
+        self.trap_throttle_yield = float(config["CRAWLER"].get("TRAPTHROTTLEYIELD", "0.3"))
+        self.trap_block_yield = float(config["CRAWLER"].get("TRAPBLOCKYIELD", "0.1"))
+        self.trap_throttle_rate = int(config["CRAWLER"].get("TRAPTHROTTLERATE", "4"))
+        self.recrawl_interval = float(config["CRAWLER"].get("RECRAWLINTERVAL", "86400"))
+        self.recrawl_min_interval = float(config["CRAWLER"].get("RECRAWLMININTERVAL", "3600"))
+        self.recrawl_max_interval = float(config["CRAWLER"].get("RECRAWLMAXINTERVAL", "2592000"))
 
-        self.cache_server = None
\ No newline at end of file
+        self.cache_server = None
+        # Set by launch.py --node, see crawler/cluster.py
+        self.node = None
+        self.coordinator = None
+        # Set by launch.py --recrawl, see utils/page_states.py
+        self.recrawl = False
+
+
+def default_parse_processes():
+    # The crawler process keeps about two cores busy fetching, updating its
+    # stores and pickling pages, parser processes only pay off on the cores
+    # left. With fewer than two of those, parsing stays on the worker threads.
+    spare = (os.cpu_count() or 1) - 2
+    return spare if spare >= 2 else 0
@@ -0,0 +1,125 @@
+import json
+import os
+import shelve
+import time
+
+from collections import Counter
+from threading import Thread, Lock, Event
+
+from utils.metrics import TimedLock
+from utils.token_stats import top_tokens
+
+
+class CrawlReport(object):
+    # The numbers of report.txt, kept up to date while the crawl runs: the
+    # unique pages (appended to pagesPath as they are found), the longest
+    # page, the ics subdomain counts, from tokenStats the number of tokens
+    # and the topTokens most common ones, and the url templates blocked as
+    # traps by the TrapDetector traps. Every flushInterval seconds
+    # they are written, all together, to a small snapshot that report.py
+    # reads, so a report takes the same time whatever the size of the crawl
+    # and can be made while workers keep writing.
+    def __init__(self, path, pagesPath, tokenStats, robots=None, traps=None, pageCount=0,
+                 flushInterval=30.0, topTokens=50):
+        self.path = path
+        self.pagesPath = pagesPath
+        self.tokenStats = tokenStats
+        self.robots = robots
+        self.traps = traps
+        self.flushInterval = flushInterval
+        self.topTokens = topTokens
+
+        self.lock = TimedLock("report")
+        self.flushLock = Lock()
+        self.pageCount = pageCount
+        self.longest = ("", 0)
+        self.subDomains = Counter()
+        if os.path.exists(path):
+            snapshot = read_report(path)
+            self.longest = tuple(snapshot["longest"])
+            self.subDomains.update(snapshot["subDomains"])
+        self.pages = open(pagesPath, "a", encoding="utf-8")
+
+        self.stopped = Event()
+        self.flusher = Thread(target=self._flush_loop, name="CrawlReport", daemon=True)
+        self.flusher.start()
+
+    def add_page(self, url):
+        # url is a page crawled for the first time
+        with self.lock:
+            self.pages.write(url + "\n")
+            self.pageCount += 1
+
+    def update_longest(self, url, tokenCount):
+        # Returns True if url is the new longest page
+        with self.lock:
+            if tokenCount > self.longest[1]:
+                self.longest = (url, tokenCount)
+                return True
+        return False
+
+    def add_subdomain(self, subDomain):
+        with self.lock:
+            self.subDomains[subDomain] += 1
+
+    def import_shelves(self, longestPath, subDomainsPath):
+        # Moves the longest page and subdomain counts of the old shelves in
+        with shelve.open(longestPath) as longest:
+            if "Longest" in longest:
+                url, tokenCount = longest["Longest"]
+                self.update_longest(url, tokenCount)
+        with shelve.open(subDomainsPath) as subDomains:
+            with self.lock:
+                self.subDomains.update(dict(subDomains.items()))
+        self.flush()
+
+    def snapshot(self):
+        # Everything report.txt needs, taken at one point of the crawl. The
+        # pages file is flushed first, so its first pageCount lines are the
+        # unique pages counted here.
+        with self.lock:
+            self.pages.flush()
+            snapshot = {
+                "time": time.time(), "pageCount": self.pageCount,
+                "longest": self.longest, "subDomains": dict(self.subDomains)}
+        words, totals = self.tokenStats.totals()
+        snapshot["tokenCount"] = sum(1 for count in totals if count)
+        snapshot["topTokens"] = top_tokens(words, totals, self.topTokens)
+        snapshot["robotCount"] = len(self.robots) if self.robots is not None else 0
+        snapshot["blockedTemplates"] = self.traps.blocked() if self.traps is not None else []
+        return snapshot
+
+    def flush(self):
+        with self.flushLock:
+            write_report(self.path, self.snapshot())
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def clear(self):
+        with self.lock:
+            self.pages.truncate(0)
+            self.pageCount = 0
+            self.longest = ("", 0)
+            self.subDomains.clear()
+        self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+        self.pages.close()
+
+
+def read_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_report(path, snapshot):
+    # Written to a temporary file and swapped in, readers always see a whole snapshot
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmpPath, path)
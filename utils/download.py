@@ -1,26 +1,147 @@
 import requests
 import cbor
 import time
+import asyncio
+import threading
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from utils.response import Response
 import ssl 
 
+try:
+    import aiohttp
+except ImportError:
+    # The asyncio crawl mode falls back to running download in a thread
+    aiohttp = None
 
-def download(url, config, logger=None):
-    # need a check for one of the xml files doesn't have a valid certificate
-    # possible security risk but >:)
-    ssl._create_default_https_context = ssl._create_unverified_context
+# need a check for one of the xml files doesn't have a valid certificate
+# possible security risk but >:)
+ssl._create_default_https_context = ssl._create_unverified_context
+
+# Time spent opening new connections by the current thread, see _TimedConnection
+_connectTime = threading.local()
+
+
+class _TimedConnection(HTTPConnection):
+    # Connections are opened lazily on the thread that sends the request,
+    # so a thread local is enough to attribute the connect time to a fetch
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connectTime.seconds = getattr(_connectTime, "seconds", 0) + time.perf_counter() - start
+
+
+class _TimedConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedConnectionPool, "https": HTTPSConnectionPool}
+
+
+def make_session(config):
+    # One keep-alive session to the cache server, shared by every worker of a
+    # Crawler. requests sessions are safe to share between threads for plain
+    # GETs, the adapter keeps up to POOLSIZE open connections.
+    retries = Retry(
+        total=config.retries, backoff_factor=0.5,
+        status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+    adapter = _PooledAdapter(
+        pool_connections=1, pool_maxsize=config.pool_size,
+        max_retries=retries, pool_block=True)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download(url, config, logger=None, session=None):
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")], allow_redirects=True)
+    http = session if session is not None else requests
+    _connectTime.seconds = 0
+    start = time.perf_counter()
+    try:
+        # stream so the wait for the headers and the body transfer can be timed apart
+        resp = http.get(
+            f"http://{host}:{port}/",
+            params=[("q", f"{url}"), ("u", f"{config.user_agent}")], allow_redirects=True,
+            timeout=(config.connect_timeout, config.read_timeout), stream=True)
+        headersAt = time.perf_counter()
+        content = resp.content
+    except requests.RequestException as e:
+        if logger:
+            logger.error(f"Failed to reach the cache server for {url}: {e}")
+        return Response({"error": f"Cache server request failed: {e}", "status": None, "url": url})
+    end = time.perf_counter()
+    timing = {
+        "connect": _connectTime.seconds,
+        "wait": headersAt - start - _connectTime.seconds,
+        "transfer": end - headersAt,
+        "total": end - start}
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+        if resp and content:
+            response = Response(cbor.loads(content))
+            response.timing = timing
+            return response
     except (EOFError, ValueError) as e:
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    if logger:
+        logger.error(f"Spacetime Response error {resp} with url {url}.")
     return Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
         "status": resp.status_code,
         "url": url})
+
+
+def async_session(config):
+    # One aiohttp session is shared by every coroutine of the event loop
+    if aiohttp is None:
+        return None
+    connector = aiohttp.TCPConnector(limit=config.async_concurrency)
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=config.connect_timeout, sock_read=config.read_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def async_download(url, config, logger=None, session=None):
+    # Same request and Response as download, but awaited on the event loop
+    if session is None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, download, url, config, logger)
+
+    host, port = config.cache_server
+    start = time.perf_counter()
+    try:
+        async with session.get(
+                f"http://{host}:{port}/",
+                params=[("q", f"{url}"), ("u", f"{config.user_agent}")], allow_redirects=True) as resp:
+            headersAt = time.perf_counter()
+            content = await resp.read()
+            status = resp.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if logger:
+            logger.error(f"Failed to reach the cache server for {url}: {e}")
+        return Response({"error": f"Cache server request failed: {e}", "status": None, "url": url})
+    end = time.perf_counter()
+    try:
+        if content:
+            response = Response(cbor.loads(content))
+            # aiohttp does not report connection setup separately
+            response.timing = {
+                "connect": 0, "wait": headersAt - start,
+                "transfer": end - headersAt, "total": end - start}
+            return response
+    except (EOFError, ValueError) as e:
+        pass
+    if logger:
+        logger.error(f"Spacetime Response error {status} with url {url}.")
+    return Response({
+        "error": f"Spacetime Response error {status} with url {url}.",
+        "status": status,
+        "url": url})
@@ -0,0 +1,317 @@
+import os
+import time
+
+from array import array
+from collections import Counter
+from hashlib import blake2b
+from threading import Lock
+
+from utils.metrics import TimedLock
+from utils.seen_set import read_table_snapshot, write_table_snapshot
+
+
+def normalize_text(text):
+    # Pages that only differ by whitespace are the same page
+    return " ".join(text.split())
+
+
+def content_fingerprint(text):
+    # 64-bit fingerprint of the normalized page text. blake2b runs in C, so
+    # this costs a fraction of the old per-bit CRC16 loop, and with 64 bits
+    # a collision between two different pages is practically impossible.
+    digest = blake2b(normalize_text(text).encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def body_fingerprint(content):
+    # 64-bit fingerprint of the bytes of a page, to tell whether it changed
+    # since it was last fetched without parsing it
+    return int.from_bytes(blake2b(content, digest_size=8).digest(), "little")
+
+
+class FingerprintIndex(object):
+    # Set of the fingerprints of every page seen so far. It lives in memory
+    # and is kept on disk as a flat array of 8 byte integers, instead of a
+    # shelve key per page: the fingerprints added since the last flush are
+    # appended to it every flushEvery additions or flushInterval seconds,
+    # without holding the lock the duplicate checks take.
+    def __init__(self, path, flushEvery=500, flushInterval=30.0):
+        self.path = path
+        self.flushEvery = flushEvery
+        self.flushInterval = flushInterval
+        self.lock = TimedLock("fingerprints")
+        self.flushLock = Lock()
+        self.fingerprints = set()
+        self.unsaved = array("Q")
+        self.lastFlush = time.monotonic()
+        self.fingerprints.update(read_uint64s(path))
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.fingerprints
+
+    def add(self, fingerprint):
+        # Returns False if the fingerprint was already in the index
+        with self.lock:
+            if fingerprint in self.fingerprints:
+                return False
+            self.fingerprints.add(fingerprint)
+            self.unsaved.append(fingerprint)
+            due = (len(self.unsaved) >= self.flushEvery
+                   or time.monotonic() - self.lastFlush >= self.flushInterval)
+        if due:
+            self.flush()
+        return True
+
+    def flush(self):
+        # flushLock keeps the appends in order, the lock is only held to
+        # take the fingerprints to append
+        with self.flushLock:
+            with self.lock:
+                unsaved, self.unsaved = self.unsaved, array("Q")
+                self.lastFlush = time.monotonic()
+            if unsaved:
+                append_uint64s(self.path, unsaved)
+
+    def clear(self):
+        with self.flushLock:
+            with self.lock:
+                self.fingerprints.clear()
+                self.unsaved = array("Q")
+            write_uint64s(self.path, [])
+
+
+def read_uint64s(path):
+    values = array("Q")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        # An append cut short by a crash leaves a partial value at the end,
+        # it is cut off so the next appends stay aligned
+        goodBytes = len(data) - len(data) % values.itemsize
+        values.frombytes(data[:goodBytes])
+        if goodBytes != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(goodBytes)
+    return values
+
+
+def write_uint64s(path, values):
+    # Write to a temporary file and swap it in, a crash never leaves a
+    # half written file behind
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        array("Q", values).tofile(f)
+    os.replace(tmpPath, path)
+
+
+def append_uint64s(path, values):
+    with open(path, "ab") as f:
+        array("Q", values).tofile(f)
+
+
+# Byte values that have bit b set, used to turn per byte weights into per bit weights
+_BYTES_WITH_BIT = [[value for value in range(256) if value >> bit & 1] for bit in range(8)]
+
+
+def simhash64(tokens, shingleSize=3):
+    # 64-bit SimHash (Charikar) of a page over shingles of shingleSize
+    # consecutive tokens, each weighted by how often it appears. Pages with
+    # a few changed words end up a few bits apart.
+    if len(tokens) < shingleSize:
+        shingles = Counter(tokens)
+    else:
+        shingles = Counter(
+            " ".join(tokens[i:i + shingleSize]) for i in range(len(tokens) - shingleSize + 1))
+    if not shingles:
+        return 0
+
+    # Sum the weights per byte value of each of the 8 hash bytes first, that
+    # is 8 additions per shingle instead of 64 bit tests
+    byteWeights = [[0] * 256 for _ in range(8)]
+    for shingle, weight in shingles.items():
+        digest = blake2b(shingle.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+        for position, value in enumerate(digest):
+            byteWeights[position][value] += weight
+
+    totalWeight = sum(shingles.values())
+    fingerprint = 0
+    for position in range(8):
+        weights = byteWeights[position]
+        for bit in range(8):
+            # Weight of the shingles with this bit set minus of those without it
+            setWeight = sum(weights[value] for value in _BYTES_WITH_BIT[bit])
+            if 2 * setWeight > totalWeight:
+                fingerprint |= 1 << (position * 8 + bit)
+    return fingerprint
+
+
+class SimHashIndex(object):
+    # Answers "is any stored fingerprint within maxDistance bits of this one"
+    # without comparing against every page (Manku et al., Detecting
+    # near-duplicates for web crawling). The 64 bits are split into
+    # maxDistance + 1 blocks; two fingerprints that are at most maxDistance
+    # bits apart agree exactly on at least one block. Table i is the set of
+    # fingerprints permuted so that block i leads, i.e. grouped by the value
+    # of block i, so a lookup only compares against the fingerprints sharing
+    # one of its blocks. Fingerprints are stored in flat 8 byte arrays, and
+    # those added since the last flush are appended to the file like in
+    # FingerprintIndex.
+    #
+    # Filling the tables costs a dict lookup per block and fingerprint, so
+    # close() also writes them to path + ".tables" with a digest of the
+    # fingerprints they hold. On start they are loaded back a bucket at a
+    # time when the digest matches the start of the file, and only the
+    # fingerprints appended after them are inserted one by one.
+    def __init__(self, path, maxDistance=3, flushEvery=500, flushInterval=30.0):
+        self.path = path
+        self.tablesPath = path + ".tables"
+        self.maxDistance = maxDistance
+        self.flushEvery = flushEvery
+        self.flushInterval = flushInterval
+        self.lock = TimedLock("simhash")
+        self.flushLock = Lock()
+
+        blockCount = maxDistance + 1
+        self.blocks = []
+        start = 0
+        for block in range(blockCount):
+            width = 64 // blockCount + (1 if block < 64 % blockCount else 0)
+            self.blocks.append((start, (1 << width) - 1))
+            start += width
+        self.tables = [dict() for _ in self.blocks]
+        self.fingerprints = array("Q")
+
+        self.lastFlush = time.monotonic()
+        fingerprints = read_uint64s(path)
+        snapshot = read_table_snapshot(self.tablesPath)
+        if snapshot is not None and self._snapshot_matches(snapshot[0], fingerprints):
+            self._load_tables(*snapshot)
+            self.fingerprints = fingerprints[:snapshot[0]["count"]]
+        for fingerprint in fingerprints[len(self.fingerprints):]:
+            self._insert(fingerprint)
+        # fingerprints[saved:] are not in the file yet
+        self.saved = len(self.fingerprints)
+
+    def _snapshot_matches(self, header, fingerprints):
+        count = header["count"]
+        return (header.get("maxDistance") == self.maxDistance and count <= len(fingerprints)
+                and header.get("digest") == _digest(fingerprints[:count])
+                and header["tableBytes"] == sum(16 * keys + 8 * count for keys in header["keyCounts"]))
+
+    def _load_tables(self, header, data):
+        # Each table is its keys, the size of their buckets, then the buckets
+        # one after the other
+        count = header["count"]
+        offset = 0
+        self.tables = []
+        for keyCount in header["keyCounts"]:
+            keys = array("Q", data[offset:offset + 8 * keyCount])
+            offset += 8 * keyCount
+            sizes = array("Q", data[offset:offset + 8 * keyCount])
+            offset += 8 * keyCount
+            values = array("Q", data[offset:offset + 8 * count])
+            offset += 8 * count
+            table = dict()
+            start = 0
+            for key, size in zip(keys, sizes):
+                table[key] = values[start:start + size]
+                start += size
+            self.tables.append(table)
+
+    def _dump_tables(self):
+        # Caller holds the lock
+        parts = []
+        for table in self.tables:
+            parts.append(array("Q", table.keys()).tobytes())
+            parts.append(array("Q", map(len, table.values())).tobytes())
+            parts.extend(bucket.tobytes() for bucket in table.values())
+        return b"".join(parts), [len(table) for table in self.tables]
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def _insert(self, fingerprint):
+        self.fingerprints.append(fingerprint)
+        for (shift, mask), table in zip(self.blocks, self.tables):
+            key = (fingerprint >> shift) & mask
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = bucket = array("Q")
+            bucket.append(fingerprint)
+
+    def find_near(self, fingerprint):
+        # Returns a stored fingerprint within maxDistance bits, or None
+        for (shift, mask), table in zip(self.blocks, self.tables):
+            bucket = table.get((fingerprint >> shift) & mask)
+            if bucket is None:
+                continue
+            for candidate in bucket:
+                if (candidate ^ fingerprint).bit_count() <= self.maxDistance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint):
+        # Stores the fingerprint unless a near duplicate is already stored,
+        # returns False in that case
+        with self.lock:
+            if self.find_near(fingerprint) is not None:
+                return False
+            self._insert(fingerprint)
+            due = (len(self.fingerprints) - self.saved >= self.flushEvery
+                   or time.monotonic() - self.lastFlush >= self.flushInterval)
+        if due:
+            self.flush()
+        return True
+
+    def flush(self):
+        with self.flushLock:
+            with self.lock:
+                unsaved = self.fingerprints[self.saved:]
+                self.saved = len(self.fingerprints)
+                self.lastFlush = time.monotonic()
+            if unsaved:
+                append_uint64s(self.path, unsaved)
+
+    def close(self):
+        # Flush, then write the tables for the next start
+        with self.flushLock:
+            with self.lock:
+                unsaved = self.fingerprints[self.saved:]
+                self.saved = len(self.fingerprints)
+                data, keyCounts = self._dump_tables()
+                header = {"maxDistance": self.maxDistance, "keyCounts": keyCounts,
+                          "digest": _digest(self.fingerprints)}
+                count = len(self.fingerprints)
+            if unsaved:
+                append_uint64s(self.path, unsaved)
+            write_table_snapshot(self.tablesPath, data, count, header)
+
+    def clear(self):
+        with self.flushLock:
+            with self.lock:
+                self.tables = [dict() for _ in self.blocks]
+                self.fingerprints = array("Q")
+                self.saved = 0
+            write_uint64s(self.path, [])
+            if os.path.exists(self.tablesPath):
+                os.remove(self.tablesPath)
+
+
+def _digest(fingerprints):
+    # Tells whether a tables snapshot was written for these fingerprints
+    return blake2b(fingerprints.tobytes(), digest_size=16).hexdigest()
+
+
+def drop_legacy_shelve(shelvePath, reason, logger=None):
+    # Remove a shelve the crawler no longer reads, with every file dbm may
+    # have created for it
+    removed = False
+    for suffix in ("", ".dat", ".dir", ".bak", ".db"):
+        if os.path.exists(shelvePath + suffix):
+            os.remove(shelvePath + suffix)
+            removed = True
+    if removed and logger:
+        logger.info(f"Dropped {shelvePath}: {reason}")
@@ -0,0 +1,225 @@
+import json
+import os
+import time
+
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, Event, local
+
+# Upper bounds, in seconds, of the latency histogram buckets: 1 microsecond
+# doubling up to about 9 minutes, and one more bucket for anything longer
+BUCKET_BOUNDS = [1e-6 * 2 ** i for i in range(30)]
+
+
+class _Shard(object):
+    # The counters and histograms of one thread, only that thread writes them
+    def __init__(self):
+        self.counters = dict()
+        # name -> [bucket counts..., total seconds, max seconds]
+        self.histograms = dict()
+
+
+class Metrics(object):
+    # Counters and latency histograms of the crawl. Like TokenStats, every
+    # thread records into its own shard, so recording never takes a lock
+    # and costs a dict lookup and a bisect; snapshot() adds the shards up.
+    def __init__(self):
+        self.started = time.time()
+        self.shardsLock = Lock()
+        self.shards = list()
+        self.threadShard = local()
+
+    def _shard(self):
+        shard = getattr(self.threadShard, "shard", None)
+        if shard is None:
+            shard = self.threadShard.shard = _Shard()
+            with self.shardsLock:
+                self.shards.append(shard)
+        return shard
+
+    def count(self, name, amount=1):
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        histograms = self._shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = [0] * (len(BUCKET_BOUNDS) + 1) + [0.0, 0.0]
+        histogram[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        histogram[-2] += seconds
+        if seconds > histogram[-1]:
+            histogram[-1] = seconds
+
+    def timer(self, name):
+        # with metrics.timer("parse"): ... observes the time spent inside
+        return _Timer(self, name)
+
+    def snapshot(self):
+        # Everything recorded so far, as plain data. Copying a dict or a
+        # list is atomic, the threads keep recording while this runs.
+        with self.shardsLock:
+            shards = list(self.shards)
+        counters = dict()
+        histograms = dict()
+        for shard in shards:
+            for name, value in dict(shard.counters).items():
+                counters[name] = counters.get(name, 0) + value
+            for name, histogram in dict(shard.histograms).items():
+                histogram = list(histogram)
+                merged = histograms.get(name)
+                if merged is None:
+                    histograms[name] = histogram
+                    continue
+                for index in range(len(histogram) - 1):
+                    merged[index] += histogram[index]
+                merged[-1] = max(merged[-1], histogram[-1])
+        return {
+            "time": time.time(), "uptime": time.time() - self.started,
+            "counters": dict(sorted(counters.items())),
+            "latencies": {name: summarize(histogram) for name, histogram in sorted(histograms.items())}}
+
+
+class _Timer(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+def summarize(histogram):
+    # Count, total, mean, max and percentiles (the upper bound of the bucket
+    # they fall in) of a histogram
+    buckets = histogram[:-2]
+    count = sum(buckets)
+    summary = {
+        "count": count, "total": histogram[-2],
+        "mean": histogram[-2] / count if count else 0.0, "max": histogram[-1]}
+    for percentile in (50, 90, 99):
+        wanted = count * percentile / 100
+        seen = 0
+        for index, bucketCount in enumerate(buckets):
+            seen += bucketCount
+            if bucketCount and seen >= wanted:
+                break
+        bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else histogram[-1]
+        summary[f"p{percentile}"] = min(bound, histogram[-1])
+    return summary
+
+
+class TimedLock(object):
+    # A Lock that records how long acquiring it had to wait as the latency
+    # "lock.<name>", and how often it was taken as the counter of that name.
+    # Taking it uncontended only costs one non blocking acquire more.
+    def __init__(self, name, metrics=None):
+        self.lock = Lock()
+        self.name = f"lock.{name}"
+        self.metrics = metrics if metrics else get_metrics()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self.metrics.count(self.name)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        if acquired:
+            self.metrics.count(self.name)
+            self.metrics.observe(self.name, time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    # The metrics of this process, shared like the loggers of get_logger
+    return _metrics
+
+
+class MetricsReporter(object):
+    # Publishes the metrics while the crawl runs: written to path every
+    # interval seconds (and when closed), and served as JSON on
+    # http://127.0.0.1:<port>/metrics when port is not 0.
+    def __init__(self, metrics, path, interval=10.0, port=0, logger=None):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.logger = logger
+        self.server = None
+        if port:
+            try:
+                self.server = _make_server(metrics, ("127.0.0.1", port))
+            except OSError as e:
+                if logger:
+                    logger.warning(f"Could not serve metrics on port {port}: {e}")
+            else:
+                Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True).start()
+                if logger:
+                    logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+        self.stopped = Event()
+        self.writer = Thread(target=self._write_loop, name="MetricsWriter", daemon=True)
+        self.writer.start()
+
+    def _write_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        # Swapped in whole, like the report snapshot
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w", encoding="utf-8") as f:
+            json.dump(self.metrics.snapshot(), f)
+        os.replace(tmpPath, self.path)
+
+    def close(self):
+        self.stopped.set()
+        self.writer.join()
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def _make_server(metrics, address):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = json.dumps(metrics.snapshot(), indent=1).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(address, Handler)
+    server.daemon_threads = True
+    return server
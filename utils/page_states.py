@@ -0,0 +1,201 @@
+import json
+import os
+import time
+
+from threading import Thread, Lock, Event
+
+from utils import canonicalize_url, url_id
+from utils.fingerprint import body_fingerprint
+from utils.metrics import TimedLock
+
+# What update() found out about a fetched page
+NEW, CHANGED, UNCHANGED = "new", "changed", "unchanged"
+
+
+class PageStates(object):
+    # What the crawler remembers of every page it fetched, for re-crawls:
+    # its ETag and Last-Modified headers, a fingerprint of its bytes, when
+    # it was fetched and how long to wait before fetching it again. That
+    # interval starts at interval seconds, is halved (down to minInterval)
+    # every time the page is found changed and doubled (up to maxInterval)
+    # every time it is not, so pages are revisited about as often as they
+    # change. Kept in memory; the pages updated since the last flush are
+    # appended to a log every flushInterval seconds, and the log is
+    # compacted to one record per page once it holds mostly stale records,
+    # like the frontier save file.
+    def __init__(self, path, interval=86400.0, minInterval=3600.0, maxInterval=2592000.0,
+                 flushInterval=30.0, compactRatio=3, compactMinimum=10000):
+        self.path = path
+        self.interval = interval
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.flushInterval = flushInterval
+        self.compactRatio = compactRatio
+        self.compactMinimum = compactMinimum
+
+        self.lock = TimedLock("page_states")
+        self.flushLock = Lock()
+        # url id -> [url id, url, etag, last modified, fingerprint, fetched at,
+        # interval], the record of its last update
+        self.pages = dict()
+        # Records not in the log yet, those of updates and [url id] for removals
+        self.unsaved = list()
+        self.logRecords = 0
+        self._replay()
+
+        self.stopped = Event()
+        self.flusher = Thread(target=self._flush_loop, name="PageStates", daemon=True)
+        self.flusher.start()
+
+    def _replay(self):
+        # The log is parsed a megabyte of records at a time, as one JSON array,
+        # which is a few times faster than a json.loads per record
+        if not os.path.exists(self.path):
+            return
+        goodBytes = 0
+        with open(self.path, "rb") as f:
+            while True:
+                lines = f.readlines(1 << 20)
+                if not lines:
+                    break
+                try:
+                    records = json.loads(b"[" + b",".join(lines) + b"]")
+                    torn = not lines[-1].endswith(b"\n")
+                except ValueError:
+                    torn = True
+                if torn:
+                    # A record torn by a crash, everything before it is good
+                    records = []
+                    for line in lines:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            break
+                        if not line.endswith(b"\n"):
+                            records.pop()
+                            break
+                    lines = lines[:len(records)]
+                for record in records:
+                    self._apply(record)
+                self.logRecords += len(records)
+                goodBytes += sum(len(line) for line in lines)
+                if torn:
+                    break
+        if goodBytes != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(goodBytes)
+
+    def _apply(self, record):
+        if len(record) == 1:
+            self.pages.pop(record[0], None)
+        else:
+            self.pages[record[0]] = record
+
+    def __len__(self):
+        return len(self.pages)
+
+    def update(self, url, headers, content, now=None):
+        # Records a fetch of url and returns NEW, CHANGED or UNCHANGED. The
+        # validators are compared first, the bytes are only hashed when they
+        # do not settle it.
+        url = canonicalize_url(url)
+        urlId = url_id(url)
+        now = time.time() if now is None else now
+        etag = headers.get("ETag")
+        lastModified = headers.get("Last-Modified")
+        with self.lock:
+            page = self.pages.get(urlId)
+        if page is None:
+            state = NEW
+            fingerprint = body_fingerprint(content)
+            interval = self.interval
+        elif (etag and etag == page[2]) or (not etag and lastModified and lastModified == page[3]):
+            state = UNCHANGED
+            fingerprint = page[4]
+        else:
+            fingerprint = body_fingerprint(content)
+            state = UNCHANGED if fingerprint == page[4] else CHANGED
+        if page is not None:
+            if state == UNCHANGED:
+                interval = min(page[6] * 2, self.maxInterval)
+            else:
+                interval = max(page[6] / 2, self.minInterval)
+        record = [urlId, url, etag, lastModified, fingerprint, now, interval]
+        with self.lock:
+            self._apply(record)
+            self.unsaved.append(record)
+        return state
+
+    def remove(self, url):
+        # A page that is gone is not revisited anymore
+        urlId = url_id(canonicalize_url(url))
+        with self.lock:
+            if urlId in self.pages:
+                self._apply([urlId])
+                self.unsaved.append([urlId])
+
+    def due(self, now=None):
+        # Urls of the pages to fetch again, the oldest first. A page is due
+        # once less than a tenth of its interval is left, so a page on a one
+        # day interval is still due on a nightly run started a bit early.
+        now = time.time() if now is None else now
+        with self.lock:
+            pages = list(self.pages.values())
+        due = [page for page in pages if page[5] + page[6] * 0.9 <= now]
+        due.sort(key=lambda page: page[5])
+        return [page[1] for page in due]
+
+    def flush(self):
+        # Only the lists are swapped under the lock, the records are written
+        # out without it; flushLock keeps the appends and compactions in order
+        with self.flushLock:
+            with self.lock:
+                unsaved, self.unsaved = self.unsaved, list()
+            if unsaved:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(record) + "\n" for record in unsaved))
+                self.logRecords += len(unsaved)
+            if self.logRecords > max(self.compactMinimum, self.compactRatio * len(self.pages)):
+                self._compact()
+
+    def _compact(self):
+        # Caller holds flushLock. Rewrites the log from a copy of the pages
+        # and swaps it in. Records made after the copy are in it as well as
+        # in unsaved, appending them again later leaves the same state.
+        with self.lock:
+            pages = list(self.pages.values())
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w", encoding="utf-8") as f:
+            for page in pages:
+                f.write(json.dumps(page) + "\n")
+        os.replace(tmpPath, self.path)
+        self.logRecords = len(pages)
+
+    def import_snapshot(self, snapshotPath):
+        # Moves the pages of the former pageStates.json snapshot in
+        with open(snapshotPath, "r", encoding="utf-8") as f:
+            pages = json.load(f)["pages"]
+        with self.lock:
+            for page in pages:
+                record = [url_id(page[0])] + page
+                self._apply(record)
+                self.unsaved.append(record)
+        self.flush()
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def clear(self):
+        with self.flushLock:
+            with self.lock:
+                self.pages.clear()
+                self.unsaved = list()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.logRecords = 0
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
@@ -0,0 +1,147 @@
+from collections import Counter
+from io import BytesIO
+
+from bs4 import BeautifulSoup, NavigableString, CData, Tag
+
+try:
+    from lxml import etree
+    from lxml import html as lxmlHtml
+except ImportError:
+    etree = None
+
+# html.parser gives the strings inside these tags their own string classes,
+# so get_text() leaves them out. Both backends skip them the same way.
+HIDDEN_TEXT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+
+
+class Bs4Parser(object):
+    # The original BeautifulSoup backend, html.parser for pages and the bs4
+    # xml builder for sitemaps.
+    name = "bs4"
+
+    def parse_html(self, content):
+        # Returns (text, paragraphText, links, tagCounts) for scraper.ParsedPage
+        soup = BeautifulSoup(content, 'html.parser')
+        textParts = []
+        paragraphs = []
+        anchorLinks = []
+        urlLinks = []
+        tagCounts = Counter()
+
+        for element in soup.descendants:
+            if isinstance(element, Tag):
+                tagCounts[element.name] += 1
+                if element.name == 'a':
+                    anchorLinks.append(element.get('href'))
+                elif element.name == 'url':
+                    urlLinks.append(element.get('href'))
+                elif element.name == 'p':
+                    paragraphs.append(element)
+            # get_text only keeps plain strings, not comments, scripts or styles
+            elif type(element) is NavigableString or type(element) is CData:
+                textParts.append(element)
+
+        paragraphText = "".join(paragraph.get_text() + " " for paragraph in paragraphs)
+        return "".join(textParts), paragraphText, anchorLinks + urlLinks, tagCounts
+
+    def iter_sitemap(self, content):
+        # Yields ("url", loc) for every page and ("sitemap", loc) for every
+        # nested sitemap. content is bytes or a binary file object.
+        if hasattr(content, "read"):
+            content = content.read()
+        soup = BeautifulSoup(content, "xml")
+        for link in soup.find_all("url"):
+            loc = link.find("loc")
+            if loc:
+                yield "url", loc.text.strip()
+        for nested in soup.find_all("sitemap"):
+            loc = nested.find("loc")
+            if loc:
+                yield "sitemap", loc.text.strip()
+
+
+class LxmlParser(object):
+    # libxml2 backend, several times faster than html.parser. Sitemaps are
+    # streamed with iterparse and every element is freed once it is read.
+    name = "lxml"
+
+    def parse_html(self, content):
+        try:
+            root = lxmlHtml.document_fromstring(content)
+        except (etree.ParserError, ValueError):
+            # Empty or whitespace only documents
+            return "", "", [], Counter()
+
+        textParts = []
+        paragraphs = []
+        anchorLinks = []
+        urlLinks = []
+        tagCounts = Counter()
+        hiddenDepth = 0
+
+        def add_text(text):
+            textParts.append(text)
+            for paragraph in paragraphs:
+                if paragraph[1]:
+                    paragraph[0].append(text)
+
+        for event, element in etree.iterwalk(root, events=("start", "end")):
+            isTag = isinstance(element.tag, str)
+            if event == "start":
+                if not isTag:
+                    continue
+                tagCounts[element.tag] += 1
+                if element.tag == 'a':
+                    anchorLinks.append(element.get('href'))
+                elif element.tag == 'url':
+                    urlLinks.append(element.get('href'))
+                elif element.tag == 'p':
+                    # [text parts, still open]
+                    paragraphs.append([[], True])
+                if element.tag in HIDDEN_TEXT_TAGS:
+                    hiddenDepth += 1
+                if element.text and not hiddenDepth:
+                    add_text(element.text)
+            else:
+                if isTag:
+                    if element.tag in HIDDEN_TEXT_TAGS:
+                        hiddenDepth -= 1
+                    if element.tag == 'p':
+                        for paragraph in reversed(paragraphs):
+                            if paragraph[1]:
+                                paragraph[1] = False
+                                break
+                # The tail belongs to the parent, comments only keep their tail
+                if element.tail and not hiddenDepth:
+                    add_text(element.tail)
+
+        paragraphText = "".join("".join(parts) + " " for parts, _ in paragraphs)
+        return "".join(textParts), paragraphText, anchorLinks + urlLinks, tagCounts
+
+    def iter_sitemap(self, content):
+        stream = content if hasattr(content, "read") else BytesIO(content)
+        events = etree.iterparse(
+            stream, events=("end",), tag=("{*}url", "{*}sitemap"), recover=True)
+        for _, element in events:
+            loc = element.findtext("{*}loc")
+            if loc:
+                yield etree.QName(element).localname, loc.strip()
+            # Free what has been read so memory stays flat on huge sitemaps
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+PARSERS = {Bs4Parser.name: Bs4Parser, LxmlParser.name: LxmlParser}
+
+
+def get_parser(name, logger=None):
+    # Returns the parser backend named in config.ini, falling back to bs4
+    # when lxml is not installed
+    if name not in PARSERS:
+        raise ValueError(f"Unknown parser {name}, expected one of {', '.join(PARSERS)}")
+    if name == LxmlParser.name and etree is None:
+        if logger:
+            logger.warning("lxml is not installed, falling back to the bs4 parser")
+        name = Bs4Parser.name
+    return PARSERS[name]()
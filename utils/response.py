@@ -1,14 +1,46 @@
 import pickle
 
 class Response(object):
+    # A cache server answer. url, status and error are read from the cbor
+    # map right away; the pickled requests.Response is only loaded the first
+    # time raw_response (or content, headers) is used, so pages dropped
+    # because of their status never pay for it, and in the asyncio mode it
+    # is loaded by the parsing threads instead of the event loop. The pickle
+    # is released as soon as it is loaded.
     def __init__(self, resp_dict):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        # Seconds spent in connect, wait (for the headers) and transfer, set by download
+        self.timing = None
+        self._pickled = resp_dict["response"] if "response" in resp_dict else None
+        self._raw = None
+
+    @property
+    def raw_response(self):
+        if self._pickled is not None:
+            pickled, self._pickled = self._pickled, None
+            try:
+                self._raw = pickle.loads(pickled)
+            except (TypeError, pickle.UnpicklingError):
+                self._raw = None
+        return self._raw
+
+    @property
+    def content(self):
+        # The body of the page, the bytes held by raw_response (no copy),
+        # b"" when there is none
+        raw = self.raw_response
+        if raw is None or raw.content is None:
+            return b""
+        return raw.content
+
+    @property
+    def view(self):
+        # content as a memoryview, to slice or decode parts without copies
+        return memoryview(self.content)
+
+    @property
+    def headers(self):
+        raw = self.raw_response
+        return raw.headers if raw is not None else {}
@@ -0,0 +1,225 @@
+import re
+import shelve
+import time
+
+from collections import OrderedDict
+from threading import Event
+from urllib.parse import urlparse, quote, unquote
+
+from utils.download import download
+from utils.metrics import TimedLock
+
+# Google and RFC 9309 only read the first 500 KiB of a robots.txt
+MAX_ROBOTS_BYTES = 500 * 1024
+
+# Characters left alone when percent-encoding paths and patterns, so both
+# sides are compared in the same form
+_SAFE_CHARACTERS = "/?&=;:@+,$*!~'()%"
+
+
+def _normalize_path(path):
+    return quote(unquote(path), safe=_SAFE_CHARACTERS)
+
+
+class RobotRules(object):
+    # The rules of one robots.txt that apply to our user agent. The most
+    # specific (longest) matching pattern wins and Allow wins ties, as in
+    # RFC 9309. Patterns without wildcards are plain prefix checks, the
+    # others are compiled to a regular expression once.
+    def __init__(self, rules=(), crawlDelay=None, sitemaps=(), fetched=None, unreachable=False):
+        # rules: (pattern, allow) pairs. unreachable: the robots.txt could not
+        # be downloaded, everything is allowed until it is tried again.
+        self.rules = [(pattern, allow) for pattern, allow in rules]
+        self.crawlDelay = crawlDelay
+        self.sitemaps = list(sitemaps)
+        self.fetched = fetched if fetched is not None else time.time()
+        self.unreachable = unreachable
+
+        self.matchers = []
+        ordered = sorted(self.rules, key=lambda rule: (-len(rule[0]), not rule[1]))
+        for pattern, allow in ordered:
+            if "*" in pattern or pattern.endswith("$"):
+                regex = re.escape(pattern).replace(r"\*", ".*")
+                if regex.endswith(r"\$"):
+                    regex = regex[:-2] + "$"
+                self.matchers.append((re.compile(regex).match, allow))
+            else:
+                self.matchers.append((pattern, allow))
+
+    def can_fetch(self, url):
+        parsed = urlparse(url)
+        path = _normalize_path(parsed.path or "/")
+        if parsed.query:
+            path += "?" + parsed.query
+        for matcher, allow in self.matchers:
+            if isinstance(matcher, str):
+                if path.startswith(matcher):
+                    return allow
+            elif matcher(path):
+                return allow
+        return True
+
+    def to_dict(self):
+        # What is persisted, plain data instead of a pickled parser
+        return {
+            "rules": self.rules, "crawlDelay": self.crawlDelay,
+            "sitemaps": self.sitemaps, "fetched": self.fetched, "unreachable": self.unreachable}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["rules"], data["crawlDelay"], data["sitemaps"], data["fetched"], data["unreachable"])
+
+
+def parse_robots(text, userAgent):
+    # Returns the RobotRules of the group for userAgent, or of the * group.
+    # Like urllib.robotparser, a group applies when its name is part of the
+    # product token of our user agent.
+    agentToken = userAgent.split("/")[0].lower()
+    groups = []
+    sitemaps = []
+    agents, rules, delay = [], [], None
+    inRules = False
+
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if ":" not in line:
+            continue
+        field, value = line.split(":", 1)
+        field, value = field.strip().lower(), value.strip()
+        if field == "sitemap":
+            if value:
+                sitemaps.append(value)
+        elif field == "user-agent":
+            if inRules:
+                groups.append((agents, rules, delay))
+                agents, rules, delay = [], [], None
+                inRules = False
+            agents.append(value.lower())
+        elif field in ("allow", "disallow"):
+            inRules = True
+            # An empty Disallow allows everything, it adds no rule
+            if value:
+                rules.append((_normalize_path(value), field == "allow"))
+        elif field == "crawl-delay":
+            inRules = True
+            try:
+                delay = float(value)
+            except ValueError:
+                pass
+    if agents:
+        groups.append((agents, rules, delay))
+
+    chosen = None
+    for agents, rules, delay in groups:
+        if any(agent != "*" and agent in agentToken for agent in agents):
+            chosen = (rules, delay)
+            break
+        if chosen is None and "*" in agents:
+            chosen = (rules, delay)
+    if chosen is None:
+        return RobotRules(sitemaps=sitemaps)
+    return RobotRules(chosen[0], chosen[1], sitemaps)
+
+
+class RobotsCache(object):
+    # robots.txt rules per site (scheme and host). Each robots.txt is
+    # downloaded through the cache server once, by whichever worker needs it
+    # first; other workers needing the same site wait for that download
+    # instead of starting their own, and workers on other sites never wait.
+    # The most recently used rules stay compiled in memory, all of them are
+    # kept as plain data in a shelve, and they are downloaded again after ttl
+    # seconds. Unreachable robots.txt files allow everything and are retried
+    # after errorTtl seconds.
+    def __init__(self, config, path, session=None, logger=None,
+                 capacity=1000, ttl=86400, errorTtl=600):
+        self.config = config
+        self.session = session
+        self.logger = logger
+        self.capacity = capacity
+        self.ttl = ttl
+        self.errorTtl = errorTtl
+
+        self.lock = TimedLock("robots")
+        self.compiled = OrderedDict()
+        self.fetching = dict()
+        self.stored = shelve.open(path)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.stored)
+
+    def can_fetch(self, url):
+        return self.lookup(url)[0].can_fetch(url)
+
+    def lookup(self, url):
+        # Returns (rules, downloaded), downloaded is True when this call
+        # fetched the robots.txt, which counts as a request to the host
+        parsed = urlparse(url)
+        site = f"{parsed.scheme}://{parsed.netloc.lower()}"
+        while True:
+            with self.lock:
+                rules = self._cached(site)
+                if rules is not None:
+                    return rules, False
+                done = self.fetching.get(site)
+                if done is None:
+                    done = self.fetching[site] = Event()
+                    break
+            done.wait()
+
+        rules = None
+        try:
+            rules = self._download(site)
+        finally:
+            with self.lock:
+                if rules is not None:
+                    self._remember(site, rules)
+                    self.stored[site] = rules.to_dict()
+                del self.fetching[site]
+            done.set()
+        return rules, True
+
+    def _cached(self, site):
+        # Caller holds the lock
+        rules = self.compiled.get(site)
+        if rules is None and site in self.stored:
+            rules = RobotRules.from_dict(self.stored[site])
+            self._remember(site, rules)
+        if rules is None:
+            return None
+        ttl = self.errorTtl if rules.unreachable else self.ttl
+        if time.time() > rules.fetched + ttl:
+            del self.compiled[site]
+            return None
+        self.compiled.move_to_end(site)
+        return rules
+
+    def _remember(self, site, rules):
+        # Caller holds the lock
+        self.compiled[site] = rules
+        self.compiled.move_to_end(site)
+        while len(self.compiled) > self.capacity:
+            self.compiled.popitem(last=False)
+
+    def _download(self, site):
+        resp = download(site + "/robots.txt", self.config, self.logger, self.session)
+        if resp.status == 200 and resp.raw_response is not None:
+            # Decoded straight from the response, without copying the bytes first
+            text = str(resp.view[:MAX_ROBOTS_BYTES], "utf-8", "replace")
+            return parse_robots(text, self.config.user_agent)
+        if resp.status is not None and 400 <= resp.status < 500:
+            # No robots.txt, everything is allowed
+            return RobotRules()
+        if self.logger:
+            self.logger.info(f"Could not get {site}/robots.txt <{resp.status}>, allowing everything for now.")
+        return RobotRules(unreachable=True)
+
+    def clear(self):
+        with self.lock:
+            self.compiled.clear()
+            self.stored.clear()
+
+    def close(self):
+        with self.lock:
+            self.stored.close()
@@ -0,0 +1,179 @@
+import json
+import os
+
+from array import array
+from threading import Lock
+
+
+class BloomFilter(object):
+    # Bit array answering "definitely not added" without touching the table.
+    # The bit positions come from the two halves of the 64-bit id
+    # (Kirsch-Mitzenmacher double hashing), the ids are already hashes.
+    def __init__(self, capacity, bitsPerItem=10):
+        self.size = max(64, capacity * bitsPerItem)
+        self.hashCount = max(1, round(bitsPerItem * 0.693))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        first = key & 0xFFFFFFFF
+        second = (key >> 32) | 1
+        return [(first + i * second) % self.size for i in range(self.hashCount)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SeenSet(object):
+    # Set of 64-bit url ids in one open addressing table (linear probing) of
+    # 8 byte slots. The table grows by half once it is 3/4 full, so it costs
+    # between 10.7 and 16 bytes per url, instead of the ~60 of a Python set
+    # of ints or the 64 character sha256 keys of a shelve. Membership checks
+    # take no lock: they read one (table, size) pair that add only ever
+    # replaces as a whole. Adds are serialized by a lock.
+    MAX_LOAD = 0.75
+
+    def __init__(self, capacity=1024, bloomBitsPerItem=0):
+        self.bloomBitsPerItem = bloomBitsPerItem
+        self.lock = Lock()
+        self.count = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        size = int(capacity / self.MAX_LOAD) + 1
+        self.state = (array("Q", bytes(8 * size)), size)
+        self.bloom = BloomFilter(capacity, self.bloomBitsPerItem) if self.bloomBitsPerItem else None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, urlId):
+        key = urlId or 1  # 0 marks an empty slot
+        bloom = self.bloom
+        if bloom is not None and key not in bloom:
+            return False
+        table, size = self.state
+        slot = key % size
+        while True:
+            value = table[slot]
+            if value == key:
+                return True
+            if not value:
+                return False
+            slot += 1
+            if slot == size:
+                slot = 0
+
+    def _insert(self, key):
+        # Caller holds the lock. Returns False if present.
+        table, size = self.state
+        slot = key % size
+        while True:
+            value = table[slot]
+            if value == key:
+                return False
+            if not value:
+                break
+            slot += 1
+            if slot == size:
+                slot = 0
+        if self.bloom is not None:
+            self.bloom.add(key)
+        table[slot] = key
+        self.count += 1
+        if self.count > self.MAX_LOAD * size:
+            self._grow()
+        return True
+
+    def _grow(self):
+        # Build the bigger table aside and swap it in, readers keep using the
+        # old one until then. Both blooms hold every id, so a reader mixing
+        # the new bloom with the old table only misses the newest ids.
+        table, _ = self.state
+        capacity = self.count * 3 // 2
+        newSize = int(capacity / self.MAX_LOAD) + 1
+        newTable = array("Q", bytes(8 * newSize))
+        newBloom = BloomFilter(capacity, self.bloomBitsPerItem) if self.bloomBitsPerItem else None
+        for key in table:
+            if key:
+                slot = key % newSize
+                while newTable[slot]:
+                    slot += 1
+                    if slot == newSize:
+                        slot = 0
+                newTable[slot] = key
+                if newBloom is not None:
+                    newBloom.add(key)
+        self.bloom = newBloom
+        self.state = (newTable, newSize)
+
+    def add(self, urlId):
+        # Returns True if the id was not in the set yet
+        key = urlId or 1
+        with self.lock:
+            return self._insert(key)
+
+    def __iter__(self):
+        table, _ = self.state
+        return (key for key in table if key)
+
+    def table(self):
+        # (bytes of the table, number of ids) as they are now, for a snapshot
+        with self.lock:
+            table, _ = self.state
+            return table.tobytes(), self.count
+
+    def load_table(self, data, count):
+        # Replaces the contents with a table saved by table(), as is: no id
+        # is hashed or inserted again, only the Bloom filter is rebuilt
+        table = array("Q")
+        table.frombytes(data)
+        bloom = None
+        if self.bloomBitsPerItem:
+            bloom = BloomFilter(int(len(table) * self.MAX_LOAD), self.bloomBitsPerItem)
+            for key in table:
+                if key:
+                    bloom.add(key)
+        with self.lock:
+            self.bloom = bloom
+            self.state = (table, len(table))
+            self.count = count
+
+    def clear(self):
+        with self.lock:
+            self._allocate(1024)
+
+
+def write_table_snapshot(path, table, count, header):
+    # One line of JSON, header with the size of the table added, then a
+    # table from SeenSet.table(). Written aside and swapped in.
+    header = dict(header, count=count, tableBytes=len(table))
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(table)
+    os.replace(tmpPath, path)
+
+
+def read_table_snapshot(path):
+    # Returns (header, table bytes) of a snapshot, None if it is missing or
+    # cut short. SeenSet.load_table takes the table and header["count"].
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+        data = f.read()
+    if len(data) != header.get("tableBytes"):
+        return None
+    return header, data
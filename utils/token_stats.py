@@ -0,0 +1,144 @@
+import json
+import heapq
+import os
+import shelve
+import time
+
+from array import array
+from threading import Thread, Lock, Event, local
+
+
+class TokenStats(object):
+    # Word frequencies of the whole crawl kept in memory. Every token gets an
+    # integer id, and every worker thread counts into its own array indexed
+    # by id, so counting a page never waits on other workers. A background
+    # thread sums the arrays and writes a snapshot every flushInterval
+    # seconds; report.py reads the snapshot instead of the old tokens shelve.
+    def __init__(self, path, flushInterval=30.0):
+        self.path = path
+        self.flushInterval = flushInterval
+
+        self.ids = dict()
+        self.words = list()
+        self.vocabularyLock = Lock()
+
+        # Counts from previous runs, then one array per worker thread
+        self.baseCounts = array("q")
+        self.accumulators = list()
+        self.threadCounts = local()
+        self.flushLock = Lock()
+
+        if os.path.exists(path):
+            words, counts = read_snapshot(path)
+            for word in words:
+                self._intern(word)
+            self.baseCounts.extend(counts)
+
+        self.stopped = Event()
+        self.flusher = Thread(target=self._flush_loop, name="TokenStats", daemon=True)
+        self.flusher.start()
+
+    def _intern(self, word):
+        # Returns the id of a word, giving it the next id when it is new
+        wordId = self.ids.get(word)
+        if wordId is None:
+            with self.vocabularyLock:
+                wordId = self.ids.get(word)
+                if wordId is None:
+                    wordId = len(self.words)
+                    self.words.append(word)
+                    self.ids[word] = wordId
+        return wordId
+
+    def _counts(self):
+        counts = getattr(self.threadCounts, "counts", None)
+        if counts is None:
+            counts = self.threadCounts.counts = array("q")
+            with self.vocabularyLock:
+                self.accumulators.append(counts)
+        return counts
+
+    def add(self, frequencies):
+        # frequencies: token -> count for one page
+        counts = self._counts()
+        for word, count in frequencies.items():
+            wordId = self._intern(word)
+            if wordId >= len(counts):
+                counts.extend([0] * (wordId + 1 - len(counts) + 1024))
+            counts[wordId] += count
+
+    def totals(self):
+        # Sum of the base counts and every worker's counts. Copying an array
+        # is atomic, so workers keep counting while this runs.
+        with self.vocabularyLock:
+            words = list(self.words)
+            accumulators = list(self.accumulators)
+        totals = array("q", self.baseCounts)
+        totals.extend([0] * (len(words) - len(totals)))
+        for counts in accumulators:
+            counts = counts[:len(words)]
+            for wordId, count in enumerate(counts):
+                if count:
+                    totals[wordId] += count
+        return words, totals
+
+    def __len__(self):
+        return sum(1 for count in self.totals()[1] if count)
+
+    def most_common(self, n):
+        # The n most frequent tokens as (token, count), ties broken alphabetically
+        words, totals = self.totals()
+        return top_tokens(words, totals, n)
+
+    def flush(self):
+        with self.flushLock:
+            words, totals = self.totals()
+            write_snapshot(self.path, words, totals)
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def clear(self):
+        with self.vocabularyLock:
+            self.baseCounts = array("q")
+            for counts in self.accumulators:
+                for wordId in range(len(counts)):
+                    counts[wordId] = 0
+        self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+
+    def import_shelve(self, shelvePath):
+        # Moves the counts of the old tokens shelve into the stats
+        with shelve.open(shelvePath) as tokens:
+            for word, count in tokens.items():
+                wordId = self._intern(word)
+                if wordId >= len(self.baseCounts):
+                    self.baseCounts.extend([0] * (wordId + 1 - len(self.baseCounts)))
+                self.baseCounts[wordId] += count
+        self.flush()
+
+
+def top_tokens(words, counts, n):
+    best = heapq.nsmallest(
+        n, (wordId for wordId in range(len(counts)) if counts[wordId]),
+        key=lambda wordId: (-counts[wordId], words[wordId]))
+    return [(words[wordId], counts[wordId]) for wordId in best]
+
+
+def read_snapshot(path):
+    with open(path, "r", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    return snapshot["words"], snapshot["counts"]
+
+
+def write_snapshot(path, words, counts):
+    # Written to a temporary file and swapped in, readers always see a whole snapshot
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w", encoding="utf-8") as f:
+        json.dump({"time": time.time(), "words": words, "counts": list(counts)}, f)
+    os.replace(tmpPath, path)
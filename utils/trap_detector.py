@@ -0,0 +1,162 @@
+import json
+import os
+import time
+
+from threading import Thread, Lock, Event
+from urllib.parse import urlparse, parse_qsl
+
+from utils.metrics import get_metrics, TimedLock
+
+# The yield of a template is the share of novel pages among its last
+# YIELD_WINDOW fetches (all of them until there are that many)
+YIELD_WINDOW = 50
+
+THROTTLED, BLOCKED = "throttled", "blocked"
+
+
+def url_template(url):
+    # Groups the urls of a host that are siblings: the directories of the
+    # path, those with digits (dates, ids) as {n}, the last segment as * and
+    # the names of the query parameters, so /events/2024-01-03 and
+    # /wiki/Page?action=history&oldid=12 give host/events/* and
+    # host/wiki/*?action&oldid. Top level pages have no directory to tell
+    # them apart, so there the last segment is kept the same way: /about
+    # and /contact are templates of their own, that a few thin pages cannot
+    # block for the whole host, while /2024-01-03 and /2024-01-04 share
+    # host/{n}.
+    parsed = urlparse(url)
+    segments = parsed.path.split("/")[1:]
+    directories = segments[:-1] or segments
+    template = "/".join(
+        "{n}" if any(char.isdigit() for char in directory) else directory.lower()
+        for directory in directories)
+    if len(segments) > 1:
+        template = f"{parsed.hostname}/{template}/*"
+    else:
+        template = f"{parsed.hostname}/{template}"
+    if parsed.query:
+        names = sorted({name.lower() for name, _ in parse_qsl(parsed.query, keep_blank_values=True)})
+        template += "?" + "&".join(names)
+    return template
+
+
+class TrapDetector(object):
+    # Calendars, wiki revisions and faceted searches are endless urls of a
+    # few templates that keep giving the same content. For every template
+    # (see url_template) this counts the urls found and dropped, the pages
+    # fetched and its yield, the share of those pages that were new content
+    # (not a duplicate nor low information). Once a template has been
+    # fetched minFetches times, new urls of it are throttled, only one in
+    # throttleRate is queued, while its yield is below throttleYield, and
+    # once it is below blockYield the template is blocked for good: none of
+    # its urls are queued or fetched anymore. Kept in memory, written as a
+    # snapshot every flushInterval seconds like the token counts.
+    def __init__(self, path, minFetches=20, throttleYield=0.3, blockYield=0.1, throttleRate=4,
+                 flushInterval=30.0, logger=None):
+        self.path = path
+        self.minFetches = minFetches
+        self.throttleYield = throttleYield
+        self.blockYield = blockYield
+        self.throttleRate = throttleRate
+        self.flushInterval = flushInterval
+        self.logger = logger
+        self.metrics = get_metrics()
+
+        self.lock = TimedLock("traps")
+        self.flushLock = Lock()
+        # template -> [urls found, urls dropped, pages fetched, yield, state]
+        self.templates = dict()
+        self.dirty = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.templates.update(json.load(f)["templates"])
+
+        self.stopped = Event()
+        self.flusher = Thread(target=self._flush_loop, name="TrapDetector", daemon=True)
+        self.flusher.start()
+
+    def _stats(self, template):
+        # Caller holds the lock
+        stats = self.templates.get(template)
+        if stats is None:
+            stats = self.templates[template] = [0, 0, 0, 1.0, None]
+        return stats
+
+    def admit_many(self, urls):
+        # The urls worth queueing: none of a blocked template, one in
+        # throttleRate of a throttled one
+        admitted = []
+        with self.lock:
+            for url in urls:
+                stats = self._stats(url_template(url))
+                stats[0] += 1
+                if stats[4] == BLOCKED or (stats[4] == THROTTLED and stats[0] % self.throttleRate):
+                    stats[1] += 1
+                    continue
+                admitted.append(url)
+            self.dirty = True
+        if len(admitted) < len(urls):
+            self.metrics.count("traps.dropped", len(urls) - len(admitted))
+        return admitted
+
+    def is_blocked(self, url):
+        with self.lock:
+            stats = self.templates.get(url_template(url))
+            return stats is not None and stats[4] == BLOCKED
+
+    def record(self, url, novel):
+        # A page of url was fetched, novel if it was new content
+        template = url_template(url)
+        with self.lock:
+            stats = self._stats(template)
+            stats[2] += 1
+            stats[3] += ((1.0 if novel else 0.0) - stats[3]) / min(stats[2], YIELD_WINDOW)
+            state = stats[4]
+            if stats[2] >= self.minFetches:
+                if stats[3] < self.blockYield:
+                    stats[4] = BLOCKED
+                elif stats[3] < self.throttleYield:
+                    stats[4] = THROTTLED
+                else:
+                    stats[4] = None
+            changed = stats[4] != state
+            self.dirty = True
+        if changed and self.logger:
+            self.logger.warning(
+                f"Url template {template} is now {stats[4] or 'allowed'}, "
+                f"yield {stats[3]:.2f} over {stats[2]} pages.")
+
+    def blocked(self):
+        # (template, pages fetched, yield, urls dropped) of every blocked template
+        with self.lock:
+            return sorted(
+                (template, stats[2], round(stats[3], 3), stats[1])
+                for template, stats in self.templates.items() if stats[4] == BLOCKED)
+
+    def flush(self):
+        with self.flushLock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                templates = {template: list(stats) for template, stats in self.templates.items()}
+                self.dirty = False
+            # Swapped in whole, like the token snapshot
+            tmpPath = self.path + ".tmp"
+            with open(tmpPath, "w", encoding="utf-8") as f:
+                json.dump({"time": time.time(), "templates": templates}, f)
+            os.replace(tmpPath, self.path)
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+            self.dirty = True
+        self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
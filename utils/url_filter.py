@@ -0,0 +1,100 @@
+import re
+
+from collections import Counter
+from functools import lru_cache
+from threading import Lock
+from urllib.parse import urlparse
+
+# Files that are not web pages, by extension or by a path segment named
+# after one (/pdf/file_name is a bad link too)
+NON_PAGE_EXTENSIONS = frozenset((
+    "css js bmp gif jpg jpeg ico png tif tiff mid mp2 mp3 mp4 wav avi mov mpeg ram m4v mkv "
+    "ogg ogv pdf ps eps tex ppt pptx doc docx xls xlsx names data dat exe bz2 tar msi bin 7z "
+    "psd dmg iso epub dll cnf tgz sha1 thmx mso arff rtf jar csv rm smil wmv swf wma zip rar gz"
+).split())
+
+# (rule name, pattern searched in the whole url)
+TRAP_PATTERNS = (
+    # Calendar entries
+    ("calendar", r"\d{4}-\d{2}-\d{2}"),
+    # The same path segment twice in a row
+    ("repeated path", r"/([^/]+)/\1(?:/|\?|$)"),
+)
+
+_END = None
+
+
+class UrlFilter(object):
+    # Decides which urls are worth crawling, compiled once from config.ini.
+    # Allowed domains are a trie of reversed host labels, so a host is
+    # checked in one walk of its labels whatever the number of domains, and
+    # extensions are a set lookup. Decisions are cached per canonical url
+    # and every rule counts the urls it rejected.
+    def __init__(self, domains, extensions=NON_PAGE_EXTENSIONS, trapPatterns=TRAP_PATTERNS, cacheSize=100000):
+        self.domains = dict()
+        for domain in domains:
+            node = self.domains
+            for label in reversed(domain.strip().lower().strip(".").split(".")):
+                node = node.setdefault(label, dict())
+            node[_END] = True
+        self.extensions = frozenset(extension.lower() for extension in extensions)
+        self.trapPatterns = [(name, re.compile(pattern).search) for name, pattern in trapPatterns]
+
+        self.ruleHits = Counter()
+        self.hitsLock = Lock()
+        self._decide = lru_cache(maxsize=cacheSize)(self._check)
+
+    def in_domains(self, host):
+        # True if host is one of the domains or a subdomain of one
+        node = self.domains
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+    def _check(self, url):
+        # Returns the name of the rule rejecting url, or None if it is valid
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https"):
+            rule = "scheme"
+        elif not parsed.hostname or not self.in_domains(parsed.hostname):
+            rule = "domain"
+        else:
+            rule = None
+            for segment in parsed.path.lower().split("/"):
+                if segment.rpartition(".")[2] in self.extensions:
+                    rule = "extension"
+                    break
+            if rule is None:
+                for name, search in self.trapPatterns:
+                    if search(url):
+                        rule = name
+                        break
+        with self.hitsLock:
+            self.ruleHits[rule or "valid"] += 1
+        return rule
+
+    def rejecting_rule(self, url):
+        # url must already be canonical, see utils.canonicalize_url
+        return self._decide(url)
+
+    def is_valid(self, url):
+        return self._decide(url) is None
+
+    def is_valid_many(self, urls):
+        # Canonical urls that pass the filter, in order
+        decide = self._decide
+        return [url for url in urls if decide(url) is None]
+
+    def stats(self):
+        # Urls rejected per rule (and valid ones) among the decisions made,
+        # plus the use of the decision cache
+        cache = self._decide.cache_info()
+        with self.hitsLock:
+            stats = dict(self.ruleHits)
+        stats["cache hits"] = cache.hits
+        stats["cache misses"] = cache.misses
+        return stats